@@ -1,12 +1,15 @@
 import json
-import os
 from typing import Dict, Any
+from instrumentation import instrumented
+from security import issue_token, not_configured, password_matches, record_failure, throttle
 
+@instrumented('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Simple password authentication for admin panel
-    Args: event with httpMethod, body containing password
-    Returns: HTTP response with authentication result
+    Business: Password authentication for admin panel, issuing a short-lived signed
+              token for the admin functions; repeated attempts per IP are throttled
+    Args: event with httpMethod, body containing password, requestContext with source IP
+    Returns: HTTP response with authentication result and token, or 429 when throttled
     '''
     method: str = event.get('httpMethod', 'POST')
     
@@ -29,19 +32,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
+    throttled = throttle(event)
+    if throttled:
+        return throttled
+    
+    unavailable = not_configured('ADMIN_PASSWORD', 'ADMIN_TOKEN_SECRET')
+    if unavailable:
+        return unavailable
+    
     body = json.loads(event.get('body', '{}'))
     password = body.get('password', '')
     
-    admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
-    
-    if password == admin_password:
+    if password_matches(password):
+        token, expires_at = issue_token()
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'success': True, 'message': 'Authentication successful'})
+            'body': json.dumps({
+                'success': True,
+                'message': 'Authentication successful',
+                'token': token,
+                'expiresAt': expires_at
+            })
         }
     else:
+        record_failure(event)
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,190 @@
+import functools
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# psycopg2 is imported lazily: the auth function has no database dependency
+
+# Opt-in slow-query log: statements slower than this many milliseconds are logged with EXPLAIN
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+# Log statements with their bound values and unredacted plans; local tooling only, values hold customer data
+SLOW_QUERY_LOG_VALUES = os.environ.get('SLOW_QUERY_LOG_VALUES') == '1'
+EXPLAINABLE_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+QUOTED_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+class RequestMetrics:
+    '''Timings and SQL counters collected while one request is handled'''
+    
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.statements = 0
+        self.rows = 0
+        self.slow_queries: List[Dict[str, Any]] = []
+    
+    def add_timing(self, name: str, seconds: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds * 1000
+    
+    def record_query(self, seconds: float, rowcount: int) -> None:
+        self.statements += 1
+        self.rows += max(rowcount, 0)
+        self.add_timing('db', seconds)
+    
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def server_timing(self, total_ms: float) -> str:
+        parts = [f'{name};dur={duration:.1f}' for name, duration in self.timings.items()]
+        parts.append(f'total;dur={total_ms:.1f};desc="{self.statements} statements, {self.rows} rows"')
+        return ', '.join(parts)
+
+
+# A function instance handles one request at a time, so module state is per request
+_current: Optional[RequestMetrics] = None
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    '''Add the duration of the block to the current request under name'''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _current is not None:
+            _current.add_timing(name, time.perf_counter() - started)
+
+
+def _explain(cursor: Any, query: bytes) -> Optional[str]:
+    import psycopg2
+    import psycopg2.extensions
+    
+    # A failing EXPLAIN must not abort the request transaction
+    plain = psycopg2.extensions.cursor(cursor.connection)
+    try:
+        plain.execute('SAVEPOINT slow_query_explain')
+        try:
+            plain.execute(b'EXPLAIN ' + query)
+            plan = '\n'.join(row[0] for row in plain.fetchall())
+            plain.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        except psycopg2.Error:
+            plain.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return None
+    finally:
+        plain.close()
+
+
+def _logged_statement(cursor: Any, template: Any, query_vars: Any) -> str:
+    '''
+    The statement as passed to execute, without bound values; statements built
+    with values inlined (execute_values) get their quoted literals masked
+    '''
+    if isinstance(template, bytes):
+        text = template.decode(errors='replace')
+    elif isinstance(template, str):
+        text = template
+    else:
+        text = template.as_string(cursor)
+    return text if query_vars is not None else QUOTED_LITERAL.sub("'?'", text)
+
+
+def _record_execute(cursor: Any, started: float, template: Any, query_vars: Any, succeeded: bool) -> None:
+    if _current is None:
+        return
+    seconds = time.perf_counter() - started
+    _current.record_query(seconds, cursor.rowcount if succeeded else 0)
+    
+    # After a failed statement the transaction is aborted, so there is nothing to EXPLAIN
+    if succeeded and SLOW_QUERY_MS is not None and seconds * 1000 >= SLOW_QUERY_MS and cursor.query:
+        query = cursor.query if isinstance(cursor.query, bytes) else cursor.query.encode()
+        bound = query.decode(errors='replace')
+        plan = None
+        if cursor.name is None and bound.lstrip().upper().startswith(EXPLAINABLE_PREFIXES):
+            plan = _explain(cursor, query)
+        if SLOW_QUERY_LOG_VALUES:
+            statement = bound
+        else:
+            statement = _logged_statement(cursor, template, query_vars)
+            # Plans show the bound values in their conditions
+            plan = plan and QUOTED_LITERAL.sub("'?'", plan)
+        _current.slow_queries.append({'durationMs': round(seconds * 1000, 1), 'statement': statement, 'plan': plan})
+
+
+_instrumented_cursor_classes: Dict[type, type] = {}
+
+
+def instrumented_cursor_class(base: type) -> type:
+    '''Subclass of a psycopg2 cursor class that reports every execute to the request metrics'''
+    if base not in _instrumented_cursor_classes:
+        def execute(self: Any, query: Any, query_vars: Any = None) -> Any:
+            started = time.perf_counter()
+            try:
+                result = base.execute(self, query, query_vars)
+            except BaseException:
+                _record_execute(self, started, query, query_vars, False)
+                raise
+            _record_execute(self, started, query, query_vars, True)
+            return result
+        
+        _instrumented_cursor_classes[base] = type('Instrumented' + base.__name__, (base,), {'execute': execute})
+    return _instrumented_cursor_classes[base]
+
+
+_connection_class: Optional[type] = None
+
+
+def connection_factory() -> type:
+    '''psycopg2 connection class whose cursors, of any cursor_factory, are instrumented'''
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+        
+        class InstrumentedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args: Any, **kwargs: Any) -> Any:
+                base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs['cursor_factory'] = instrumented_cursor_class(base)
+                return super().cursor(*args, **kwargs)
+        
+        _connection_class = InstrumentedConnection
+    return _connection_class
+
+
+def instrumented(function_name: str) -> Callable:
+    '''
+    Business: Wrap a function handler to report per-request timings
+    Adds a Server-Timing header and prints one JSON log line keyed by request_id
+    '''
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            global _current
+            metrics = RequestMetrics()
+            _current = metrics
+            response: Dict[str, Any] = {'statusCode': 500}
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                _current = None
+                total_ms = metrics.total_ms()
+                if isinstance(response.get('headers'), dict):
+                    response['headers']['Server-Timing'] = metrics.server_timing(total_ms)
+                    response['headers']['Timing-Allow-Origin'] = '*'
+                print(json.dumps({
+                    'requestId': getattr(context, 'request_id', None),
+                    'function': function_name,
+                    'method': event.get('httpMethod'),
+                    'statusCode': response.get('statusCode'),
+                    'totalMs': round(total_ms, 1),
+                    'timingsMs': {name: round(value, 1) for name, value in metrics.timings.items()},
+                    'statements': metrics.statements,
+                    'rows': metrics.rows,
+                    'slowQueries': metrics.slow_queries,
+                }, ensure_ascii=False))
+        
+        return wrapper
+    return decorator
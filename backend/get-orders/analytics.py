@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from rollups import CANCELLED_STATUSES
+
+TOP_PERFUMES_LIMIT = 10
+
+
+def query_analytics(cursor, date_from: Optional[datetime], date_to: Optional[datetime]) -> Dict[str, Any]:
+    '''
+    Business: Dashboard metrics read from the daily rollups instead of raw orders
+    Args: date range is half-open by day: date_from <= day < date_to
+    Returns: revenue per day, orders by status, top perfumes by quantity and totals
+    '''
+    conditions = []
+    values: List[Any] = []
+    if date_from:
+        conditions.append('day >= %s')
+        values.append(date_from.date())
+    if date_to:
+        conditions.append('day < %s')
+        values.append(date_to.date())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    active = f"{'AND' if conditions else 'WHERE'} status <> ALL(%s)"
+    
+    cursor.execute(f'''
+        SELECT day, SUM(orders_count), SUM(revenue)
+        FROM daily_sales
+        {where} {active}
+        GROUP BY day
+        HAVING SUM(orders_count) > 0
+        ORDER BY day
+    ''', values + [list(CANCELLED_STATUSES)])
+    revenue_by_day = [
+        {'day': row[0].isoformat(), 'orders': int(row[1]), 'revenue': float(row[2])}
+        for row in cursor.fetchall()
+    ]
+    
+    cursor.execute(f'''
+        SELECT status, SUM(orders_count), SUM(revenue)
+        FROM daily_sales
+        {where}
+        GROUP BY status
+        HAVING SUM(orders_count) > 0
+        ORDER BY status
+    ''', values)
+    orders_by_status = {
+        row[0]: {'orders': int(row[1]), 'revenue': float(row[2])}
+        for row in cursor.fetchall()
+    }
+    
+    cursor.execute(f'''
+        SELECT perfume_id, MAX(perfume_name), MAX(perfume_brand), SUM(quantity), SUM(revenue)
+        FROM daily_perfume_sales
+        {where} {active}
+        GROUP BY perfume_id
+        HAVING SUM(quantity) > 0
+        ORDER BY SUM(quantity) DESC, perfume_id
+        LIMIT %s
+    ''', values + [list(CANCELLED_STATUSES), TOP_PERFUMES_LIMIT])
+    top_perfumes = [
+        {
+            'perfumeId': row[0],
+            'perfumeName': row[1],
+            'perfumeBrand': row[2],
+            'quantity': int(row[3]),
+            'revenue': float(row[4])
+        }
+        for row in cursor.fetchall()
+    ]
+    
+    cursor.execute(f'''
+        SELECT COALESCE(SUM(quantity), 0)
+        FROM daily_perfume_sales
+        {where}
+    ''', values)
+    total_items = int(cursor.fetchone()[0])
+    
+    return {
+        'revenueByDay': revenue_by_day,
+        'ordersByStatus': orders_by_status,
+        'topPerfumes': top_perfumes,
+        'totalOrders': sum(s['orders'] for s in orders_by_status.values()),
+        'totalAmount': sum(s['revenue'] for s in orders_by_status.values()),
+        'totalItems': total_items,
+    }
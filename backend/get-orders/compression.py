@@ -0,0 +1,131 @@
+import base64
+import functools
+import gzip
+from typing import Any, Callable, Dict, List, Optional
+from instrumentation import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies fit in a packet or two; compressing them costs more than it saves
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'application/x-ndjson')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MAX_CACHED_BODIES = 64
+
+# Compressed bodies of ETag-tagged responses by their per-encoding ETag, reused across warm invocations
+_compressed_cache: Dict[str, str] = {}
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    '''Pick br or gzip from an Accept-Encoding header, honouring q=0 exclusions'''
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    
+    candidates: List[str] = (['br'] if brotli is not None else []) + ['gzip']
+    for coding in candidates:
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress_body(body: str, encoding: str) -> str:
+    data = body.encode('utf-8')
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return base64.b64encode(compressed).decode('ascii')
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    '''Validator of the encoding's representation: "1-abc" becomes "1-abc-gzip", W/ is kept'''
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+
+def request_for_encoding(event: Dict[str, Any], encoding: Optional[str]) -> Dict[str, Any]:
+    '''
+    Rewrite If-None-Match so the handler compares its plain ETag: validators of the
+    negotiated encoding lose their suffix, those of other encodings never match
+    '''
+    request_headers = event.get('headers', {}) or {}
+    if_none_match = request_headers.get('if-none-match') or request_headers.get('If-None-Match')
+    if not if_none_match:
+        return event
+    
+    tags = []
+    for tag in (tag.strip() for tag in if_none_match.split(',')):
+        if tag == '*':
+            tags.append(tag)
+        elif encoding is None:
+            if not any(tag.endswith(f'-{coding}"') for coding in ('br', 'gzip')):
+                tags.append(tag)
+        elif tag.endswith(f'-{encoding}"'):
+            tags.append(tag[:-len(encoding) - 2] + '"')
+    
+    headers = {
+        name: value for name, value in request_headers.items() if name.lower() != 'if-none-match'
+    }
+    if tags:
+        headers['If-None-Match'] = ', '.join(tags)
+    return {**event, 'headers': headers}
+
+
+def compressed(handler: Callable) -> Callable:
+    '''
+    Business: Compress large text responses when the client accepts gzip or br
+    The compressed body is returned base64-encoded with isBase64Encoded set. A
+    response ETag names the negotiated encoding, on 304 responses too, so a gzip
+    validator never revalidates identity bytes in a shared cache
+    '''
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        request_headers = event.get('headers', {}) or {}
+        encoding = choose_encoding(request_headers.get('accept-encoding') or request_headers.get('Accept-Encoding'))
+        response = handler(request_for_encoding(event, encoding), context)
+        headers = response.get('headers')
+        body = response.get('body')
+        if (
+            response.get('statusCode') not in (200, 304)
+            or response.get('isBase64Encoded')
+            or not isinstance(headers, dict)
+            or not isinstance(body, str)
+            or not headers.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+        
+        headers['Vary'] = 'Accept-Encoding'
+        if encoding is not None and headers.get('ETag'):
+            headers['ETag'] = encoded_etag(headers['ETag'], encoding)
+        if response['statusCode'] == 304 or encoding is None or len(body) < MIN_COMPRESS_BYTES:
+            return response
+        
+        with timed('compress'):
+            cache_key = headers.get('ETag')
+            encoded = _compressed_cache.get(cache_key) if cache_key else None
+            if encoded is None:
+                encoded = compress_body(body, encoding)
+                if cache_key:
+                    if len(_compressed_cache) >= MAX_CACHED_BODIES:
+                        _compressed_cache.pop(next(iter(_compressed_cache)))
+                    _compressed_cache[cache_key] = encoded
+        
+        headers['Content-Encoding'] = encoding
+        response['body'] = encoded
+        response['isBase64Encoded'] = True
+        return response
+    
+    return wrapper
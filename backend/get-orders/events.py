@@ -0,0 +1,27 @@
+from typing import List
+
+
+def emit_order_events(cursor, order_ids: List[int], event_type: str) -> None:
+    '''
+    Business: Record side effects of order changes in the order_events outbox
+    Args: cursor inside the transaction that changes the orders, so events are
+          stored only if the change commits; payload is a snapshot of the order
+    '''
+    if not order_ids:
+        return
+    
+    cursor.execute('''
+        INSERT INTO order_events (order_id, event_type, payload)
+        SELECT id, %s, json_build_object(
+            'orderId', id,
+            'orderNumber', order_number,
+            'status', status,
+            'customerName', customer_name,
+            'customerPhone', customer_phone,
+            'customerEmail', customer_email,
+            'totalAmount', total_amount
+        )
+        FROM orders
+        WHERE id = ANY(%s)
+        ORDER BY id
+    ''', (event_type, order_ids))
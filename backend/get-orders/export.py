@@ -0,0 +1,127 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+EXPORT_FETCH_SIZE = 2000
+# Orders per export response: keeps memory flat and the body under the function
+# response size limit; longer ranges continue with the X-Next-Cursor token
+EXPORT_PAGE_ORDERS = 5000
+
+ORDER_COLUMNS = [
+    'orderId', 'orderNumber', 'createdAt', 'status', 'customerName', 'customerPhone',
+    'customerEmail', 'deliveryMethod', 'city', 'paymentMethod', 'totalAmount', 'deliveryPrice',
+]
+ITEM_COLUMNS = ['perfumeId', 'perfumeName', 'perfumeBrand', 'quantity', 'price']
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def iter_export_rows(conn, date_from: Optional[datetime], date_to: Optional[datetime],
+                     status: Optional[str], after: Optional[Tuple[datetime, int]]) -> Iterator[tuple]:
+    '''
+    Business: Read the next EXPORT_PAGE_ORDERS orders after the keyset position, joined
+              with their items, through a server-side cursor so only EXPORT_FETCH_SIZE
+              rows are held in memory at a time
+    Returns: one row per order item (order columns + item columns), ordered by order
+    '''
+    conditions = []
+    values: List[Any] = []
+    if date_from:
+        conditions.append('o.created_at >= %s')
+        values.append(date_from)
+    if date_to:
+        conditions.append('o.created_at < %s')
+        values.append(date_to)
+    if status:
+        conditions.append('o.status = %s')
+        values.append(status)
+    if after:
+        conditions.append('(o.created_at, o.id) > (%s, %s)')
+        values.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cursor = conn.cursor(name='orders_export')
+    cursor.itersize = EXPORT_FETCH_SIZE
+    try:
+        cursor.execute(f'''
+            SELECT o.id, o.order_number, o.created_at, o.status, o.customer_name,
+                   o.customer_phone, o.customer_email, o.delivery_method, o.city,
+                   o.payment_method, o.total_amount, o.delivery_price,
+                   i.perfume_id, i.perfume_name, i.perfume_brand, i.quantity, i.price
+            FROM (
+                SELECT * FROM orders o
+                {where}
+                ORDER BY o.created_at, o.id
+                LIMIT %s
+            ) o
+            LEFT JOIN order_items i ON i.order_id = o.id
+            ORDER BY o.created_at, o.id, i.id
+        ''', values + [EXPORT_PAGE_ORDERS])
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def iter_csv(rows: Iterator[tuple], header: bool) -> Iterator[str]:
+    '''
+    Flattened export: one CSV line per order item, order columns repeated.
+    Only the first page has the header row, so pages can be concatenated
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for row in rows:
+        writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterator[tuple]) -> Iterator[str]:
+    '''Nested export: one JSON line per order with its items'''
+    order = None
+    for row in rows:
+        if order is None or order['orderId'] != row[0]:
+            if order is not None:
+                yield json.dumps(order, ensure_ascii=False) + '\n'
+            order = dict(zip(ORDER_COLUMNS, row[:12]))
+            order['createdAt'] = row[2].isoformat() if row[2] else None
+            order['totalAmount'] = float(row[10])
+            order['deliveryPrice'] = float(row[11])
+            order['items'] = []
+        if row[12] is not None:
+            item = dict(zip(ITEM_COLUMNS, row[12:]))
+            item['price'] = float(item['price'])
+            order['items'].append(item)
+    if order is not None:
+        yield json.dumps(order, ensure_ascii=False) + '\n'
+
+
+def track_position(rows: Iterator[tuple], position: Dict[str, Any]) -> Iterator[tuple]:
+    '''Count exported orders and remember the keyset position of the last one'''
+    position['orders'] = 0
+    for row in rows:
+        if position.get('last') != (row[2], row[0]):
+            position['orders'] += 1
+            position['last'] = (row[2], row[0])
+        yield row
+
+
+def iter_export(conn, export_format: str, date_from: Optional[datetime], date_to: Optional[datetime],
+                status: Optional[str], after: Optional[Tuple[datetime, int]],
+                position: Dict[str, Any]) -> Iterator[str]:
+    '''
+    One export page in the requested format
+    Args: after - (created_at, id) of the last order of the previous page, or None for the first
+          position - filled with the number of exported orders and the last one's (created_at, id)
+    '''
+    rows = track_position(iter_export_rows(conn, date_from, date_to, status, after), position)
+    return iter_csv(rows, header=after is None) if export_format == 'csv' else iter_ndjson(rows)
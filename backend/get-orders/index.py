@@ -1,14 +1,290 @@
+import base64
+import io
 import json
-import os
-import psycopg2
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Optional
+from db import get_connection, release_connection
+from export import EXPORT_CONTENT_TYPES, EXPORT_PAGE_ORDERS, iter_export
+from analytics import query_analytics
+from rollups import CANCELLED_STATUSES, apply_orders_to_rollups, fold_rollup_deltas, rebuild_rollups
+from events import emit_order_events
+from instrumentation import instrumented, timed
+from compression import compressed
+from security import is_admin_request, not_configured, record_failure, throttle
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_ORDERS = 1000
+
+# Status changes allowed in bulk operations: current status -> possible new statuses
+STATUS_TRANSITIONS = {
+    'pending': ('Новый', 'В обработке', 'Доставляется', 'Отменён'),
+    'Новый': ('В обработке', 'Доставляется', 'Отменён'),
+    'В обработке': ('Доставляется', 'Завершён', 'Отменён'),
+    'Доставляется': ('Завершён', 'Отменён'),
+    'Завершён': (),
+    'Отменён': (),
+}
+
+
+def encode_cursor(created_at: datetime, order_id: int) -> str:
+    '''Pack the keyset position of the last returned order into an opaque token'''
+    raw = json.dumps([created_at.isoformat(), order_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}')
+
+
+def build_order_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''
+    Translate status, dateFrom, dateTo, phone and email into WHERE conditions.
+    Date range is half-open: dateFrom <= created_at < dateTo.
+    '''
+    conditions = []
+    values: List[Any] = []
+    
+    if params.get('status'):
+        conditions.append('status = %s')
+        values.append(params['status'])
+    
+    date_from = parse_date(params.get('dateFrom'), 'dateFrom')
+    if date_from:
+        conditions.append('created_at >= %s')
+        values.append(date_from)
+    
+    date_to = parse_date(params.get('dateTo'), 'dateTo')
+    if date_to:
+        conditions.append('created_at < %s')
+        values.append(date_to)
+    
+    if params.get('phone'):
+        conditions.append('customer_phone = %s')
+        values.append(params['phone'])
+    
+    if params.get('email'):
+        conditions.append('lower(customer_email) = lower(%s)')
+        values.append(params['email'])
+    
+    return conditions, values
+
+
+def build_orders_query(params: Dict[str, Any]) -> Tuple[str, List[Any], int]:
+    '''
+    Build keyset-paginated orders listing from query parameters:
+    limit, cursor, sort (date-desc/date-asc) and the filters of build_order_filters
+    '''
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    descending = params.get('sort', 'date-desc') != 'date-asc'
+    conditions, values = build_order_filters(params)
+    
+    if params.get('cursor'):
+        cursor_created_at, cursor_id = decode_cursor(params['cursor'])
+        conditions.append(f"(created_at, id) {'<' if descending else '>'} (%s, %s)")
+        values.extend([cursor_created_at, cursor_id])
+    
+    direction = 'DESC' if descending else 'ASC'
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    # Fetch one extra row to know whether another page exists. Each order,
+    # with its items, is rendered to JSON by Postgres after the page is cut
+    query = f'''
+        SELECT
+            o.id, o.created_at,
+            json_build_object(
+                'id', o.id,
+                'orderNumber', o.order_number,
+                'customerName', o.customer_name,
+                'customerPhone', o.customer_phone,
+                'customerEmail', o.customer_email,
+                'deliveryMethod', o.delivery_method,
+                'deliveryAddress', o.delivery_address,
+                'city', o.city,
+                'postalCode', o.postal_code,
+                'comment', o.comment,
+                'paymentMethod', o.payment_method,
+                'totalAmount', o.total_amount::float8,
+                'deliveryPrice', o.delivery_price::float8,
+                'status', o.status,
+                'createdAt', o.created_at,
+                'updatedAt', o.updated_at,
+                'items', COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'perfumeId', i.perfume_id,
+                        'perfumeName', i.perfume_name,
+                        'perfumeBrand', i.perfume_brand,
+                        'quantity', i.quantity,
+                        'price', i.price::float8
+                    ) ORDER BY i.id)
+                    FROM order_items i
+                    WHERE i.order_id = o.id
+                ), '[]'::json)
+            )::text AS order_json
+        FROM (
+            SELECT * FROM orders
+            {where}
+            ORDER BY created_at {direction}, id {direction}
+            LIMIT %s
+        ) o
+        ORDER BY o.created_at {direction}, o.id {direction}
+    '''
+    values.append(limit + 1)
+    return query, values, limit
+
+
+def release_stock(cursor, order_ids: List[int]) -> None:
+    '''
+    Business: Return stock reserved by orders that are cancelled or deleted
+    Each order releases at most once; tracked perfume rows are locked in id order and
+    mode like at checkout, which holds FOR KEY SHARE locks through order_items
+    '''
+    cursor.execute('''
+        SELECT id FROM perfumes
+        WHERE id IN (SELECT perfume_id FROM order_items WHERE order_id = ANY(%s)) AND stock IS NOT NULL
+        ORDER BY id
+        FOR NO KEY UPDATE
+    ''', (order_ids,))
+    cursor.execute('''
+        WITH released AS (
+            UPDATE orders SET stock_reserved = false
+            WHERE id = ANY(%s) AND stock_reserved
+            RETURNING id
+        ), quantities AS (
+            SELECT i.perfume_id, SUM(i.quantity) AS quantity
+            FROM order_items i
+            JOIN released r ON r.id = i.order_id
+            GROUP BY i.perfume_id
+        )
+        UPDATE perfumes p
+        SET stock = p.stock + q.quantity
+        FROM quantities q
+        WHERE p.id = q.perfume_id AND p.stock IS NOT NULL
+    ''', (order_ids,))
+
+
+def is_bulk_request(event: Dict[str, Any]) -> bool:
+    body = json.loads(event.get('body') or '{}')
+    return isinstance(body, dict) and ('orderIds' in body or 'filter' in body)
+
+
+def select_orders_for_update(cursor, body: Dict[str, Any]) -> List[Tuple[int, str]]:
+    '''
+    Lock the orders picked by a bulk request in id order: explicit orderIds, or
+    filter with the listing filters (status, dateFrom, dateTo, phone, email)
+    Returns: (id, current status) of every selected order
+    '''
+    if 'orderIds' in body:
+        order_ids = body['orderIds']
+        if not isinstance(order_ids, list) or not order_ids or not all(isinstance(i, int) for i in order_ids):
+            raise ValueError('Invalid orderIds')
+        conditions, values = ['id = ANY(%s)'], [order_ids]
+    else:
+        if not isinstance(body.get('filter'), dict):
+            raise ValueError('Invalid filter')
+        conditions, values = build_order_filters(body['filter'])
+        if not conditions:
+            raise ValueError('Filter must not be empty')
+    
+    cursor.execute(f'''
+        SELECT id, COALESCE(status, 'pending')
+        FROM orders
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE
+    ''', values + [MAX_BULK_ORDERS + 1])
+    selected = cursor.fetchall()
+    if len(selected) > MAX_BULK_ORDERS:
+        raise ValueError(f'More than {MAX_BULK_ORDERS} orders selected')
+    return selected
+
+
+def change_orders_status(cursor, selected: List[Tuple[int, str]], status: str) -> Dict[str, Any]:
+    '''
+    Business: Move locked orders to a new status with one UPDATE, skipping orders
+              whose current status does not allow the change per STATUS_TRANSITIONS
+    Returns: updated orders and rejected ones with the reason
+    '''
+    allowed = [order_id for order_id, current in selected if status in STATUS_TRANSITIONS.get(current, ())]
+    rejected = [
+        {'id': order_id, 'status': current, 'error': f'Cannot change status from {current} to {status}'}
+        for order_id, current in selected if status not in STATUS_TRANSITIONS.get(current, ())
+    ]
+    
+    updated = []
+    if allowed:
+        apply_orders_to_rollups(cursor, allowed, -1)
+        cursor.execute('''
+            UPDATE orders
+            SET status = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ANY(%s)
+            RETURNING id, order_number, status, updated_at
+        ''', (status, allowed))
+        updated = [
+            {'id': row[0], 'orderNumber': row[1], 'status': row[2], 'updatedAt': row[3].isoformat()}
+            for row in cursor.fetchall()
+        ]
+        apply_orders_to_rollups(cursor, allowed, 1)
+        emit_order_events(cursor, allowed, 'order.status_changed')
+        if status in CANCELLED_STATUSES:
+            release_stock(cursor, allowed)
+    
+    return {'updated': sorted(updated, key=lambda order: order['id']), 'rejected': rejected}
+
+
+def delete_orders(cursor, order_ids: List[int]) -> List[Dict[str, Any]]:
+    '''
+    Business: Delete orders with their items in one statement, after taking them
+              out of the rollups, returning their stock and recording events
+    Returns: id and number of every deleted order
+    '''
+    apply_orders_to_rollups(cursor, order_ids, -1)
+    release_stock(cursor, order_ids)
+    emit_order_events(cursor, order_ids, 'order.deleted')
+    cursor.execute('''
+        WITH deleted_items AS (
+            DELETE FROM order_items WHERE order_id = ANY(%s)
+        )
+        DELETE FROM orders
+        WHERE id = ANY(%s)
+        RETURNING id, order_number
+    ''', (order_ids, order_ids))
+    return sorted(({'id': row[0], 'orderNumber': row[1]} for row in cursor.fetchall()), key=lambda order: order['id'])
+
+
+@instrumented('get-orders')
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Manage orders - get all, update, delete
-    Args: event - dict with httpMethod (GET/PUT/DELETE), body, headers (X-Admin-Password)
+    Business: Manage orders - list with filters and cursor pagination, export
+              (format=csv|ndjson with dateFrom/dateTo/status), analytics
+              (action=analytics, POST action=rebuild-analytics), update, delete;
+              PUT/DELETE with orderIds or filter change status or delete in bulk
+    Args: event - dict with httpMethod (GET/POST/PUT/DELETE), queryStringParameters, body,
+                  headers (Authorization: Bearer <token from auth>)
           context - object with request_id attribute
-    Returns: HTTP response with orders list or update/delete confirmation
+    Returns: HTTP response with orders list or update/delete confirmation;
+             large bodies are gzip/br-compressed when Accept-Encoding allows
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,19 +294,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Password',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    # Check admin password for all methods
-    headers = event.get('headers', {})
-    admin_password = headers.get('x-admin-password') or headers.get('X-Admin-Password')
-    expected_password = os.environ.get('ADMIN_PASSWORD')
+    # Throttle per client IP and check the admin token before touching the database
+    throttled = throttle(event)
+    if throttled:
+        return throttled
     
-    if admin_password != expected_password:
+    unavailable = not_configured('ADMIN_TOKEN_SECRET')
+    if unavailable:
+        return unavailable
+    
+    if not is_admin_request(event.get('headers', {}) or {}):
+        record_failure(event)
         return {
             'statusCode': 401,
             'headers': {'Access-Control-Allow-Origin': '*'},
@@ -38,62 +319,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     # Connect to database
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        if method == 'GET':
-            # Get all orders
-            cursor.execute('''
-                SELECT 
-                    id, order_number, customer_name, customer_phone, customer_email,
-                    delivery_method, delivery_address, city, postal_code,
-                    comment, payment_method, total_amount, delivery_price, status,
-                    created_at, updated_at
-                FROM orders
-                ORDER BY created_at DESC
-            ''')
-            
-            orders = []
-            for row in cursor.fetchall():
-                order = {
-                    'id': row[0],
-                    'orderNumber': row[1],
-                    'customerName': row[2],
-                    'customerPhone': row[3],
-                    'customerEmail': row[4],
-                    'deliveryMethod': row[5],
-                    'deliveryAddress': row[6],
-                    'city': row[7],
-                    'postalCode': row[8],
-                    'comment': row[9],
-                    'paymentMethod': row[10],
-                    'totalAmount': float(row[11]),
-                    'deliveryPrice': float(row[12]),
-                    'status': row[13],
-                    'createdAt': row[14].isoformat() if row[14] else None,
-                    'updatedAt': row[15].isoformat() if row[15] else None,
-                    'items': []
+        if method == 'GET' and (event.get('queryStringParameters') or {}).get('action') == 'analytics':
+            # Dashboard metrics from daily rollups
+            query_params = event.get('queryStringParameters') or {}
+            try:
+                date_from = parse_date(query_params.get('dateFrom'), 'dateFrom')
+                date_to = parse_date(query_params.get('dateTo'), 'dateTo')
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
                 }
-                
-                # Get order items
-                cursor.execute('''
-                    SELECT perfume_id, perfume_name, perfume_brand, quantity, price
-                    FROM order_items
-                    WHERE order_id = %s
-                ''', (row[0],))
-                
-                for item_row in cursor.fetchall():
-                    order['items'].append({
-                        'perfumeId': item_row[0],
-                        'perfumeName': item_row[1],
-                        'perfumeBrand': item_row[2],
-                        'quantity': item_row[3],
-                        'price': float(item_row[4])
-                    })
-                
-                orders.append(order)
+            
+            # Apply changes recorded by order writes since the last read
+            fold_rollup_deltas(cursor)
+            conn.commit()
             
             return {
                 'statusCode': 200,
@@ -102,19 +347,133 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps({'orders': orders})
+                'body': json.dumps(query_analytics(cursor, date_from, date_to), ensure_ascii=False)
             }
         
-        elif method == 'DELETE':
-            # Delete order
+        elif method == 'POST' and (event.get('queryStringParameters') or {}).get('action') == 'rebuild-analytics':
+            # Backfill daily rollups from orders
+            rebuild_rollups(cursor)
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'message': 'Analytics rebuilt'})
+            }
+        
+        elif method == 'GET' and (event.get('queryStringParameters') or {}).get('format'):
+            # Export orders for accounting as CSV or NDJSON
+            query_params = event.get('queryStringParameters') or {}
+            export_format = query_params['format']
+            try:
+                if export_format not in EXPORT_CONTENT_TYPES:
+                    raise ValueError('Invalid format')
+                date_from = parse_date(query_params.get('dateFrom'), 'dateFrom')
+                date_to = parse_date(query_params.get('dateTo'), 'dateTo')
+                after = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # One page of at most EXPORT_PAGE_ORDERS orders, written out as rows arrive
+            # from the server-side cursor; the client follows X-Next-Cursor for the rest
+            output = io.StringIO()
+            position: Dict[str, Any] = {}
+            for chunk in iter_export(conn, export_format, date_from, date_to, query_params.get('status'), after, position):
+                output.write(chunk)
+            
+            headers = {
+                'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+                'Content-Disposition': f'attachment; filename="orders.{export_format}"',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'X-Next-Cursor'
+            }
+            if position['orders'] == EXPORT_PAGE_ORDERS:
+                headers['X-Next-Cursor'] = encode_cursor(*position['last'])
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'isBase64Encoded': False,
+                'body': output.getvalue()
+            }
+        
+        elif method == 'GET':
+            # Get one page of orders
+            query_params = event.get('queryStringParameters', {}) or {}
+            try:
+                query, values, limit = build_orders_query(query_params)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            cursor.execute(query, values)
+            rows = cursor.fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+            
+            # Orders arrive as JSON text; only the envelope is assembled here
+            with timed('serialize'):
+                body = '{"orders": [' + ', '.join(row[2] for row in rows) + '], "nextCursor": ' + json.dumps(next_cursor) + '}'
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': body
+            }
+        
+        elif method == 'DELETE' and is_bulk_request(event):
+            # Delete many orders picked by ids or by filter
             body_data = json.loads(event.get('body', '{}'))
-            order_id = body_data.get('orderId')
+            try:
+                selected = select_orders_for_update(cursor, body_data)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            deleted = delete_orders(cursor, [order_id for order_id, _ in selected]) if selected else []
+            conn.commit()
             
-            # Delete order items first (foreign key constraint)
-            cursor.execute('DELETE FROM order_items WHERE order_id = %s', (order_id,))
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'deleted': deleted}, ensure_ascii=False)
+            }
+        
+        elif method == 'DELETE':
             # Delete order
-            cursor.execute('DELETE FROM orders WHERE id = %s', (order_id,))
+            body_data = json.loads(event.get('body', '{}'))
+            order_id = body_data.get('orderId') if isinstance(body_data, dict) else None
+            if not isinstance(order_id, int) or isinstance(order_id, bool):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid orderId'})
+                }
             
+            delete_orders(cursor, [order_id])
             conn.commit()
             
             return {
@@ -127,6 +486,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'success': True, 'message': 'Order deleted'})
             }
         
+        elif method == 'PUT' and is_bulk_request(event):
+            # Change status of many orders picked by ids or by filter
+            body_data = json.loads(event.get('body', '{}'))
+            status = body_data.get('status')
+            try:
+                if status not in STATUS_TRANSITIONS:
+                    raise ValueError('Invalid status')
+                selected = select_orders_for_update(cursor, body_data)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}, ensure_ascii=False)
+                }
+            
+            result = change_orders_status(cursor, selected, status)
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, **result}, ensure_ascii=False)
+            }
+        
         elif method == 'PUT':
             # Update order
             body_data = json.loads(event.get('body', '{}'))
@@ -168,8 +555,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 update_fields.append('updated_at = CURRENT_TIMESTAMP')
                 update_values.append(order_id)
                 
+                if 'status' in body_data:
+                    # Move the order between status buckets of the rollups
+                    cursor.execute('SELECT id FROM orders WHERE id = %s FOR UPDATE', (order_id,))
+                    apply_orders_to_rollups(cursor, [order_id], -1)
+                
                 query = f"UPDATE orders SET {', '.join(update_fields)} WHERE id = %s"
                 cursor.execute(query, update_values)
+                
+                if 'status' in body_data:
+                    apply_orders_to_rollups(cursor, [order_id], 1)
+                    emit_order_events(cursor, [order_id], 'order.status_changed')
+                if body_data.get('status') in CANCELLED_STATUSES:
+                    release_stock(cursor, [order_id])
                 conn.commit()
             
             return {
@@ -199,4 +597,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        release_connection(conn)
@@ -0,0 +1,101 @@
+from typing import List
+
+# Order statuses excluded from revenue and top-perfume metrics
+CANCELLED_STATUSES = ('cancelled', 'Отменён')
+
+
+def apply_orders_to_rollups(cursor, order_ids: List[int], sign: int) -> None:
+    '''
+    Business: Record adding (sign=1) or subtracting (sign=-1) the current state of orders
+              as deltas for the daily_sales and daily_perfume_sales rollups
+    Only appends rows, so concurrent checkouts do not wait on each other's rollup rows;
+    fold_rollup_deltas applies them
+    Args: cursor inside the transaction that changes the orders; call with -1 before
+          an update or delete and with 1 after an insert or update
+    '''
+    if not order_ids:
+        return
+    
+    cursor.execute('''
+        INSERT INTO daily_sales_deltas (day, status, orders_count, revenue)
+        SELECT created_at::date, COALESCE(status, 'pending'), %s * COUNT(*), %s * SUM(total_amount)
+        FROM orders
+        WHERE id = ANY(%s)
+        GROUP BY 1, 2
+    ''', (sign, sign, order_ids))
+    
+    cursor.execute('''
+        INSERT INTO daily_perfume_sales_deltas (day, status, perfume_id, perfume_name, perfume_brand, quantity, revenue)
+        SELECT o.created_at::date, COALESCE(o.status, 'pending'), i.perfume_id,
+               MAX(i.perfume_name), MAX(i.perfume_brand),
+               %s * SUM(i.quantity), %s * SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        WHERE i.order_id = ANY(%s)
+        GROUP BY 1, 2, 3
+    ''', (sign, sign, order_ids))
+
+
+def fold_rollup_deltas(cursor) -> None:
+    '''
+    Move pending deltas into the rollup tables, one upsert per table in key order;
+    deltas committed meanwhile stay for the next fold
+    '''
+    cursor.execute('''
+        WITH moved AS (
+            DELETE FROM daily_sales_deltas
+            RETURNING day, status, orders_count, revenue
+        )
+        INSERT INTO daily_sales (day, status, orders_count, revenue)
+        SELECT day, status, SUM(orders_count), SUM(revenue)
+        FROM moved
+        GROUP BY day, status
+        ORDER BY day, status
+        ON CONFLICT (day, status) DO UPDATE SET
+            orders_count = daily_sales.orders_count + EXCLUDED.orders_count,
+            revenue = daily_sales.revenue + EXCLUDED.revenue
+    ''')
+    
+    cursor.execute('''
+        WITH moved AS (
+            DELETE FROM daily_perfume_sales_deltas
+            RETURNING day, status, perfume_id, perfume_name, perfume_brand, quantity, revenue
+        )
+        INSERT INTO daily_perfume_sales (day, status, perfume_id, perfume_name, perfume_brand, quantity, revenue)
+        SELECT day, status, perfume_id, MAX(perfume_name), MAX(perfume_brand), SUM(quantity), SUM(revenue)
+        FROM moved
+        GROUP BY day, status, perfume_id
+        ORDER BY day, status, perfume_id
+        ON CONFLICT (day, status, perfume_id) DO UPDATE SET
+            perfume_name = EXCLUDED.perfume_name,
+            perfume_brand = EXCLUDED.perfume_brand,
+            quantity = daily_perfume_sales.quantity + EXCLUDED.quantity,
+            revenue = daily_perfume_sales.revenue + EXCLUDED.revenue
+    ''')
+
+
+def rebuild_rollups(cursor) -> None:
+    '''Backfill: recompute both rollup tables from orders and order_items'''
+    # Waits for in-flight order writes, whose deltas are then covered by the rebuild
+    cursor.execute('''
+        LOCK TABLE daily_sales, daily_perfume_sales, daily_sales_deltas, daily_perfume_sales_deltas
+        IN EXCLUSIVE MODE
+    ''')
+    cursor.execute('DELETE FROM daily_sales_deltas')
+    cursor.execute('DELETE FROM daily_perfume_sales_deltas')
+    cursor.execute('DELETE FROM daily_sales')
+    cursor.execute('DELETE FROM daily_perfume_sales')
+    cursor.execute('''
+        INSERT INTO daily_sales (day, status, orders_count, revenue)
+        SELECT created_at::date, COALESCE(status, 'pending'), COUNT(*), SUM(total_amount)
+        FROM orders
+        GROUP BY 1, 2
+    ''')
+    cursor.execute('''
+        INSERT INTO daily_perfume_sales (day, status, perfume_id, perfume_name, perfume_brand, quantity, revenue)
+        SELECT o.created_at::date, COALESCE(o.status, 'pending'), i.perfume_id,
+               MAX(i.perfume_name), MAX(i.perfume_brand), SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        GROUP BY 1, 2, 3
+    ''')
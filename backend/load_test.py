@@ -0,0 +1,319 @@
+'''
+Load test for the backend functions served by local_server.py.
+
+Seeds a local Postgres with a synthetic catalog and order history, then runs
+each scenario for a fixed duration with concurrent clients and reports RPS,
+p50/p95/p99 latency and the peak number of database connections. Results can
+be saved as a baseline and later checked for regressions.
+
+Admin endpoints throttle each client IP, so start local_server.py with a high
+ADMIN_RATE_LIMIT (requests per minute) before load testing them.
+
+Usage:
+  DATABASE_URL=... ADMIN_PASSWORD=... python backend/load_test.py --seed --perfumes 10000 --orders 100000
+  python backend/load_test.py --duration 20 --concurrency 16 --save-baseline baseline.json
+  python backend/load_test.py --check-baseline baseline.json --tolerance 0.2
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+Request = Tuple[str, str, Optional[bytes], Dict[str, str]]
+
+SEED_PERFUMES_SQL = '''
+    WITH vocabulary AS (
+        SELECT ARRAY['Бергамот', 'Роза', 'Пачули', 'Ваниль', 'Жасмин', 'Амбра', 'Дуб', 'Кедр',
+                     'Ветивер', 'Цитрус', 'Пион', 'Сандал', 'Удовая древесина', 'Кожа', 'Мускус',
+                     'Личи', 'Белый чай', 'Ирис', 'Табак', 'Лаванда'] AS notes
+    )
+    INSERT INTO perfumes (name, brand, price, category, volume, notes, image, concentration, availability)
+    SELECT 'Load Perfume ' || g, 'Load Brand ' || (g %% 200), 3000 + (g * 37) %% 20000,
+           (ARRAY['Мужской', 'Женский', 'Унисекс'])[1 + g %% 3], '50 мл',
+           ARRAY[v.notes[1 + g %% 20], v.notes[1 + (g * 7) %% 20], v.notes[1 + (g * 13) %% 20]],
+           '/placeholder.svg',
+           (ARRAY['Eau de Parfum', 'Eau de Toilette', 'Extrait de Parfum'])[1 + g %% 3],
+           g %% 10 <> 0
+    FROM generate_series(1, %s) g, vocabulary v
+    ON CONFLICT (brand, name) DO NOTHING
+'''
+
+SEED_ORDERS_SQL = '''
+    INSERT INTO orders (
+        order_number, customer_name, customer_phone, customer_email, delivery_method,
+        payment_method, total_amount, delivery_price, status, created_at
+    )
+    SELECT 'LOAD-' || g, 'Load Customer ' || g, '+7900' || lpad((g %% 1000000)::text, 7, '0'),
+           'load' || g || '@example.com', 'courier', 'card', 10000 + g %% 5000, 500,
+           (ARRAY['pending', 'Новый', 'В обработке', 'Доставляется', 'Завершён', 'Отменён'])[1 + g %% 6],
+           CURRENT_TIMESTAMP - (g %% 365) * interval '1 day' - (g %% 86400) * interval '1 second'
+    FROM generate_series(1, %s) g
+    ON CONFLICT (order_number) DO NOTHING
+'''
+
+SEED_ORDER_ITEMS_SQL = '''
+    WITH catalog AS (SELECT array_agg(id ORDER BY id) AS ids FROM perfumes)
+    INSERT INTO order_items (order_id, perfume_id, perfume_name, perfume_brand, quantity, price)
+    SELECT o.id, p.id, p.name, p.brand, 1 + (o.id + k) % 3, p.price
+    FROM orders o
+    CROSS JOIN generate_series(0, 1) k
+    CROSS JOIN catalog c
+    JOIN perfumes p ON p.id = c.ids[1 + (o.id * 7 + k * 13) % cardinality(c.ids)]
+    WHERE o.order_number LIKE 'LOAD-%'
+      AND NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id)
+'''
+
+
+def http(base_url: str, request: Request) -> Tuple[int, bytes]:
+    method, path, body, headers = request
+    http_request = urllib.request.Request(base_url + path, data=body, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(http_request, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+_admin_token: Optional[str] = None
+
+
+def login(base_url: str) -> None:
+    '''Get an admin token from the auth function, like the admin UI does'''
+    global _admin_token
+    body = json.dumps({'password': os.environ.get('ADMIN_PASSWORD', '')}).encode()
+    status, response = http(base_url, ('POST', '/auth/', body, {'Content-Type': 'application/json'}))
+    if status != 200:
+        raise SystemExit(f'Admin login failed with {status}: set ADMIN_PASSWORD to the server\'s password')
+    _admin_token = json.loads(response)['token']
+
+
+def admin_headers() -> Dict[str, str]:
+    return {'Authorization': f'Bearer {_admin_token}'}
+
+
+def seed_database(database_url: str, perfumes: int, orders: int) -> None:
+    '''Insert the synthetic catalog and order history; rows that already exist are kept'''
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute(SEED_PERFUMES_SQL, (perfumes,))
+            cursor.execute(SEED_ORDERS_SQL, (orders,))
+            cursor.execute(SEED_ORDER_ITEMS_SQL)
+            cursor.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+        conn.commit()
+        with conn.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        conn.commit()
+        print(f'Seeded {perfumes} perfumes and {orders} orders in {time.perf_counter() - started:.1f}s')
+    finally:
+        conn.close()
+
+
+def seed(database_url: str, base_url: str, perfumes: int, orders: int) -> None:
+    seed_database(database_url, perfumes, orders)
+    
+    # Derived data is rebuilt through the functions themselves
+    for request in (
+        ('POST', '/get-orders/?action=rebuild-analytics', b'', admin_headers()),
+        ('POST', '/perfumes-admin/?action=rebuild-similar', b'', admin_headers()),
+    ):
+        status, _ = http(base_url, request)
+        print(f'{request[0]} {request[1]} -> {status}')
+    
+    # The recommendations rebuild is only queued; run its batches instead of waiting for the timer
+    started = time.perf_counter()
+    pending = True
+    while pending:
+        status, body = http(base_url, ('POST', '/perfumes-admin/?action=rebuild-similar-batch', b'', admin_headers()))
+        if status != 200:
+            raise SystemExit(f'Recommendations rebuild batch failed with {status}')
+        pending = json.loads(body)['pending']
+    print(f'Recommendations rebuilt in {time.perf_counter() - started:.1f}s')
+
+
+def load_perfume_ids(database_url: str) -> List[int]:
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT id FROM perfumes WHERE availability ORDER BY id LIMIT 10000')
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def build_scenarios(perfume_ids: List[int]) -> Dict[str, Callable[[], Request]]:
+    def checkout() -> Request:
+        items = [{'id': random.choice(perfume_ids), 'quantity': random.randint(1, 2)} for _ in range(2)]
+        body = {
+            'name': 'Load Test', 'phone': '+79000000000', 'email': 'load@example.com',
+            'deliveryMethod': 'courier', 'paymentMethod': 'card', 'deliveryPrice': 500, 'items': items
+        }
+        return 'POST', '/save-order/', json.dumps(body).encode(), {'Content-Type': 'application/json'}
+    
+    return {
+        'perfumes-list': lambda: ('GET', '/perfumes/', None, {}),
+        'perfumes-filter': lambda: (
+            'GET', f"/perfumes/?category={urllib.request.quote('Женский')}&maxPrice={random.randint(5, 20) * 1000}&sort=price-asc&limit=24",
+            None, {}
+        ),
+        'perfumes-search': lambda: ('GET', '/perfumes/?q=' + urllib.request.quote(random.choice(['Роза', 'ветивер', 'Load Brand 1'])), None, {}),
+        'orders-page': lambda: ('GET', '/get-orders/?limit=50', None, admin_headers()),
+        'orders-analytics': lambda: ('GET', '/get-orders/?action=analytics', None, admin_headers()),
+        'save-order': checkout,
+    }
+
+
+def count_connections(database_url: str, stop: threading.Event, samples: List[int]) -> None:
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            while not stop.is_set():
+                cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+                # The sampling connection itself is not counted
+                samples.append(cursor.fetchone()[0] - 1)
+                stop.wait(0.25)
+    finally:
+        conn.close()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(base_url: str, database_url: Optional[str], make_request: Callable[[], Request],
+                 duration: float, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    
+    def client() -> None:
+        local_latencies = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = http(base_url, make_request())
+                if status >= 400:
+                    local_errors += 1
+            except OSError:
+                local_errors += 1
+            local_latencies.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+    
+    stop = threading.Event()
+    connection_samples: List[int] = []
+    sampler = None
+    if database_url:
+        sampler = threading.Thread(target=count_connections, args=(database_url, stop, connection_samples))
+        sampler.start()
+    
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    stop.set()
+    if sampler:
+        sampler.join()
+    
+    if not latencies:
+        return {'requests': 0, 'errors': errors[0]}
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50': round(statistics.median(latencies), 1),
+        'p95': round(percentile(latencies, 0.95), 1),
+        'p99': round(percentile(latencies, 0.99), 1),
+        'maxConnections': max(connection_samples) if connection_samples else None,
+    }
+
+
+def check_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                   tolerance: float) -> List[str]:
+    '''
+    Regressions: p95 above or throughput below the baseline by more than tolerance;
+    a baseline scenario that was not run or completed no requests fails too
+    '''
+    failures = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if actual is None:
+            failures.append(f'{name}: in the baseline but not run')
+            continue
+        if 'rps' not in expected or 'p95' not in expected:
+            failures.append(f'{name}: the baseline has no rps or p95 to compare with')
+            continue
+        if 'rps' not in actual:
+            failures.append(f"{name}: no requests completed ({actual['errors']} errors)")
+            continue
+        if actual['p95'] > expected['p95'] * (1 + tolerance):
+            failures.append(f"{name}: p95 {actual['p95']}ms > baseline {expected['p95']}ms")
+        if actual['rps'] < expected['rps'] * (1 - tolerance):
+            failures.append(f"{name}: {actual['rps']} rps < baseline {expected['rps']} rps")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Load test the backend functions')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--seed', action='store_true', help='seed synthetic catalog and orders first')
+    parser.add_argument('--perfumes', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--scenarios', help='comma-separated subset of scenarios')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--save-baseline')
+    parser.add_argument('--check-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    
+    if not args.database_url:
+        parser.error('DATABASE_URL or --database-url is required')
+    
+    login(args.base_url)
+    if args.seed:
+        seed(args.database_url, args.base_url, args.perfumes, args.orders)
+    
+    scenarios = build_scenarios(load_perfume_ids(args.database_url))
+    selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    
+    results = {}
+    for name in selected:
+        results[name] = run_scenario(args.base_url, args.database_url, scenarios[name], args.duration, args.concurrency)
+        print(f'{name:18} {json.dumps(results[name])}')
+    
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.check_baseline:
+        with open(args.check_baseline) as f:
+            failures = check_baseline(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print('REGRESSION', failure)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+'''
+Local HTTP harness for the backend functions.
+
+Mounts every backend/<function>/index.py handler under /<function>/ on one
+HTTP server and translates requests into the event shape used by the cloud
+functions. Each worker process imports its own copy of every function and
+serves one request at a time, like a warm function instance.
+
+Usage: DATABASE_URL=... ADMIN_PASSWORD=... ADMIN_TOKEN_SECRET=... python backend/local_server.py --port 8000 --workers 4
+'''
+import argparse
+import base64
+import contextlib
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SiblingLoader(importlib.machinery.SourceFileLoader):
+    '''
+    Load a function's sibling module under a per-function name; the plain name
+    stays aliased while the function imports, so siblings share one module object
+    '''
+    def __init__(self, plain_name: str, fullname: str, path: str):
+        super().__init__(fullname, path)
+        self.plain_name = plain_name
+    
+    def exec_module(self, module):
+        sys.modules[self.plain_name] = module
+        super().exec_module(module)
+
+
+class SiblingFinder:
+    '''Resolve `import db` and friends to the sibling modules of one function'''
+    def __init__(self, function_dir: str, prefix: str, names: set):
+        self.function_dir = function_dir
+        self.prefix = prefix
+        self.names = names
+    
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.names:
+            return None
+        location = os.path.join(self.function_dir, f'{fullname}.py')
+        loader = SiblingLoader(fullname, f'{self.prefix}__{fullname}', location)
+        return importlib.util.spec_from_file_location(loader.name, location, loader=loader)
+
+
+def load_function(function_dir: str) -> Callable:
+    '''
+    Import one function in isolation: functions ship sibling modules with the
+    same names (db, instrumentation, ...), so each gets its own module objects.
+    Those stay registered under unique names (function_<name>__<module>) so
+    pickle can still find their functions, e.g. for the image process pool.
+    '''
+    prefix = f'function_{os.path.basename(function_dir).replace("-", "_")}'
+    sibling_modules = {
+        name[:-3] for name in os.listdir(function_dir)
+        if name.endswith('.py') and name != 'index.py'
+    }
+    for name in sibling_modules:
+        sys.modules.pop(name, None)
+    
+    finder = SiblingFinder(function_dir, prefix, sibling_modules)
+    sys.meta_path.insert(0, finder)
+    try:
+        spec = importlib.util.spec_from_file_location(prefix, os.path.join(function_dir, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.meta_path.remove(finder)
+        for name in sibling_modules:
+            sys.modules.pop(name, None)
+    return module.handler
+
+
+def load_functions() -> Dict[str, Callable]:
+    functions = {}
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        function_dir = os.path.join(BACKEND_DIR, name)
+        if os.path.isfile(os.path.join(function_dir, 'index.py')):
+            functions[name] = load_function(function_dir)
+    return functions
+
+
+def login_in_process() -> Dict[str, str]:
+    '''
+    Log in through the auth function in this process, like the admin UI does over HTTP
+    Returns: headers for the admin functions
+    '''
+    auth = load_function(os.path.join(BACKEND_DIR, 'auth'))
+    event = {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({'password': os.environ.get('ADMIN_PASSWORD', '')}),
+        'requestContext': {'identity': {'sourceIp': '127.0.0.1'}},
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = auth(event, SimpleNamespace(request_id='login', function_name='auth'))
+    if response['statusCode'] != 200:
+        raise SystemExit(f"Admin login failed with {response['statusCode']}: set ADMIN_PASSWORD and ADMIN_TOKEN_SECRET")
+    return {'Authorization': f"Bearer {json.loads(response['body'])['token']}"}
+
+
+def make_request_handler(functions: Dict[str, Callable]) -> type:
+    class FunctionRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def handle_any(self) -> None:
+            url = urlsplit(self.path)
+            function_name = url.path.strip('/').split('/', 1)[0]
+            handler = functions.get(function_name)
+            
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            
+            if handler is None:
+                self.send_result({
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': f'Unknown function {function_name}'})
+                })
+                return
+            
+            try:
+                body = raw_body.decode()
+                is_base64 = False
+            except UnicodeDecodeError:
+                body = base64.b64encode(raw_body).decode()
+                is_base64 = True
+            
+            event = {
+                'httpMethod': self.command,
+                'headers': {key: value for key, value in self.headers.items()},
+                'queryStringParameters': dict(parse_qsl(url.query)),
+                'body': body,
+                'isBase64Encoded': is_base64,
+                'requestContext': {'identity': {'sourceIp': self.client_address[0]}},
+            }
+            context = SimpleNamespace(request_id=str(uuid.uuid4()), function_name=function_name)
+            
+            try:
+                result = handler(event, context)
+            except Exception as e:
+                result = {
+                    'statusCode': 502,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': f'Unhandled exception: {e}'})
+                }
+            self.send_result(result)
+        
+        def send_result(self, result: Dict[str, Any]) -> None:
+            body = result.get('body') or ''
+            payload = base64.b64decode(body) if result.get('isBase64Encoded') else body.encode()
+            
+            self.send_response(result.get('statusCode', 200))
+            for key, value in (result.get('headers') or {}).items():
+                self.send_header(key, str(value))
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(payload)
+        
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = handle_any
+        
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+    
+    return FunctionRequestHandler
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    '''Pre-fork server: workers share one listening socket'''
+    listener = socket.create_server((host, port), backlog=1024, reuse_port=False)
+    print(f'Serving backend functions on http://{host}:{port}/<function>/ with {workers} workers')
+    
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            server = HTTPServer((host, port), make_request_handler(load_functions()), bind_and_activate=False)
+            server.socket.close()
+            server.socket = listener
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+    
+    def stop_workers(*_: Any) -> None:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+    
+    signal.signal(signal.SIGTERM, stop_workers)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop_workers()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run backend functions locally behind one HTTP server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,206 @@
+import json
+import os
+import time
+import urllib.request
+from typing import Dict, Any, List
+from db import get_connection, release_connection
+from instrumentation import instrumented
+from security import is_admin_request, not_configured, record_failure, throttle
+
+BATCH_SIZE = int(os.environ.get('ORDER_EVENTS_BATCH_SIZE', '50'))
+MAX_BATCH_SIZE = 500
+MAX_ATTEMPTS = 8
+# Retry delay grows as BASE_RETRY_SECONDS * 2^(attempt - 1), capped at MAX_RETRY_SECONDS
+BASE_RETRY_SECONDS = 30
+MAX_RETRY_SECONDS = 3600
+# Events claimed by a worker that died are reclaimed after this long
+CLAIM_TIMEOUT_SECONDS = 300
+WEBHOOK_TIMEOUT_SECONDS = 10
+# A delivery starts only if it can time out this long before the claim expires;
+# events left at that point are released undelivered instead of being reclaimed twice
+CLAIM_MARGIN_SECONDS = 30
+
+
+def deliver_event(event: Dict[str, Any]) -> None:
+    '''
+    Business: Hand one event to the downstream sink (notifications, CRM, analytics)
+    Posts JSON to ORDER_EVENTS_WEBHOOK_URL when set, otherwise logs the event
+    Raises on failure so the event is retried
+    '''
+    webhook_url = os.environ.get('ORDER_EVENTS_WEBHOOK_URL')
+    if not webhook_url:
+        print(json.dumps({'orderEvent': event}, ensure_ascii=False, default=str))
+        return
+    
+    request = urllib.request.Request(
+        webhook_url,
+        data=json.dumps(event, ensure_ascii=False, default=str).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+        if response.status >= 300:
+            raise RuntimeError(f'Webhook responded with {response.status}')
+
+
+def claim_events(conn, batch_size: int) -> List[Dict[str, Any]]:
+    '''
+    Claim due events; SKIP LOCKED lets parallel workers take disjoint batches
+    The claim is committed before delivery so other workers see it
+    '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE order_events
+            SET status = 'processing', attempts = attempts + 1, locked_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM order_events
+                WHERE (status = 'pending' AND available_at <= CURRENT_TIMESTAMP)
+                   OR (status = 'processing' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, order_id, event_type, payload, attempts, created_at
+        ''', (CLAIM_TIMEOUT_SECONDS, batch_size))
+        events = [
+            {
+                'id': row[0],
+                'orderId': row[1],
+                'type': row[2],
+                'payload': row[3],
+                'attempt': row[4],
+                'createdAt': row[5].isoformat() if row[5] else None
+            }
+            for row in cursor.fetchall()
+        ]
+        conn.commit()
+        return sorted(events, key=lambda e: e['id'])
+    finally:
+        cursor.close()
+
+
+def retry_delay(attempt: int) -> int:
+    return min(BASE_RETRY_SECONDS * 2 ** (attempt - 1), MAX_RETRY_SECONDS)
+
+
+def finish_events(conn, delivered: List[int], failed: List[Dict[str, Any]], released: List[int]) -> None:
+    cursor = conn.cursor()
+    try:
+        if released:
+            # Not attempted: hand back the claim without using up an attempt
+            cursor.execute('''
+                UPDATE order_events
+                SET status = 'pending', attempts = attempts - 1, locked_at = NULL
+                WHERE id = ANY(%s)
+            ''', (released,))
+        if delivered:
+            cursor.execute('''
+                UPDATE order_events
+                SET status = 'done', processed_at = CURRENT_TIMESTAMP, locked_at = NULL, last_error = NULL
+                WHERE id = ANY(%s)
+            ''', (delivered,))
+        for event in failed:
+            cursor.execute('''
+                UPDATE order_events
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    available_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    locked_at = NULL,
+                    last_error = %s
+                WHERE id = %s
+            ''', (MAX_ATTEMPTS, retry_delay(event['attempt']), event['error'], event['id']))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+@instrumented('order-events')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Outbox worker - deliver pending order events with retries and backoff
+    Args: event - timer trigger, or HTTP call with the admin token and
+          queryStringParameters (batchSize); context - object with request_id attribute
+    Returns: HTTP response with numbers of delivered, failed and released events
+    '''
+    method: str = event.get('httpMethod', 'POST')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    # Timer triggers carry no httpMethod; HTTP calls need the admin token
+    if 'httpMethod' in event:
+        throttled = throttle(event)
+        if throttled:
+            return throttled
+        
+        unavailable = not_configured('ADMIN_TOKEN_SECRET')
+        if unavailable:
+            return unavailable
+        
+        if not is_admin_request(event.get('headers', {}) or {}):
+            record_failure(event)
+            return {
+                'statusCode': 401,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Unauthorized'})
+            }
+    
+    query_params = event.get('queryStringParameters', {}) or {}
+    try:
+        batch_size = max(1, min(int(query_params.get('batchSize') or BATCH_SIZE), MAX_BATCH_SIZE))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid batchSize'})
+        }
+    
+    conn = get_connection()
+    
+    try:
+        events = claim_events(conn, batch_size)
+        deadline = time.monotonic() + CLAIM_TIMEOUT_SECONDS - WEBHOOK_TIMEOUT_SECONDS - CLAIM_MARGIN_SECONDS
+        
+        delivered = []
+        failed = []
+        released = []
+        for order_event in events:
+            if time.monotonic() > deadline:
+                released.append(order_event['id'])
+                continue
+            try:
+                deliver_event(order_event)
+                delivered.append(order_event['id'])
+            except Exception as e:
+                failed.append({'id': order_event['id'], 'attempt': order_event['attempt'], 'error': str(e)})
+        
+        finish_events(conn, delivered, failed, released)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'claimed': len(events), 'delivered': len(delivered), 'failed': len(failed), 'released': len(released)
+            })
+        }
+    
+    except Exception as e:
+        conn.rollback()
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    finally:
+        release_connection(conn)
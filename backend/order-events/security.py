@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+TOKEN_TTL_SECONDS = int(os.environ.get('ADMIN_TOKEN_TTL_SECONDS', '3600'))
+
+# Per client IP: all admin requests, and failed password or token checks
+REQUEST_LIMIT = int(os.environ.get('ADMIN_RATE_LIMIT', '300'))
+REQUEST_WINDOW_SECONDS = 60
+FAILURE_LIMIT = int(os.environ.get('ADMIN_FAILURE_LIMIT', '10'))
+FAILURE_WINDOW_SECONDS = 300
+MAX_TRACKED_CLIENTS = 10000
+
+
+def admin_password() -> Optional[str]:
+    return os.environ.get('ADMIN_PASSWORD') or None
+
+
+def token_secret() -> Optional[bytes]:
+    '''Signing key; rotating it revokes every issued token'''
+    secret = os.environ.get('ADMIN_TOKEN_SECRET')
+    return secret.encode() if secret else None
+
+
+def not_configured(*variables: str) -> Optional[Dict[str, Any]]:
+    '''
+    Fail closed when a secret the handler needs is not set, instead of falling back
+    to a default anyone could use
+    Returns: 503 response when one is missing, otherwise None
+    '''
+    missing = [name for name in variables if not os.environ.get(name)]
+    if not missing:
+        return None
+    print(json.dumps({'error': 'Admin authentication is not configured', 'missing': missing}))
+    return {
+        'statusCode': 503,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({'error': 'Admin authentication is not configured'})
+    }
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def sign(payload: str) -> str:
+    secret = token_secret()
+    if secret is None:
+        raise RuntimeError('ADMIN_TOKEN_SECRET is not set')
+    return b64encode(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(subject: str = 'admin') -> Tuple[str, int]:
+    '''
+    Business: Create a short-lived admin token, payload.signature with HMAC-SHA256
+    Returns: token and its expiry as a unix timestamp
+    '''
+    now = int(time.time())
+    expires_at = now + TOKEN_TTL_SECONDS
+    payload = b64encode(json.dumps({'sub': subject, 'iat': now, 'exp': expires_at}).encode())
+    return f'{payload}.{sign(payload)}', expires_at
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Claims of a token with a valid signature that has not expired, otherwise None'''
+    payload, _, signature = token.partition('.')
+    if token_secret() is None or not payload or not hmac.compare_digest(signature.encode(), sign(payload).encode()):
+        return None
+    try:
+        claims = json.loads(b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get('exp'), int) or claims['exp'] <= time.time():
+        return None
+    return claims
+
+
+def password_matches(candidate: Any) -> bool:
+    password = admin_password()
+    if password is None or not isinstance(candidate, str):
+        return False
+    return hmac.compare_digest(candidate.encode(), password.encode())
+
+
+def is_admin_request(headers: Dict[str, Any]) -> bool:
+    '''Accept only Authorization: Bearer <token> issued by auth, checked in constant time'''
+    authorization = headers.get('authorization') or headers.get('Authorization') or ''
+    if not authorization.startswith('Bearer '):
+        return False
+    return verify_token(authorization[len('Bearer '):].strip()) is not None
+
+
+def client_ip(event: Dict[str, Any]) -> str:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or 'unknown'
+
+
+class SlidingWindowLimiter:
+    '''
+    Approximate sliding window per key: hits of the current fixed window plus the
+    previous window's hits weighted by how much of it the sliding window still covers.
+    State lives in the warm function instance, so no database round trip is needed
+    '''
+    
+    def __init__(self, limit: int, window_seconds: int) -> None:
+        self.limit = limit
+        self.window_seconds = window_seconds
+        # key -> (window number, hits in that window, hits in the window before)
+        self.windows: Dict[str, Tuple[int, int, int]] = {}
+    
+    def counts(self, key: str, now: float) -> Tuple[int, int, int]:
+        window = int(now // self.window_seconds)
+        stored_window, hits, previous_hits = self.windows.get(key, (window, 0, 0))
+        if stored_window == window:
+            return window, hits, previous_hits
+        if stored_window == window - 1:
+            return window, 0, hits
+        return window, 0, 0
+    
+    def retry_after(self, key: str) -> Optional[int]:
+        '''Seconds the key has to wait, or None when it is under the limit'''
+        now = time.time()
+        window, hits, previous_hits = self.counts(key, now)
+        elapsed = now / self.window_seconds - window
+        if previous_hits * (1 - elapsed) + hits < self.limit:
+            return None
+        if hits >= self.limit:
+            # Even with the previous window fully slid out the key stays over the limit
+            return max(1, math.ceil((window + 1 - now / self.window_seconds) * self.window_seconds))
+        # Wait until enough of the previous window's hits have slid out
+        fraction_needed = 1 - (self.limit - hits) / previous_hits
+        return max(1, math.ceil((fraction_needed - elapsed) * self.window_seconds))
+    
+    def hit(self, key: str) -> None:
+        window, hits, previous_hits = self.counts(key, time.time())
+        # Re-insert so the dict stays ordered by last activity and the idlest key is evicted first
+        self.windows.pop(key, None)
+        if len(self.windows) >= MAX_TRACKED_CLIENTS:
+            self.windows.pop(next(iter(self.windows)))
+        self.windows[key] = (window, hits + 1, previous_hits)
+
+
+request_limiter = SlidingWindowLimiter(REQUEST_LIMIT, REQUEST_WINDOW_SECONDS)
+failure_limiter = SlidingWindowLimiter(FAILURE_LIMIT, FAILURE_WINDOW_SECONDS)
+
+
+def throttle(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Count the request against the client's limits
+    Returns: 429 response when the client is over a limit, otherwise None
+    '''
+    ip = client_ip(event)
+    retry_after = failure_limiter.retry_after(ip) or request_limiter.retry_after(ip)
+    if retry_after is None:
+        request_limiter.hit(ip)
+        return None
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(retry_after)
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps({'error': 'Too many requests'})
+    }
+
+
+def record_failure(event: Dict[str, Any]) -> None:
+    failure_limiter.hit(client_ip(event))
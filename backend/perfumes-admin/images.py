@@ -0,0 +1,270 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import pickle
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageOps, features
+from psycopg2.extras import execute_values
+
+# Widths of the srcset; a source narrower than a width is not upscaled
+VARIANT_WIDTHS = (160, 320, 640, 960)
+PLACEHOLDER_WIDTH = 16
+WEBP_QUALITY = 80
+AVIF_QUALITY = 55
+PLACEHOLDER_QUALITY = 30
+FETCH_TIMEOUT_SECONDS = 15
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+
+# Offline mode: sources like /images/x.jpg are read from IMAGE_SOURCE_DIR and variants are
+# written under IMAGE_STORAGE_DIR. Without a storage dir, variants go to the IMAGE_S3_BUCKET
+IMAGE_SOURCE_DIR = os.environ.get('IMAGE_SOURCE_DIR', 'public')
+IMAGE_STORAGE_DIR = os.environ.get('IMAGE_STORAGE_DIR')
+IMAGE_BASE_URL = os.environ.get('IMAGE_BASE_URL', '/media').rstrip('/')
+# Hosts http(s) sources may be fetched from, comma-separated; without it URLs are rejected
+IMAGE_SOURCE_HOSTS = {
+    host.strip().lower() for host in os.environ.get('IMAGE_SOURCE_HOSTS', '').split(',') if host.strip()
+}
+
+CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'json': 'application/json'}
+
+
+def is_raster_source(ref: Optional[str]) -> bool:
+    '''SVG placeholders and empty values are served as is'''
+    if not ref:
+        return False
+    lowered = ref.lower()
+    return not (lowered.split('?')[0].endswith('.svg') or lowered.startswith('data:image/svg'))
+
+
+def check_source_host(url: str) -> None:
+    host = (urllib.parse.urlsplit(url).hostname or '').lower()
+    if host not in IMAGE_SOURCE_HOSTS:
+        raise ValueError(f'Image host {host or url!r} is not in IMAGE_SOURCE_HOSTS')
+
+
+class AllowedHostRedirectHandler(urllib.request.HTTPRedirectHandler):
+    '''Follow redirects only to allowed hosts'''
+    
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_source_host(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def source_path(ref: str) -> str:
+    '''Resolve a local source, which must stay inside IMAGE_SOURCE_DIR after following .. and symlinks'''
+    root = os.path.realpath(IMAGE_SOURCE_DIR)
+    path = os.path.realpath(os.path.join(root, ref.lstrip('/')))
+    if not path.startswith(root + os.sep):
+        raise ValueError('Image path is outside IMAGE_SOURCE_DIR')
+    return path
+
+
+def load_source(ref: str) -> bytes:
+    '''Read source image bytes from a data: URL, an http(s) URL or a local path'''
+    if ref.startswith('data:'):
+        header, _, payload = ref.partition(',')
+        if not header.endswith(';base64'):
+            raise ValueError('Unsupported data URL')
+        # Base64 takes 4 characters per 3 bytes, so the payload length bounds the decoded size
+        if len(payload) * 3 // 4 > MAX_SOURCE_BYTES + 2:
+            raise ValueError('Image is too large')
+        data = base64.b64decode(payload)
+    
+    elif ref.startswith(('http://', 'https://')):
+        check_source_host(ref)
+        opener = urllib.request.build_opener(AllowedHostRedirectHandler)
+        with opener.open(ref, timeout=FETCH_TIMEOUT_SECONDS) as response:
+            data = response.read(MAX_SOURCE_BYTES + 1)
+    else:
+        with open(source_path(ref), 'rb') as f:
+            data = f.read(MAX_SOURCE_BYTES + 1)
+    
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError('Image is too large')
+    return data
+
+
+def storage_key(source_hash: str, name: str) -> str:
+    return f'perfumes/{source_hash[:2]}/{source_hash}/{name}'
+
+
+def s3_client() -> Any:
+    import boto3
+    return boto3.client(
+        's3',
+        endpoint_url=os.environ.get('IMAGE_S3_ENDPOINT'),
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+    )
+
+
+def read_stored(key: str) -> Optional[bytes]:
+    if IMAGE_STORAGE_DIR:
+        path = os.path.join(IMAGE_STORAGE_DIR, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    client = s3_client()
+    try:
+        return client.get_object(Bucket=os.environ['IMAGE_S3_BUCKET'], Key=key)['Body'].read()
+    except client.exceptions.NoSuchKey:
+        return None
+
+
+def write_stored(key: str, data: bytes) -> None:
+    content_type = CONTENT_TYPES[key.rsplit('.', 1)[-1]]
+    if IMAGE_STORAGE_DIR:
+        path = os.path.join(IMAGE_STORAGE_DIR, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a concurrent reader never sees a partial file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        return
+    
+    s3_client().put_object(
+        Bucket=os.environ['IMAGE_S3_BUCKET'], Key=key, Body=data, ContentType=content_type,
+        CacheControl='public, max-age=31536000, immutable'
+    )
+
+
+def encode_image(image: Image.Image, image_format: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=image_format.upper(), quality=quality)
+    return output.getvalue()
+
+
+def render_variants(source_hash: str, data: bytes) -> Dict[str, Any]:
+    '''
+    Business: Resize one source image to every srcset width in WebP (and AVIF when
+              Pillow supports it), store the files and return the variants map
+    Returns: {'src', 'width', 'height', 'placeholder', 'srcset': {format: srcset string}}
+    '''
+    with Image.open(io.BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    
+    width, height = image.size
+    widths = [w for w in VARIANT_WIDTHS if w <= width] or [width]
+    formats = ['avif', 'webp'] if features.check('avif') else ['webp']
+    
+    srcset: Dict[str, List[str]] = {image_format: [] for image_format in formats}
+    for variant_width in widths:
+        variant_height = max(1, round(height * variant_width / width))
+        resized = image.resize((variant_width, variant_height), Image.LANCZOS)
+        for image_format in formats:
+            key = storage_key(source_hash, f'{variant_width}.{image_format}')
+            quality = AVIF_QUALITY if image_format == 'avif' else WEBP_QUALITY
+            write_stored(key, encode_image(resized, image_format, quality))
+            srcset[image_format].append(f'{IMAGE_BASE_URL}/{key} {variant_width}w')
+    
+    tiny = image.resize((PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.BILINEAR)
+    placeholder = base64.b64encode(encode_image(tiny, 'webp', PLACEHOLDER_QUALITY)).decode('ascii')
+    
+    return {
+        'src': f"{IMAGE_BASE_URL}/{storage_key(source_hash, f'{widths[-1]}.webp')}",
+        'width': width,
+        'height': height,
+        'placeholder': f'data:image/webp;base64,{placeholder}',
+        'srcset': {image_format: ', '.join(entries) for image_format, entries in srcset.items()},
+    }
+
+
+def process_source(ref: str) -> Dict[str, Any]:
+    '''
+    Process pool task: load one source, reuse stored variants of identical bytes
+    or render them, recording a manifest next to the files
+    Returns: {'hash', 'variants'} or {'error'}
+    '''
+    try:
+        data = load_source(ref)
+        source_hash = hashlib.sha256(data).hexdigest()
+        manifest_key = storage_key(source_hash, 'manifest.json')
+        
+        manifest = read_stored(manifest_key)
+        if manifest is not None:
+            return {'hash': source_hash, 'variants': json.loads(manifest)}
+        
+        variants = render_variants(source_hash, data)
+        write_stored(manifest_key, json.dumps(variants).encode())
+        return {'hash': source_hash, 'variants': variants}
+    except Exception as e:
+        return {'error': str(e) or type(e).__name__}
+
+
+def run_pool(refs: List[str]) -> List[Dict[str, Any]]:
+    '''
+    Process sources on all cores; runtimes where the pool cannot start or its
+    tasks cannot be pickled, or whose workers die, fall back to one
+    '''
+    if len(refs) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(len(refs), os.cpu_count() or 1)) as pool:
+                return list(pool.map(process_source, refs))
+        except (OSError, NotImplementedError, pickle.PicklingError, BrokenProcessPool):
+            pass
+    return [process_source(ref) for ref in refs]
+
+
+def pending_images(cursor, perfume_ids: Optional[List[int]], after: int = 0,
+                   limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    '''
+    Perfumes whose current image has no variants linked yet, by id
+    Args: perfume_ids - perfumes to check, or None for the whole catalog after the id `after`;
+          limit - batch size, None for all
+    '''
+    if perfume_ids is not None and not perfume_ids:
+        return []
+    cursor.execute('''
+        SELECT id, image FROM perfumes
+        WHERE image_hash IS NULL AND (%s::int[] IS NULL OR id = ANY(%s::int[])) AND id > %s
+        ORDER BY id
+        LIMIT %s
+    ''', (perfume_ids, perfume_ids, after, limit))
+    return cursor.fetchall()
+
+
+def render_images(pending: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    '''
+    Business: Fetch and render every distinct raster source of the pending perfumes once;
+              touches no database, so callers run it with no transaction open
+    Returns: {source: {'hash', 'variants'} or {'error'}}
+    '''
+    refs = sorted({row['image'] for row in pending if is_raster_source(row['image'])})
+    return dict(zip(refs, run_pool(refs)))
+
+
+def link_images(cursor, pending: List[Dict[str, Any]], results: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Business: Record the manifests of rendered sources and link them via perfumes.image_hash,
+              skipping perfumes whose image changed again since pending_images read it
+    Returns: per-perfume errors for images that could not be processed
+    '''
+    processed = {ref: result for ref, result in results.items() if 'hash' in result}
+    if processed:
+        execute_values(cursor, '''
+            INSERT INTO perfume_images (hash, variants)
+            VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+        ''', list({r['hash']: (r['hash'], json.dumps(r['variants'])) for r in processed.values()}.values()))
+        execute_values(cursor, '''
+            UPDATE perfumes p
+            SET image_hash = v.hash
+            FROM (VALUES %s) AS v(id, image, hash)
+            WHERE p.id = v.id AND p.image = v.image AND p.image_hash IS NULL
+        ''', [(row['id'], row['image'], processed[row['image']]['hash'])
+              for row in pending if row['image'] in processed])
+    
+    return [
+        {'id': row['id'], 'image': row['image'][:200], 'error': results[row['image']]['error']}
+        for row in pending if 'error' in results.get(row['image'], {})
+    ]
@@ -1,13 +1,361 @@
 import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import time
+from psycopg2 import errors
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Dict, Any, List, Optional, Tuple
+from db import get_connection, release_connection
+from similarity import (
+    Features, catalog_version_bumped, rebuild_similar_batch, start_similar_rebuild, update_similar
+)
+from images import link_images, pending_images, render_images
+from instrumentation import instrumented
+from security import is_admin_request, not_configured, record_failure, throttle
 
+BULK_COLUMNS = ('name', 'brand', 'price', 'category', 'volume', 'notes', 'image', 'concentration', 'availability', 'stock')
+# Columns feeding similar-perfume recommendations or image variants; other changes only bump the catalog version
+DERIVED_DATA_FIELDS = {'notes', 'category', 'concentration', 'image'}
+# Perfumes scanned per action=process-images call; each source costs a fetch and an encode
+IMAGE_BATCH_SIZE = 50
+MAX_IMAGE_BATCH_SIZE = 500
+# Scoring time of one batch of the queued full rebuild of recommendations (timer or HTTP)
+REBUILD_BATCH_SECONDS = 20
+# Changed rows listed in PATCH responses; counts and price delta always cover all of them
+MAX_REPORTED_CHANGES = 100
+
+# Old and new values of every row changed by a PATCH, read in the UPDATE itself
+CHANGE_RETURNING = '''
+    RETURNING p.id, p.name, p.brand, old.price AS old_price, p.price,
+              old.availability AS old_availability, p.availability
+'''
+
+
+def bump_catalog_version(cursor, features: Optional[Features] = None) -> None:
+    '''
+    Invalidate cached catalog responses of the perfumes function; the cached similarity
+    features follow the new version, replaced by features when the change re-encoded any
+    '''
+    cursor.execute('SELECT version, updated_at FROM catalog_version WHERE id = 1 FOR UPDATE')
+    previous = cursor.fetchone()
+    cursor.execute('''
+        UPDATE catalog_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        RETURNING version, updated_at
+    ''')
+    current = cursor.fetchone()
+    catalog_version_bumped(
+        (previous['version'], previous['updated_at']), (current['version'], current['updated_at']), features
+    )
+
+
+def catalog_changed(cursor, touched_ids: List[int], deleted_ids: List[int]) -> None:
+    '''Keep recommendations in step with a perfume change, in the same transaction; images follow after commit'''
+    bump_catalog_version(cursor, update_similar(cursor, touched_ids, deleted_ids))
+
+
+def continue_similar_rebuild(conn, cursor) -> Dict[str, Any]:
+    '''Run one time-bounded batch of the queued full rebuild; cached catalog responses refresh after it'''
+    scored, pending = rebuild_similar_batch(conn, time.monotonic() + REBUILD_BATCH_SECONDS)
+    if scored:
+        bump_catalog_version(cursor)
+        conn.commit()
+    return {'success': True, 'scored': scored, 'pending': pending}
+
+
+def refresh_images(conn, cursor, perfume_ids: Optional[List[int]], after: int = 0,
+                   limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    '''
+    Business: Render images of committed perfume changes: fetching and encoding run with no
+              transaction open, so checkouts never wait on locked perfume rows, and only
+              linking the variants takes a short transaction
+    Returns: errors of images that could not be processed (those perfumes keep the raw image
+             until a later action=process-images), and the id to continue after when a
+             limited batch was full
+    '''
+    pending = pending_images(cursor, perfume_ids, after, limit)
+    conn.commit()
+    
+    results = render_images(pending)
+    image_errors: List[Dict[str, Any]] = []
+    if results:
+        image_errors = link_images(cursor, pending, results)
+        bump_catalog_version(cursor)
+        conn.commit()
+    
+    next_after = pending[-1]['id'] if limit is not None and len(pending) == limit else None
+    return image_errors, next_after
+
+
+def parse_bulk_rows(event: Dict[str, Any]) -> Optional[List[Tuple[int, Any]]]:
+    '''
+    Detect bulk import body: JSON array or NDJSON (Content-Type application/x-ndjson)
+    Returns: list of (row number, parsed row or parse error) or None for a single perfume
+    '''
+    headers = event.get('headers', {}) or {}
+    content_type = (headers.get('content-type') or headers.get('Content-Type') or '').lower()
+    raw = event.get('body') or ''
+    
+    if 'ndjson' in content_type:
+        rows: List[Tuple[int, Any]] = []
+        for number, line in enumerate(raw.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((number, json.loads(line)))
+            except ValueError:
+                rows.append((number, ValueError('Invalid JSON')))
+        return rows
+    
+    parsed = json.loads(raw or '{}')
+    if isinstance(parsed, list):
+        return list(enumerate(parsed, start=1))
+    return None
+
+
+def validate_perfume(data: Any) -> Tuple:
+    '''Normalize one imported row into BULK_COLUMNS order, raising ValueError on bad data'''
+    if isinstance(data, Exception):
+        raise data
+    if not isinstance(data, dict):
+        raise ValueError('Row must be an object')
+    
+    for field in ('name', 'brand', 'category', 'volume'):
+        if not isinstance(data.get(field), str) or not data[field].strip():
+            raise ValueError(f'Missing {field}')
+    
+    try:
+        price = int(data.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid price')
+    if price < 0:
+        raise ValueError('Invalid price')
+    
+    notes = data.get('notes', [])
+    if isinstance(notes, str):
+        notes = [n.strip() for n in notes.split(',') if n.strip()]
+    if not isinstance(notes, list) or not all(isinstance(n, str) for n in notes):
+        raise ValueError('Invalid notes')
+    
+    stock = data.get('stock')
+    if stock is not None:
+        try:
+            stock = int(stock)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid stock')
+        if stock < 0:
+            raise ValueError('Invalid stock')
+    
+    return (
+        data['name'].strip(), data['brand'].strip(), price, data['category'],
+        data['volume'], notes, data.get('image') or '/placeholder.svg',
+        data.get('concentration'), bool(data.get('availability', True)), stock
+    )
+
+
+def bulk_upsert(cursor, rows: List[Tuple[int, Any]]) -> Dict[str, Any]:
+    '''
+    Validate all rows in one pass and upsert the valid ones by (brand, name)
+    with a single INSERT ... ON CONFLICT statement
+    Returns: counts of inserted/updated rows, ids and per-row error report
+    '''
+    errors = []
+    valid: Dict[Tuple[str, str], Tuple[int, Tuple]] = {}
+    
+    for number, data in rows:
+        try:
+            values = validate_perfume(data)
+        except ValueError as e:
+            errors.append({'row': number, 'error': str(e)})
+            continue
+        key = (values[1], values[0])
+        if key in valid:
+            # ON CONFLICT cannot touch one row twice, so the last occurrence wins
+            errors.append({'row': valid[key][0], 'error': f'Superseded by row {number} with the same brand and name'})
+        valid[key] = (number, values)
+    
+    inserted = updated = 0
+    ids = []
+    if valid:
+        returned = execute_values(cursor, f'''
+            INSERT INTO perfumes ({', '.join(BULK_COLUMNS)})
+            VALUES %s
+            ON CONFLICT (brand, name) DO UPDATE SET
+                price = EXCLUDED.price, category = EXCLUDED.category, volume = EXCLUDED.volume,
+                notes = EXCLUDED.notes, image = EXCLUDED.image,
+                concentration = EXCLUDED.concentration, availability = EXCLUDED.availability,
+                stock = COALESCE(EXCLUDED.stock, perfumes.stock),
+                image_hash = CASE WHEN perfumes.image IS DISTINCT FROM EXCLUDED.image
+                                  THEN NULL ELSE perfumes.image_hash END
+            RETURNING id, (xmax = 0) AS inserted
+        ''', [values for _, values in valid.values()], page_size=1000, fetch=True)
+        
+        for row in returned:
+            ids.append(row['id'])
+            if row['inserted']:
+                inserted += 1
+            else:
+                updated += 1
+        catalog_changed(cursor, ids, [])
+    
+    errors.sort(key=lambda e: e['row'])
+    return {'inserted': inserted, 'updated': updated, 'ids': ids, 'errors': errors}
+
+
+def validate_patch(data: Dict[str, Any]) -> Dict[str, Any]:
+    '''Validate the columns present in a partial update, raising ValueError on bad data'''
+    changes: Dict[str, Any] = {}
+    for field in ('name', 'brand', 'category', 'volume'):
+        if field in data:
+            if not isinstance(data[field], str) or not data[field].strip():
+                raise ValueError(f'Invalid {field}')
+            changes[field] = data[field].strip()
+    
+    for field in ('price', 'stock'):
+        if field in data:
+            value = data[field]
+            if field == 'stock' and value is None:
+                changes[field] = None
+                continue
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ValueError(f'Invalid {field}')
+            changes[field] = value
+    
+    if 'notes' in data:
+        notes = data['notes']
+        if isinstance(notes, str):
+            notes = [n.strip() for n in notes.split(',') if n.strip()]
+        if not isinstance(notes, list) or not all(isinstance(n, str) for n in notes):
+            raise ValueError('Invalid notes')
+        changes['notes'] = notes
+    
+    if 'availability' in data:
+        if not isinstance(data['availability'], bool):
+            raise ValueError('Invalid availability')
+        changes['availability'] = data['availability']
+    
+    for field in ('image', 'concentration'):
+        if field in data:
+            changes[field] = data[field]
+    
+    if not changes:
+        raise ValueError('Nothing to update')
+    return changes
+
+
+def patch_perfume(cursor, perfume_id: Any, changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''Write only the given columns of one perfume'''
+    assignments = [f'{column} = %s' for column in changes]
+    values = list(changes.values())
+    if 'image' in changes:
+        assignments.append('image_hash = CASE WHEN p.image IS DISTINCT FROM %s THEN NULL ELSE p.image_hash END')
+        values.append(changes['image'])
+    
+    cursor.execute(f'''
+        UPDATE perfumes p
+        SET {', '.join(assignments)}
+        FROM perfumes old
+        WHERE old.id = p.id AND p.id = %s
+        {CHANGE_RETURNING}
+    ''', values + [perfume_id])
+    return cursor.fetchall()
+
+
+def bulk_patch(cursor, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''
+    Business: Apply a price change (percent, delta or set) and/or an availability flip
+              to every perfume matching the filter (brand, category, ids) in one UPDATE
+    Returns: old and new price and availability of the perfumes that actually changed
+    '''
+    filters = body.get('filter')
+    if not isinstance(filters, dict):
+        raise ValueError('Invalid filter')
+    
+    conditions = []
+    values: List[Any] = []
+    for param, column in (('brand', 'brand'), ('category', 'category')):
+        if param in filters:
+            options = filters[param] if isinstance(filters[param], list) else [filters[param]]
+            if not options or not all(isinstance(v, str) for v in options):
+                raise ValueError(f'Invalid {param}')
+            conditions.append(f'p.{column} = ANY(%s)')
+            values.append(options)
+    if 'ids' in filters:
+        ids = filters['ids']
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            raise ValueError('Invalid ids')
+        conditions.append('p.id = ANY(%s)')
+        values.append(ids)
+    if not conditions:
+        raise ValueError('Filter must not be empty')
+    
+    # New values are computed from the row being updated (p), which READ COMMITTED
+    # re-reads after a concurrent change; the old self-join only feeds RETURNING
+    price_expression = 'p.price'
+    price_values: List[Any] = []
+    price = body.get('price')
+    if price is not None:
+        if not isinstance(price, dict) or len(price) != 1:
+            raise ValueError('Invalid price')
+        (kind, amount), = price.items()
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            raise ValueError('Invalid price')
+        if kind == 'percent':
+            price_expression = 'GREATEST(0, round(p.price * (1 + %s / 100.0)))::int'
+        elif kind == 'delta':
+            price_expression = 'GREATEST(0, p.price + round(%s))::int'
+        elif kind == 'set' and amount >= 0:
+            price_expression = 'round(%s)::int'
+        else:
+            raise ValueError('Invalid price')
+        price_values = [amount]
+    
+    availability = body.get('availability')
+    if availability is not None and not isinstance(availability, bool):
+        raise ValueError('Invalid availability')
+    if price is None and availability is None:
+        raise ValueError('Nothing to update')
+    
+    # Rows already at the target values are left alone
+    cursor.execute(f'''
+        UPDATE perfumes p
+        SET price = {price_expression},
+            availability = COALESCE(%s, p.availability)
+        FROM perfumes old
+        WHERE old.id = p.id AND {' AND '.join(conditions)}
+          AND ({price_expression} <> p.price OR COALESCE(%s, p.availability) IS DISTINCT FROM p.availability)
+        {CHANGE_RETURNING}
+    ''', price_values + [availability] + values + price_values + [availability])
+    return cursor.fetchall()
+
+
+def change_report(rows: List[Dict[str, Any]], dry_run: bool) -> Dict[str, Any]:
+    changes = [
+        {
+            'id': row['id'], 'name': row['name'], 'brand': row['brand'],
+            'oldPrice': row['old_price'], 'price': row['price'],
+            'oldAvailability': row['old_availability'], 'availability': row['availability']
+        }
+        for row in sorted(rows, key=lambda row: row['id'])
+    ]
+    return {
+        'dryRun': dry_run,
+        'affected': len(changes),
+        'priceDelta': sum(c['price'] - c['oldPrice'] for c in changes),
+        'changes': changes[:MAX_REPORTED_CHANGES],
+    }
+
+
+@instrumented('perfumes-admin')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Admin API for managing perfumes - create, update, delete
-    Args: event with httpMethod, body; context with request_id
+    Business: Admin API for managing perfumes - create, bulk import, update, partial
+              or bulk price/availability update (PATCH, with dryRun), delete,
+              keeping similar-perfume recommendations and image variants up to date
+    Args: event with httpMethod, body (perfume object, or JSON array / NDJSON for bulk
+          upsert by brand and name), queryStringParameters (action=rebuild-similar,
+          rebuild-similar-batch or process-images), headers (Authorization: Bearer
+          <token from auth>), or a timer trigger continuing a queued rebuild;
+          context with request_id
     Returns: HTTP response with operation result
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -17,33 +365,113 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
+    # Timer triggers carry no httpMethod; HTTP calls are throttled per client IP and
+    # need the admin token before touching the database
+    is_timer = 'httpMethod' not in event
+    if not is_timer:
+        throttled = throttle(event)
+        if throttled:
+            return throttled
+        
+        unavailable = not_configured('ADMIN_TOKEN_SECRET')
+        if unavailable:
+            return unavailable
+        
+        if not is_admin_request(event.get('headers', {}) or {}):
+            record_failure(event)
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Unauthorized'})
+            }
+    
+    conn = get_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        if method == 'POST':
+        action = (event.get('queryStringParameters') or {}).get('action')
+        if is_timer or (method == 'POST' and action == 'rebuild-similar-batch'):
+            # Continue the queued rebuild of recommendations; a no-op when none is queued
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps(continue_similar_rebuild(conn, cursor))
+            }
+        
+        elif method == 'POST' and action == 'process-images':
+            # Backfill variants of perfumes whose image is not processed yet, one batch by id
+            # per call; callers repeat with after=nextAfter until it is null
+            query_params = event.get('queryStringParameters') or {}
+            try:
+                limit = max(1, min(int(query_params.get('limit') or IMAGE_BATCH_SIZE), MAX_IMAGE_BATCH_SIZE))
+                after = int(query_params.get('after') or 0)
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid limit or after'})
+                }
+            
+            image_errors, next_after = refresh_images(conn, cursor, None, after, limit)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'imageErrors': image_errors, 'nextAfter': next_after}, ensure_ascii=False)
+            }
+        
+        elif method == 'POST' and action == 'rebuild-similar':
+            # Scoring the whole catalog takes minutes, so it only queues the rebuild; the timer
+            # trigger (or action=rebuild-similar-batch) runs it in batches
+            start_similar_rebuild(cursor)
+            conn.commit()
+            
+            return {
+                'statusCode': 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'pending': True, 'message': 'Recommendations rebuild queued'})
+            }
+        
+        elif method == 'POST':
+            bulk_rows = parse_bulk_rows(event)
+            if bulk_rows is not None:
+                report = bulk_upsert(cursor, bulk_rows)
+                conn.commit()
+                report['imageErrors'], _ = refresh_images(conn, cursor, report['ids'])
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps(report, ensure_ascii=False)
+                }
+            
             body = json.loads(event.get('body', '{}'))
             
             cursor.execute('''
-                INSERT INTO perfumes (name, brand, price, category, volume, notes, image, concentration, availability)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, name, brand, price, category, volume, notes, image, concentration, availability
+                INSERT INTO perfumes (name, brand, price, category, volume, notes, image, concentration, availability, stock)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, name, brand, price, category, volume, notes, image, concentration, availability, stock
             ''', (
                 body['name'], body['brand'], body['price'], body['category'],
                 body['volume'], body['notes'], body.get('image', '/placeholder.svg'),
-                body.get('concentration'), body.get('availability', True)
+                body.get('concentration'), body.get('availability', True), body.get('stock')
             ))
             
             new_perfume = cursor.fetchone()
+            catalog_changed(cursor, [new_perfume['id']], [])
             conn.commit()
+            refresh_images(conn, cursor, [new_perfume['id']])
             
             return {
                 'statusCode': 201,
@@ -59,17 +487,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cursor.execute('''
                 UPDATE perfumes
                 SET name = %s, brand = %s, price = %s, category = %s,
-                    volume = %s, notes = %s, image = %s, concentration = %s, availability = %s
+                    volume = %s, notes = %s, image = %s, concentration = %s, availability = %s,
+                    stock = CASE WHEN %s THEN %s ELSE stock END,
+                    image_hash = CASE WHEN image IS DISTINCT FROM %s THEN NULL ELSE image_hash END
                 WHERE id = %s
-                RETURNING id, name, brand, price, category, volume, notes, image, concentration, availability
+                RETURNING id, name, brand, price, category, volume, notes, image, concentration, availability, stock
             ''', (
                 body['name'], body['brand'], body['price'], body['category'],
                 body['volume'], body['notes'], body.get('image', '/placeholder.svg'),
-                body.get('concentration'), body.get('availability', True), perfume_id
+                body.get('concentration'), body.get('availability', True),
+                'stock' in body, body.get('stock'), body.get('image', '/placeholder.svg'), perfume_id
             ))
             
             updated_perfume = cursor.fetchone()
+            if updated_perfume:
+                catalog_changed(cursor, [updated_perfume['id']], [])
             conn.commit()
+            if updated_perfume:
+                refresh_images(conn, cursor, [updated_perfume['id']])
             
             if not updated_perfume:
                 return {
@@ -85,6 +520,62 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps(dict(updated_perfume), ensure_ascii=False)
             }
         
+        elif method == 'PATCH':
+            # Partial update of one perfume, or bulk price/availability change by filter;
+            # a dry run executes the same UPDATE and rolls it back
+            try:
+                body = json.loads(event.get('body') or '{}')
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Body must be a JSON object'})
+                }
+            query_params = event.get('queryStringParameters', {}) or {}
+            dry_run = body.get('dryRun') is True or query_params.get('dryRun') in ('true', '1')
+            
+            try:
+                if 'filter' in body:
+                    rows = bulk_patch(cursor, body)
+                else:
+                    changes = validate_patch({k: v for k, v in body.items() if k not in ('id', 'dryRun')})
+                    rows = patch_perfume(cursor, body.get('id'), changes)
+                    if not rows:
+                        return {
+                            'statusCode': 404,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Perfume not found'})
+                        }
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            report = change_report(rows, dry_run)
+            if dry_run:
+                conn.rollback()
+            else:
+                if 'filter' in body or not DERIVED_DATA_FIELDS & changes.keys():
+                    # No similarity or image input changed (price, availability, stock, name...),
+                    # only cached pages change
+                    bump_catalog_version(cursor)
+                else:
+                    catalog_changed(cursor, [row['id'] for row in rows], [])
+                conn.commit()
+                if 'filter' not in body and 'image' in changes:
+                    report['imageErrors'], _ = refresh_images(conn, cursor, [row['id'] for row in rows])
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps(report, ensure_ascii=False)
+            }
+        
         elif method == 'DELETE':
             query_params = event.get('queryStringParameters', {}) or {}
             perfume_id = query_params.get('id')
@@ -98,6 +589,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             cursor.execute('DELETE FROM perfumes WHERE id = %s RETURNING id', (perfume_id,))
             deleted = cursor.fetchone()
+            if deleted:
+                catalog_changed(cursor, [], [deleted['id']])
             conn.commit()
             
             if not deleted:
@@ -121,6 +614,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Method not allowed'})
             }
     
+    except errors.ForeignKeyViolation:
+        conn.rollback()
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Perfume is part of existing orders; mark it unavailable instead'})
+        }
+    
+    except errors.UniqueViolation:
+        conn.rollback()
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Perfume with this brand and name already exists'})
+        }
+    
     except Exception as e:
         conn.rollback()
         return {
@@ -131,4 +640,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        release_connection(conn)
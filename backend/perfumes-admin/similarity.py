@@ -0,0 +1,297 @@
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+from scipy import sparse
+from typing import Any, Dict, List, Optional, Tuple
+
+SIMILAR_TOP_K = 12
+# Rows scored at once: bounds the dense score block to SCORE_CHUNK_ROWS x catalog size
+SCORE_CHUNK_ROWS = 256
+# Key of the session advisory lock held by a rebuild batch, so timer and HTTP batches never overlap
+REBUILD_LOCK_KEY = 7200012
+
+NOTE_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.5
+CONCENTRATION_WEIGHT = 0.3
+
+FeatureKey = Tuple[int, Any]
+Features = Tuple[np.ndarray, sparse.csr_matrix, Dict[str, int]]
+
+# Feature matrix of the committed catalog as of one catalog_version (version, updated_at),
+# so a save re-encodes only the perfumes it changed instead of the whole catalog
+_feature_cache: Dict[str, Tuple[FeatureKey, np.ndarray, sparse.csr_matrix, Dict[str, int]]] = {}
+
+
+def encode_rows(rows: List[Tuple], vocabulary: Dict[str, int]) -> sparse.csr_matrix:
+    '''
+    Business: Encode (id, category, concentration, notes) rows as sparse vectors of notes,
+              category and concentration, L2-normalized so a dot product is cosine similarity
+    Args: vocabulary - feature -> column, extended with features seen for the first time
+    Returns: CSR matrix with one row per input row
+    '''
+    indptr = [0]
+    indices: List[int] = []
+    data: List[float] = []
+    for _, category, concentration, notes in rows:
+        features = {}
+        for note in notes or []:
+            features[vocabulary.setdefault('note:' + note.strip().lower(), len(vocabulary))] = NOTE_WEIGHT
+        features[vocabulary.setdefault('category:' + category, len(vocabulary))] = CATEGORY_WEIGHT
+        if concentration:
+            features[vocabulary.setdefault('concentration:' + concentration, len(vocabulary))] = CONCENTRATION_WEIGHT
+        indices.extend(features.keys())
+        data.extend(features.values())
+        indptr.append(len(indices))
+    
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(rows), max(len(vocabulary), 1))
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+
+
+def load_feature_matrix(cursor, vocabulary: Optional[Dict[str, int]] = None) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    '''
+    Business: Encode every perfume of the catalog
+    Returns: perfume ids and CSR matrix with one row per id
+    '''
+    # Plain tuples: a dict per catalog row costs as much as encoding the catalog
+    with cursor.connection.cursor() as rows_cursor:
+        rows_cursor.execute('SELECT id, category, concentration, notes FROM perfumes ORDER BY id')
+        rows = rows_cursor.fetchall()
+    
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    return ids, encode_rows(rows, {} if vocabulary is None else vocabulary)
+
+
+def catalog_key(cursor, lock: bool = False) -> FeatureKey:
+    with cursor.connection.cursor() as key_cursor:
+        key_cursor.execute(
+            f"SELECT version, updated_at FROM catalog_version WHERE id = 1{' FOR UPDATE' if lock else ''}"
+        )
+        return tuple(key_cursor.fetchone())
+
+
+def cached_features(cursor, key: FeatureKey) -> Features:
+    '''
+    The cached feature matrix when it is of catalog version key, otherwise the catalog
+    encoded again and cached; only for transactions without uncommitted catalog changes
+    '''
+    cached = _feature_cache.get('current')
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2], cached[3]
+    
+    vocabulary: Dict[str, int] = {}
+    ids, matrix = load_feature_matrix(cursor, vocabulary)
+    _feature_cache['current'] = (key, ids, matrix, vocabulary)
+    return ids, matrix, vocabulary
+
+
+def patch_features(cursor, features: Features, changed_ids: List[int]) -> Features:
+    '''Re-encode the changed perfumes in a copy of the matrix; deleted ones drop out'''
+    ids, matrix, vocabulary = features
+    with cursor.connection.cursor() as rows_cursor:
+        rows_cursor.execute('''
+            SELECT id, category, concentration, notes FROM perfumes WHERE id = ANY(%s) ORDER BY id
+        ''', (changed_ids,))
+        rows = rows_cursor.fetchall()
+    
+    kept = ~np.isin(ids, changed_ids)
+    changed = encode_rows(rows, vocabulary)
+    width = max(len(vocabulary), 1)
+    blocks = []
+    for block in (matrix[kept], changed):
+        block.resize((block.shape[0], width))
+        blocks.append(block)
+    return (
+        np.concatenate([ids[kept], np.array([row[0] for row in rows], dtype=np.int64)]),
+        sparse.vstack(blocks, format='csr'),
+        vocabulary,
+    )
+
+
+def catalog_version_bumped(previous_key: FeatureKey, key: FeatureKey, features: Optional[Features]) -> None:
+    '''
+    Carry the cached feature matrix over a catalog_version bump: the saved features
+    become current, and a bump that changed no features (prices, images...) keeps the
+    current matrix when it was of the previous version
+    '''
+    cached = _feature_cache.get('current')
+    if features is not None:
+        _feature_cache['current'] = (key, *features)
+    elif cached is not None and cached[0] == previous_key:
+        _feature_cache['current'] = (key, cached[1], cached[2], cached[3])
+
+
+def top_k_neighbours(matrix: sparse.csr_matrix, positions: np.ndarray,
+                     k: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Score the given rows against the whole catalog: the rows are dense over the small
+    feature vocabulary, so each product is a dense block without a sparse result
+    Returns: neighbour positions and scores per row, best first
+    '''
+    k = min(k, matrix.shape[0] - 1)
+    if k <= 0:
+        return np.zeros((len(positions), 0), dtype=np.int64), np.zeros((len(positions), 0), dtype=np.float32)
+    
+    scores = np.ascontiguousarray((matrix @ matrix[positions].toarray().T).T)
+    scores[np.arange(len(positions)), positions] = -1
+    
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def store_neighbours(cursor, ids: np.ndarray, matrix: sparse.csr_matrix, positions: np.ndarray) -> None:
+    if len(positions) == 0:
+        return
+    
+    # Score first, so the rows below are locked only while they are rewritten
+    rows = []
+    for start in range(0, len(positions), SCORE_CHUNK_ROWS):
+        chunk = positions[start:start + SCORE_CHUNK_ROWS]
+        neighbours, scores = top_k_neighbours(matrix, chunk, SIMILAR_TOP_K)
+        for row_position, row_neighbours, row_scores in zip(chunk, neighbours, scores):
+            perfume_id = int(ids[row_position])
+            rank = 0
+            for neighbour, score in zip(row_neighbours, row_scores):
+                if score <= 0:
+                    break
+                rank += 1
+                rows.append((perfume_id, int(ids[neighbour]), float(score), rank))
+    
+    cursor.execute('DELETE FROM perfume_similar WHERE perfume_id = ANY(%s)', (ids[positions].tolist(),))
+    if rows:
+        execute_values(cursor, '''
+            INSERT INTO perfume_similar (perfume_id, similar_id, score, rank) VALUES %s
+        ''', rows, page_size=1000)
+
+
+def start_similar_rebuild(cursor) -> None:
+    '''Queue a full rebuild; rebuild_similar_batch re-scores the catalog from the first id'''
+    cursor.execute('''
+        UPDATE similar_rebuild
+        SET next_after = 0, started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    ''')
+
+
+def rebuild_similar_batch(conn, deadline: float) -> Tuple[int, bool]:
+    '''
+    Business: Continue the queued full rebuild: re-score perfumes in id order a chunk at
+              a time, committing each chunk with the position reached, until the catalog
+              is done or the monotonic deadline passes
+    Returns: number of perfumes re-scored, and whether the rebuild is still pending
+    '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', (REBUILD_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            # Another batch is running; it keeps the rebuild going
+            conn.commit()
+            return 0, True
+        
+        scored = 0
+        try:
+            cursor.execute('SELECT next_after FROM similar_rebuild WHERE id = 1')
+            after = cursor.fetchone()[0]
+            while after is not None:
+                # Saves between chunks change the catalog version; their features come from the cache
+                ids, matrix, _ = cached_features(cursor, catalog_key(cursor))
+                remaining = np.nonzero(ids > after)[0]
+                if len(remaining) == 0:
+                    # Rows of perfumes deleted since the rebuild started
+                    cursor.execute('''
+                        DELETE FROM perfume_similar s
+                        WHERE NOT EXISTS (SELECT 1 FROM perfumes p WHERE p.id = s.perfume_id)
+                    ''')
+                    after = None
+                else:
+                    chunk = remaining[np.argsort(ids[remaining])[:SCORE_CHUNK_ROWS]]
+                    store_neighbours(cursor, ids, matrix, chunk)
+                    scored += len(chunk)
+                    after = int(ids[chunk[-1]])
+                
+                cursor.execute('''
+                    UPDATE similar_rebuild SET next_after = %s, updated_at = CURRENT_TIMESTAMP WHERE id = 1
+                ''', (after,))
+                conn.commit()
+                if after is not None and time.monotonic() > deadline:
+                    break
+        finally:
+            conn.rollback()
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (REBUILD_LOCK_KEY,))
+            conn.commit()
+        return scored, after is not None
+    finally:
+        cursor.close()
+
+
+def positions_of(ids: np.ndarray, order: np.ndarray, wanted) -> np.ndarray:
+    '''Positions in ids of the wanted ids that are there; order is np.argsort(ids)'''
+    wanted = np.asarray(wanted, dtype=np.int64)
+    if len(ids) == 0 or len(wanted) == 0:
+        return np.zeros(0, dtype=np.int64)
+    found = np.minimum(np.searchsorted(ids, wanted, sorter=order), len(ids) - 1)
+    positions = order[found]
+    return positions[ids[positions] == wanted]
+
+
+def update_similar(cursor, touched_ids: List[int], deleted_ids: List[int]) -> Features:
+    '''
+    Business: Incrementally refresh recommendations after admin changes
+    Args: touched_ids - created or updated perfumes, deleted_ids - removed perfumes
+    Returns: the catalog's features including this change, for catalog_version_bumped
+    Re-scores the touched perfumes, perfumes that listed a touched or deleted
+    perfume, and perfumes for which a touched perfume now beats their weakest neighbour
+    '''
+    # The version row stays locked until commit, so no other save changes the catalog
+    # between this read and the bump that labels the patched matrix
+    key = catalog_key(cursor, lock=True)
+    changed = sorted(set(touched_ids) | set(deleted_ids))
+    cached = _feature_cache.get('current')
+    if cached is not None and cached[0] == key:
+        features = patch_features(cursor, (cached[1], cached[2], cached[3]), changed)
+    else:
+        # This transaction's changes are already in the rows, so nothing is cached until the bump
+        vocabulary: Dict[str, int] = {}
+        ids, matrix = load_feature_matrix(cursor, vocabulary)
+        features = (ids, matrix, vocabulary)
+    ids, matrix, _ = features
+    
+    # Ids are not in order once a save appended its rows, so positions come from a sort
+    order = np.argsort(ids, kind='stable')
+    recompute = set(positions_of(ids, order, touched_ids).tolist())
+    
+    if changed:
+        cursor.execute('SELECT DISTINCT perfume_id FROM perfume_similar WHERE similar_id = ANY(%s)', (changed,))
+        listed = [row['perfume_id'] for row in cursor.fetchall()]
+        recompute.update(positions_of(ids, order, listed).tolist())
+    if deleted_ids:
+        cursor.execute('DELETE FROM perfume_similar WHERE perfume_id = ANY(%s) OR similar_id = ANY(%s)',
+                       (list(deleted_ids), list(deleted_ids)))
+    
+    touched_positions = np.sort(positions_of(ids, order, touched_ids))
+    if len(touched_positions):
+        best = np.zeros(len(ids), dtype=np.float32)
+        for start in range(0, len(touched_positions), SCORE_CHUNK_ROWS):
+            chunk = touched_positions[start:start + SCORE_CHUNK_ROWS]
+            scores = matrix @ matrix[chunk].toarray().T
+            scores[chunk, np.arange(len(chunk))] = 0
+            best = np.maximum(best, scores.max(axis=1))
+        
+        # A perfume's weakest neighbour is its rank-K row; perfumes with fewer than K
+        # neighbours accept any positive score
+        threshold = np.zeros(len(ids), dtype=np.float32)
+        with cursor.connection.cursor() as rows_cursor:
+            rows_cursor.execute('SELECT perfume_id, score FROM perfume_similar WHERE rank = %s', (SIMILAR_TOP_K,))
+            weakest = np.array(rows_cursor.fetchall(), dtype=np.float64).reshape(-1, 2)
+        known = np.isin(weakest[:, 0].astype(np.int64), ids)
+        threshold[positions_of(ids, order, weakest[known, 0].astype(np.int64))] = weakest[known, 1]
+        recompute.update(np.nonzero(best > threshold)[0].tolist())
+    
+    store_neighbours(cursor, ids, matrix, np.array(sorted(recompute), dtype=np.int64))
+    return features
@@ -1,14 +1,317 @@
+import base64
+import hashlib
 import json
-import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+from db import get_connection, release_connection
+from instrumentation import instrumented, timed
+from compression import compressed
 
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# sort parameter -> (column, direction)
+SORT_OPTIONS = {
+    'id': ('id', 'ASC'),
+    'price-asc': ('price', 'ASC'),
+    'price-desc': ('price', 'DESC'),
+    'name-asc': ('name', 'ASC'),
+    'newest': ('id', 'DESC'),
+    'relevance': ('rank', 'DESC'),
+}
+
+SUGGEST_LIMIT = 10
+SIMILAR_LIMIT = 12
+
+# Full-text match (Russian stemming + exact words) or typo-tolerant trigram word match
+SEARCH_CONDITION = (
+    "(search_vector @@ (websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s))"
+    " OR lower(%s) <%% perfume_search_text(name, brand, notes))"
+)
+RANK_EXPRESSION = (
+    "(ts_rank(search_vector, websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s))"
+    " + word_similarity(lower(%s), perfume_search_text(name, brand, notes)))::float8"
+)
+
+# Responsive image variants rendered by perfumes-admin, NULL until processed
+IMAGE_VARIANTS = '(SELECT variants FROM perfume_images WHERE hash = {table}.image_hash)'
+
+CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+MAX_CACHED_RESPONSES = 256
+
+# Serialized responses kept across warm invocations, valid for one catalog version
+_response_cache: Dict[str, str] = {}
+_cached_version: Any = None
+
+CATALOG_PARAMS = (
+    'category', 'brand', 'minPrice', 'maxPrice', 'available', 'concentration',
+    'notes', 'q', 'sort', 'limit', 'cursor',
+)
+
+
+def encode_cursor(sort_value: Any, perfume_id: int) -> str:
+    raw = json.dumps([sort_value, perfume_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[Any, int]:
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        sort_value, perfume_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return sort_value, int(perfume_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_int(params: Dict[str, Any], name: str) -> Any:
+    if not params.get(name):
+        return None
+    try:
+        return int(params[name])
+    except ValueError:
+        raise ValueError(f'Invalid {name}')
+
+
+def build_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''
+    Translate catalog query parameters into WHERE conditions.
+    Brand, category and concentration accept comma-separated lists;
+    notes match perfumes containing all of the given notes.
+    '''
+    conditions = []
+    values: List[Any] = []
+    
+    for param, column in (('category', 'category'), ('brand', 'brand'), ('concentration', 'concentration')):
+        if params.get(param):
+            options = [v.strip() for v in params[param].split(',') if v.strip()]
+            conditions.append(f'{column} = ANY(%s)')
+            values.append(options)
+    
+    min_price = parse_int(params, 'minPrice')
+    if min_price is not None:
+        conditions.append('price >= %s')
+        values.append(min_price)
+    
+    max_price = parse_int(params, 'maxPrice')
+    if max_price is not None:
+        conditions.append('price <= %s')
+        values.append(max_price)
+    
+    if params.get('available') in ('true', '1'):
+        conditions.append('availability = true')
+    elif params.get('available') in ('false', '0'):
+        conditions.append('availability = false')
+    
+    if params.get('notes'):
+        notes = [n.strip() for n in params['notes'].split(',') if n.strip()]
+        conditions.append('notes @> %s::text[]')
+        values.append(notes)
+    
+    return conditions, values
+
+
+def query_catalog(cursor, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Run filtered, sorted, keyset-paginated catalog query; with q it becomes
+    a ranked search sorted by relevance unless another sort is requested
+    Returns: page of perfumes with total count, facet counts and next cursor
+    '''
+    search = (params.get('q') or '').strip()
+    sort = params.get('sort') or ('relevance' if search else 'id')
+    if sort not in SORT_OPTIONS or (sort == 'relevance' and not search):
+        raise ValueError('Invalid sort')
+    sort_column, direction = SORT_OPTIONS[sort]
+    
+    limit = parse_int(params, 'limit') or DEFAULT_PAGE_SIZE
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    conditions, values = build_filters(params)
+    if search:
+        conditions.append(SEARCH_CONDITION)
+        values.extend([search, search, search])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    # Total and facet counts for the filtered set in one pass
+    cursor.execute(f'''
+        SELECT category, brand, concentration,
+               GROUPING(category, brand, concentration) AS grouping_id,
+               COUNT(*) AS count
+        FROM perfumes
+        {where}
+        GROUP BY GROUPING SETS ((category), (brand), (concentration), ())
+    ''', values)
+    
+    total = 0
+    facets: Dict[str, Dict[str, int]] = {'category': {}, 'brand': {}, 'concentration': {}}
+    for row in cursor.fetchall():
+        # GROUPING bitmask: bit set means the column is aggregated away
+        if row['grouping_id'] == 0b111:
+            total = row['count']
+        elif row['grouping_id'] == 0b011:
+            facets['category'][row['category']] = row['count']
+        elif row['grouping_id'] == 0b101:
+            facets['brand'][row['brand']] = row['count']
+        elif row['grouping_id'] == 0b110 and row['concentration'] is not None:
+            facets['concentration'][row['concentration']] = row['count']
+    
+    if sort == 'relevance':
+        cursor_where = ''
+        cursor_values: List[Any] = []
+        if params.get('cursor'):
+            cursor_rank, cursor_id = decode_cursor(params['cursor'])
+            cursor_where = 'WHERE rank < %s OR (rank = %s AND id > %s)'
+            cursor_values = [cursor_rank, cursor_rank, cursor_id]
+        
+        cursor.execute(f'''
+            SELECT ranked.*, {IMAGE_VARIANTS.format(table='ranked')} AS image_variants FROM (
+                SELECT id, name, brand, price, category, volume, notes,
+                       image, image_hash, concentration, availability, {RANK_EXPRESSION} AS rank
+                FROM perfumes
+                {where}
+            ) ranked
+            {cursor_where}
+            ORDER BY rank DESC, id
+            LIMIT %s
+        ''', [search, search, search] + values + cursor_values + [limit + 1])
+    else:
+        page_conditions = list(conditions)
+        page_values = list(values)
+        if params.get('cursor'):
+            cursor_value, cursor_id = decode_cursor(params['cursor'])
+            comparison = '>' if direction == 'ASC' else '<'
+            if sort_column == 'id':
+                page_conditions.append(f'id {comparison} %s')
+                page_values.append(cursor_id)
+            else:
+                page_conditions.append(f'({sort_column}, id) {comparison} (%s, %s)')
+                page_values.extend([cursor_value, cursor_id])
+        page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+        order_by = 'id' if sort_column == 'id' else f'{sort_column} {direction}, id'
+        
+        cursor.execute(f'''
+            SELECT id, name, brand, price, category, volume, notes, 
+                   image, concentration, availability,
+                   {IMAGE_VARIANTS.format(table='perfumes')} AS image_variants
+            FROM perfumes
+            {page_where}
+            ORDER BY {order_by} {direction}
+            LIMIT %s
+        ''', page_values + [limit + 1])
+    
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][sort_column], rows[-1]['id']) if has_more else None
+    
+    return {
+        'perfumes': [serialize_perfume(p) for p in rows],
+        'total': total,
+        'facets': facets,
+        'nextCursor': next_cursor,
+    }
+
+
+def suggest_perfumes(cursor, prefix: str) -> Dict[str, Any]:
+    '''
+    Autocomplete: perfumes whose name starts with prefix, then those whose brand does.
+    Each branch walks its lower(name)/lower(brand) text_pattern_ops index in order
+    (USING ~<~ is that index's sort order) and stops after SUGGEST_LIMIT rows, so
+    short prefixes matching most of the catalog cost the same as long ones
+    '''
+    escaped = prefix.strip().lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    cursor.execute('''
+        SELECT id, name, brand
+        FROM (
+            (SELECT id, name, brand, 1 AS branch FROM perfumes
+             WHERE lower(name) LIKE %s
+             ORDER BY lower(name) USING ~<~, id
+             LIMIT %s)
+            UNION ALL
+            (SELECT id, name, brand, 2 AS branch FROM perfumes
+             WHERE lower(brand) LIKE %s
+             ORDER BY lower(brand) USING ~<~, lower(name) USING ~<~, id
+             LIMIT %s)
+        ) matches
+        ORDER BY branch, CASE branch WHEN 1 THEN lower(name) ELSE lower(brand) END USING ~<~,
+                 lower(name) USING ~<~, id
+    ''', (escaped + '%', SUGGEST_LIMIT, escaped + '%', SUGGEST_LIMIT))
+    
+    # A perfume whose name and brand both match comes back from both branches
+    suggestions = {}
+    for row in cursor.fetchall():
+        suggestions.setdefault(row['id'], dict(row))
+    return {'suggestions': list(suggestions.values())[:SUGGEST_LIMIT]}
+
+
+def similar_perfumes(cursor, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''Precomputed recommendations for one perfume, best match first'''
+    perfume_id = parse_int(params, 'similar')
+    limit = max(1, min(parse_int(params, 'limit') or SIMILAR_LIMIT, SIMILAR_LIMIT))
+    cursor.execute('''
+        SELECT p.id, p.name, p.brand, p.price, p.category, p.volume, p.notes,
+               p.image, p.concentration, p.availability, i.variants AS image_variants
+        FROM perfume_similar s
+        JOIN perfumes p ON p.id = s.similar_id
+        LEFT JOIN perfume_images i ON i.hash = p.image_hash
+        WHERE s.perfume_id = %s
+        ORDER BY s.rank
+        LIMIT %s
+    ''', (perfume_id, limit))
+    return [serialize_perfume(p) for p in cursor.fetchall()]
+
+
+def serialize_perfume(p: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': p['id'],
+        'name': p['name'],
+        'brand': p['brand'],
+        'price': p['price'],
+        'category': p['category'],
+        'volume': p['volume'],
+        'notes': p['notes'],
+        'image': p['image'],
+        'concentration': p['concentration'],
+        'availability': p['availability'],
+        'imageVariants': p['image_variants']
+    }
+
+
+def full_catalog_json(cursor) -> str:
+    '''Whole catalog as a JSON array rendered by Postgres, skipping per-row Python dicts'''
+    cursor.execute(f'''
+        SELECT COALESCE(json_agg(p ORDER BY p.id), '[]')::text AS body
+        FROM (
+            SELECT id, name, brand, price, category, volume, notes,
+                   image, concentration, availability,
+                   {IMAGE_VARIANTS.format(table='perfumes')} AS "imageVariants"
+            FROM perfumes
+        ) p
+    ''')
+    return cursor.fetchone()['body']
+
+
+def get_catalog_version(cursor) -> int:
+    cursor.execute('SELECT version FROM catalog_version WHERE id = 1')
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+
+def make_etag(version: int, cache_key: str) -> str:
+    digest = hashlib.sha1(cache_key.encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+@instrumented('perfumes')
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Get all perfumes from database with optional filters
-    Args: event with httpMethod, queryStringParameters; context with request_id
-    Returns: HTTP response with perfumes list
+    Business: Get perfumes from database with optional filters, sorting and pagination
+    Args: event with httpMethod, queryStringParameters (category, brand, minPrice, maxPrice,
+          available, concentration, notes, q, sort, limit, cursor, or suggest for
+          autocomplete, or similar=<id> for recommendations); context with request_id
+    Returns: HTTP response with full perfumes list, or a filtered page with total and facets
+             when any catalog parameter is given; 304 when If-None-Match matches the ETag;
+             gzip/br-compressed when Accept-Encoding allows and the body is large
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +321,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -31,43 +334,78 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
-    database_url = os.environ.get('DATABASE_URL')
+    global _cached_version
     
-    conn = psycopg2.connect(database_url)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    query_params = event.get('queryStringParameters', {}) or {}
+    cache_key = json.dumps(sorted(query_params.items()), ensure_ascii=False)
+    headers = event.get('headers', {}) or {}
+    if_none_match = headers.get('if-none-match') or headers.get('If-None-Match')
     
-    cursor.execute('''
-        SELECT id, name, brand, price, category, volume, notes, 
-               image, concentration, availability
-        FROM perfumes
-        ORDER BY id
-    ''')
+    conn = get_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    perfumes = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    result = []
-    for p in perfumes:
-        result.append({
-            'id': p['id'],
-            'name': p['name'],
-            'brand': p['brand'],
-            'price': p['price'],
-            'category': p['category'],
-            'volume': p['volume'],
-            'notes': p['notes'],
-            'image': p['image'],
-            'concentration': p['concentration'],
-            'availability': p['availability']
-        })
+    try:
+        version = get_catalog_version(cursor)
+        etag = make_etag(version, cache_key)
+        response_headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': CACHE_CONTROL,
+            'ETag': etag
+        }
+        
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return {
+                'statusCode': 304,
+                'headers': response_headers,
+                'isBase64Encoded': False,
+                'body': ''
+            }
+        
+        if version != _cached_version:
+            _response_cache.clear()
+            _cached_version = version
+        
+        body = _response_cache.get(cache_key)
+        if body is None:
+            if query_params.get('similar'):
+                try:
+                    result = similar_perfumes(cursor, query_params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+            elif query_params.get('suggest'):
+                result = suggest_perfumes(cursor, query_params['suggest'])
+            elif any(query_params.get(name) for name in CATALOG_PARAMS):
+                try:
+                    result = query_catalog(cursor, query_params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+            else:
+                result = None
+                body = full_catalog_json(cursor)
+            
+            if result is not None:
+                with timed('serialize'):
+                    body = json.dumps(result, ensure_ascii=False)
+            if len(_response_cache) >= MAX_CACHED_RESPONSES:
+                _response_cache.pop(next(iter(_response_cache)))
+            _response_cache[cache_key] = body
+    finally:
+        cursor.close()
+        release_connection(conn)
     
     return {
         'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
+        'headers': response_headers,
         'isBase64Encoded': False,
-        'body': json.dumps(result, ensure_ascii=False)
+        'body': body
     }
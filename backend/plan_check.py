@@ -0,0 +1,326 @@
+'''
+Query plan regression check for the backend functions.
+
+Runs every handler in-process against a seeded local Postgres with the slow-query
+log catching all statements, then re-runs each captured statement under
+EXPLAIN (ANALYZE, BUFFERS) inside a rolled back transaction. Fails when a
+selective query reads a large table with a sequential scan, or when the planner's
+total cost grows past the baseline by more than the tolerance.
+
+The first run on a fresh database also adds the records the write scenarios keep
+(the test image, the imported perfume), so save baselines from a later run.
+
+Admin scenarios log in through the auth function, so ADMIN_PASSWORD and
+ADMIN_TOKEN_SECRET must be set.
+
+Usage:
+  DATABASE_URL=... python backend/plan_check.py --seed --perfumes 10000 --orders 100000
+  DATABASE_URL=... python backend/plan_check.py --save-baseline backend/plan_baseline.json
+  DATABASE_URL=... python backend/plan_check.py --baseline backend/plan_baseline.json --tolerance 0.25
+'''
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import uuid
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Every statement goes to the slow-query log with its bound values, so it can be
+# re-run under EXPLAIN ANALYZE; must be set before the functions are imported
+os.environ['SLOW_QUERY_MS'] = '0'
+os.environ['SLOW_QUERY_LOG_VALUES'] = '1'
+# Image variants of created perfumes are written locally instead of to S3
+os.environ.setdefault('IMAGE_STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'plan-check-images'))
+
+import psycopg2
+
+from load_test import seed_database
+from local_server import BACKEND_DIR, load_function, login_in_process
+
+# A sequential scan that keeps less than this share of a table's rows should use an index
+MAX_SEQ_SCAN_SELECTIVITY = 0.05
+MIN_CHECKED_TABLE_ROWS = 1000
+# Costs this small move with a few rows of data, so they are not compared with the baseline
+MIN_COMPARED_COST = 100.0
+
+# Filled with a token from the auth function once main() logs in
+ADMIN_HEADERS: Dict[str, str] = {}
+# 8x8 PNGs, so creating a perfume also renders and links image variants;
+# the import gets two distinct ones so it goes through the process pool
+PLAN_CHECK_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAgAAAAICAIAAABLbSncAAAAFElEQVR4nGM8URHAgA0wYRUdtBIAPO8BoAS2yX0AAAAASUVORK5CYII='
+)
+PLAN_CHECK_IMPORT_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAgAAAAICAIAAABLbSncAAAAFUlEQVR42mM8sSCKARtgYsABBqcEAGORAdK2zLBgAAAAAElFTkSuQmCC'
+)
+
+Event = Dict[str, Any]
+# name, function, event factory taking results of earlier scenarios, tables allowed to be scanned in full
+Scenario = Tuple[str, str, Callable[[Dict[str, Any]], Event], Tuple[str, ...]]
+
+
+def get(params: Dict[str, str], headers: Optional[Dict[str, str]] = None) -> Event:
+    return {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': headers or {}}
+
+
+def send(method: str, body: Any, headers: Optional[Dict[str, str]] = None) -> Event:
+    return {
+        'httpMethod': method,
+        'headers': {'Content-Type': 'application/json', **(headers or {})},
+        'queryStringParameters': {},
+        'body': json.dumps(body, ensure_ascii=False),
+    }
+
+
+def checkout(perfume_id: int) -> Event:
+    return send('POST', {
+        'name': 'Plan Check', 'phone': '+79000000000', 'email': 'plan@example.com',
+        'deliveryMethod': 'courier', 'paymentMethod': 'card', 'deliveryPrice': 500,
+        'items': [{'id': perfume_id, 'quantity': 1}]
+    })
+
+
+def perfume_fields(name: str, **overrides: Any) -> Dict[str, Any]:
+    return {
+        'name': name, 'brand': 'Plan Check', 'price': 5000, 'category': 'Унисекс', 'volume': '50 мл',
+        'notes': ['Роза', 'Мускус'], 'concentration': 'EDP', 'availability': True, **overrides,
+    }
+
+
+def build_scenarios(perfume_id: int) -> List[Scenario]:
+    '''
+    Read scenarios, then writes on records the check creates itself: two checkouts whose
+    orders are cancelled and deleted singly and in bulk, and a perfume that is created
+    with an image, updated, re-imported and deleted
+    '''
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+    perfume_name = f'Plan Check {uuid.uuid4().hex[:8]}'
+    return [
+        ('perfumes-list', 'perfumes', lambda _: get({}), ('perfumes',)),
+        ('perfumes-filter', 'perfumes', lambda _: get({'category': 'Женский', 'maxPrice': '10000', 'sort': 'price-asc', 'limit': '24'}), ()),
+        ('perfumes-brand', 'perfumes', lambda _: get({'brand': 'Load Brand 7', 'sort': 'name-asc'}), ()),
+        ('perfumes-search', 'perfumes', lambda _: get({'q': 'Роза'}), ()),
+        ('perfumes-suggest', 'perfumes', lambda _: get({'suggest': 'Load Perfume 12'}), ()),
+        ('perfumes-similar', 'perfumes', lambda _: get({'similar': str(perfume_id)}), ()),
+        ('orders-page', 'get-orders', lambda _: get({'limit': '50'}, ADMIN_HEADERS), ()),
+        ('orders-next-page', 'get-orders', lambda results: get({'limit': '50', 'cursor': results['orders-page']['nextCursor']}, ADMIN_HEADERS), ()),
+        ('orders-status', 'get-orders', lambda _: get({'status': 'Новый', 'limit': '50'}, ADMIN_HEADERS), ()),
+        ('orders-phone', 'get-orders', lambda _: get({'phone': '+79000000042'}, ADMIN_HEADERS), ()),
+        ('orders-email', 'get-orders', lambda _: get({'email': 'LOAD42@example.com'}, ADMIN_HEADERS), ()),
+        ('orders-analytics', 'get-orders', lambda _: get({'action': 'analytics', 'dateFrom': month_ago}, ADMIN_HEADERS), ()),
+        ('orders-export', 'get-orders', lambda _: get({'format': 'csv', 'dateFrom': month_ago}, ADMIN_HEADERS), ()),
+        ('checkout', 'save-order', lambda _: checkout(perfume_id), ()),
+        ('checkout-second', 'save-order', lambda _: checkout(perfume_id), ()),
+        ('order-cancel', 'get-orders', lambda results: send('PUT', {
+            'orderId': results['checkout']['orderId'], 'status': 'Отменён'
+        }, ADMIN_HEADERS), ()),
+        ('orders-bulk-cancel', 'get-orders', lambda results: send('PUT', {
+            'orderIds': [results['checkout-second']['orderId']], 'status': 'Отменён'
+        }, ADMIN_HEADERS), ()),
+        ('order-delete', 'get-orders', lambda results: send('DELETE', {
+            'orderId': results['checkout']['orderId']
+        }, ADMIN_HEADERS), ()),
+        ('orders-bulk-delete', 'get-orders', lambda results: send('DELETE', {
+            'orderIds': [results['checkout-second']['orderId']]
+        }, ADMIN_HEADERS), ()),
+        ('perfume-create', 'perfumes-admin', lambda _: send('POST', perfume_fields(
+            perfume_name, image=PLAN_CHECK_IMAGE
+        ), ADMIN_HEADERS), ()),
+        ('perfume-update', 'perfumes-admin', lambda results: send('PUT', perfume_fields(
+            perfume_name, id=results['perfume-create']['id'], notes=['Роза', 'Ваниль'], image=PLAN_CHECK_IMAGE
+        ), ADMIN_HEADERS), ()),
+        ('perfume-import', 'perfumes-admin', lambda _: send('POST', [
+            perfume_fields(perfume_name, price=5500, image=PLAN_CHECK_IMAGE),
+            perfume_fields('Plan Check Import', price=6000, image=PLAN_CHECK_IMPORT_IMAGE),
+        ], ADMIN_HEADERS), ()),
+        ('perfume-delete', 'perfumes-admin', lambda results: {
+            'httpMethod': 'DELETE', 'headers': ADMIN_HEADERS,
+            'queryStringParameters': {'id': str(results['perfume-create']['id'])},
+        }, ()),
+        ('catalog-reprice-preview', 'perfumes-admin', lambda _: send('PATCH', {
+            'filter': {'brand': 'Load Brand 7'}, 'price': {'percent': 7}, 'dryRun': True
+        }, ADMIN_HEADERS), ()),
+        ('order-events', 'order-events', lambda _: {'httpMethod': 'POST', 'headers': ADMIN_HEADERS, 'queryStringParameters': {}}, ()),
+    ]
+
+
+def run_handler(handler: Callable, event: Event) -> Tuple[Dict[str, Any], List[str]]:
+    '''Call a handler and collect the statements it ran from its log line'''
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        response = handler(event, SimpleNamespace(request_id='plan-check'))
+    
+    statements = []
+    for line in output.getvalue().splitlines():
+        if line.startswith('{"requestId"'):
+            statements.extend(entry['statement'] for entry in json.loads(line)['slowQueries'])
+    return response, statements
+
+
+def fingerprint(statement: str) -> str:
+    '''Statement shape without literal values, stable across runs'''
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    normalized = re.sub(r'\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', '?', normalized)
+    # Lists of values (ARRAY[...], execute_values rows) count as one value whatever their length
+    normalized = re.sub(r'ARRAY\[[?,\s-]*\]', 'ARRAY[?]', normalized)
+    normalized = re.sub(r'\([?,\s-]*\)(?:\s*,\s*\([?,\s-]*\))*', '(?)', normalized)
+    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def explainable(statement: str) -> Optional[str]:
+    # Server-side cursors log their DECLARE; the plan is the one of the query behind it
+    statement = re.sub(r'^\s*DECLARE\s+\S+\s+CURSOR\s+(?:WITH(?:OUT)?\s+HOLD\s+)?FOR\s+', '', statement, flags=re.I)
+    if statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+        return statement
+    return None
+
+
+def plan_nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(conn, statement: str) -> Dict[str, Any]:
+    '''
+    EXPLAIN ANALYZE executes the statement, so it always runs in a rolled back transaction;
+    a statement that cannot run twice, like an insert of a key the handler committed,
+    gets a plain EXPLAIN without actual rows
+    '''
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement)
+            return cursor.fetchone()[0][0]
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement)
+            return cursor.fetchone()[0][0]
+        finally:
+            conn.rollback()
+
+
+def table_sizes(conn) -> Dict[str, float]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace")
+        sizes = dict(cursor.fetchall())
+    conn.rollback()
+    return sizes
+
+
+def check_plan(plan: Dict[str, Any], sizes: Dict[str, float], allowed_tables: Tuple[str, ...]) -> List[str]:
+    problems = []
+    for node in plan_nodes(plan['Plan']):
+        if node['Node Type'] != 'Seq Scan' or node['Relation Name'] in allowed_tables or 'Actual Rows' not in node:
+            continue
+        if sizes.get(node['Relation Name'], 0) < MIN_CHECKED_TABLE_ROWS:
+            continue
+        kept = node['Actual Rows'] * node['Actual Loops']
+        scanned = kept + node.get('Rows Removed by Filter', 0) * node['Actual Loops']
+        if scanned and kept / scanned < MAX_SEQ_SCAN_SELECTIVITY:
+            problems.append(f"Seq Scan on {node['Relation Name']} keeps {kept} of {scanned} rows")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Check query plans of the backend functions')
+    parser.add_argument('--seed', action='store_true', help='seed synthetic catalog and orders first')
+    parser.add_argument('--perfumes', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--baseline', help='baseline JSON with planner costs per statement')
+    parser.add_argument('--save-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        parser.error('DATABASE_URL is required')
+    
+    ADMIN_HEADERS.update(login_in_process())
+    handlers = {
+        name: load_function(os.path.join(BACKEND_DIR, name))
+        for name in ('perfumes', 'perfumes-admin', 'get-orders', 'save-order', 'order-events')
+    }
+    
+    if args.seed:
+        seed_database(database_url, args.perfumes, args.orders)
+        for name, action in (('get-orders', 'rebuild-analytics'), ('perfumes-admin', 'rebuild-similar')):
+            event = {'httpMethod': 'POST', 'headers': ADMIN_HEADERS, 'queryStringParameters': {'action': action}, 'body': ''}
+            response, _ = run_handler(handlers[name], event)
+            print(f"{name} {action} -> {response['statusCode']}")
+        # The recommendations rebuild is only queued; run its batches like the timer does
+        pending = True
+        while pending:
+            response, _ = run_handler(handlers['perfumes-admin'], {'queryStringParameters': {}})
+            pending = json.loads(response['body'])['pending']
+    
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.seed:
+            # The rebuilds filled perfume_similar and the rollups after the seed's ANALYZE
+            with conn.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            conn.commit()
+        sizes = table_sizes(conn)
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT min(id) FROM perfumes')
+            perfume_id = cursor.fetchone()[0]
+        conn.rollback()
+        
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        
+        results: Dict[str, Any] = {}
+        costs: Dict[str, Dict[str, Any]] = {}
+        failures = []
+        for name, function, make_event, allowed_tables in build_scenarios(perfume_id):
+            response, statements = run_handler(handlers[function], make_event(results))
+            if response['statusCode'] >= 400:
+                failures.append(f"{name}: handler returned {response['statusCode']} {response.get('body')}")
+                continue
+            if response.get('headers', {}).get('Content-Type') == 'application/json' and response.get('body'):
+                results[name] = json.loads(response['body'])
+            
+            for statement in statements:
+                query = explainable(statement)
+                if query is None:
+                    continue
+                key = f'{name}:{fingerprint(query)}'
+                try:
+                    plan = explain(conn, query)
+                except psycopg2.Error as e:
+                    failures.append(f'{key}: EXPLAIN failed: {e}')
+                    continue
+                
+                cost = plan['Plan']['Total Cost']
+                costs[key] = {'cost': cost, 'statement': re.sub(r'\s+', ' ', query).strip()[:160]}
+                print(f"{key:40} cost={cost:<12.1f} time={plan.get('Execution Time', 0):.1f}ms "
+                      f"shared hit={plan['Plan'].get('Shared Hit Blocks', 0)} read={plan['Plan'].get('Shared Read Blocks', 0)}")
+                
+                failures.extend(f'{key}: {problem}' for problem in check_plan(plan, sizes, allowed_tables))
+                expected = baseline.get(key)
+                if expected and cost > max(expected['cost'] * (1 + args.tolerance), MIN_COMPARED_COST):
+                    failures.append(f"{key}: cost {cost:.1f} > baseline {expected['cost']:.1f}")
+    finally:
+        conn.close()
+    
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(costs, f, indent=2, ensure_ascii=False, sort_keys=True)
+    
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import psycopg2
+import psycopg2.extensions
+from typing import Optional
+from instrumentation import connection_factory, timed
+
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
+
+# One connection per warm container: a function instance serves one request at a time
+_connection: Optional[psycopg2.extensions.connection] = None
+
+
+def _connect() -> psycopg2.extensions.connection:
+    with timed('connect'):
+        return psycopg2.connect(os.environ.get('DATABASE_URL'), connection_factory=connection_factory())
+
+
+def _discard() -> None:
+    global _connection
+    if _connection is not None and not _connection.closed:
+        try:
+            _connection.close()
+        except psycopg2.Error:
+            pass
+    _connection = None
+
+
+def _prepare(timeout: int) -> psycopg2.extensions.connection:
+    global _connection
+    if _connection is None or _connection.closed:
+        _connection = _connect()
+    if _connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        _connection.rollback()
+    # Set outside a transaction so a rollback later in the request cannot undo it;
+    # doubles as the health check: fails fast on a dropped connection
+    _connection.autocommit = True
+    try:
+        with _connection.cursor() as cursor:
+            cursor.execute('SET SESSION statement_timeout = %s', (timeout,))
+    finally:
+        if not _connection.closed:
+            _connection.autocommit = False
+    return _connection
+
+
+def get_connection(statement_timeout_ms: Optional[int] = None) -> psycopg2.extensions.connection:
+    '''
+    Business: Reuse the warm-container database connection, reconnecting if it is gone
+    Args: statement_timeout_ms - per-request statement timeout, defaults to DB_STATEMENT_TIMEOUT_MS
+    Returns: connection in a clean state with the timeout applied
+    '''
+    timeout = statement_timeout_ms or DEFAULT_STATEMENT_TIMEOUT_MS
+    try:
+        return _prepare(timeout)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        _discard()
+        return _prepare(timeout)
+
+
+def release_connection(conn: psycopg2.extensions.connection) -> None:
+    '''Return the connection for reuse, rolling back anything left uncommitted'''
+    if conn.closed:
+        _discard()
+        return
+    try:
+        status = conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            _discard()
+        elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard()
@@ -1,13 +1,151 @@
 import json
-import os
-import psycopg2
-from datetime import datetime
-from typing import Dict, Any
+import re
+import secrets
+from psycopg2.extras import execute_values
+from typing import Dict, Any, List, Optional, Tuple
+from db import get_connection, release_connection
+from rollups import apply_orders_to_rollups
+from events import emit_order_events
+from instrumentation import instrumented
 
+# Idempotency keys fit orders.idempotency_key VARCHAR(100); UUIDs and similar tokens
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'[A-Za-z0-9._:-]{1,100}')
+
+# perfume id -> (name, brand, price, availability), valid for one catalog version
+_price_cache: Dict[int, Tuple[str, str, int, bool]] = {}
+_price_cache_version: Any = None
+
+
+def make_order_number_suffix() -> str:
+    '''Short random tail so order numbers are not trivially enumerable'''
+    return secrets.token_hex(2).upper()
+
+
+def find_order_by_idempotency_key(cursor, idempotency_key: str) -> Optional[tuple]:
+    cursor.execute(
+        'SELECT id, order_number, total_amount FROM orders WHERE idempotency_key = %s',
+        (idempotency_key,)
+    )
+    return cursor.fetchone()
+
+
+def load_prices(cursor, perfume_ids: List[int]) -> Dict[int, Tuple[str, str, int, bool]]:
+    '''
+    Business: Current catalog data for ordered perfumes, served from the warm-container
+              cache and refreshed in one query when the catalog version changes
+    Returns: mapping of perfume id to (name, brand, price, availability) for known ids
+    '''
+    global _price_cache_version
+    
+    cursor.execute('SELECT version FROM catalog_version WHERE id = 1')
+    row = cursor.fetchone()
+    version = row[0] if row else 0
+    if version != _price_cache_version:
+        _price_cache.clear()
+        _price_cache_version = version
+    
+    missing = [perfume_id for perfume_id in set(perfume_ids) if perfume_id not in _price_cache]
+    if missing:
+        cursor.execute(
+            'SELECT id, name, brand, price, availability FROM perfumes WHERE id = ANY(%s)',
+            (missing,)
+        )
+        for perfume_id, name, brand, price, availability in cursor.fetchall():
+            _price_cache[perfume_id] = (name, brand, price, availability)
+    
+    return {perfume_id: _price_cache[perfume_id] for perfume_id in perfume_ids if perfume_id in _price_cache}
+
+
+def price_order_items(cursor, items: List[Dict[str, Any]]) -> Tuple[List[Tuple], int]:
+    '''
+    Recompute order lines from catalog data, ignoring client-side names and prices
+    Returns: (perfume_id, name, brand, quantity, price) rows and items subtotal
+    '''
+    if not items:
+        raise ValueError('Order has no items')
+    
+    try:
+        lines = [(int(item['id']), int(item['quantity'])) for item in items]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid order items')
+    if any(quantity <= 0 for _, quantity in lines):
+        raise ValueError('Invalid item quantity')
+    
+    prices = load_prices(cursor, [perfume_id for perfume_id, _ in lines])
+    
+    unknown = sorted({perfume_id for perfume_id, _ in lines if perfume_id not in prices})
+    if unknown:
+        raise ValueError(f'Unknown perfumes: {unknown}')
+    unavailable = sorted({perfume_id for perfume_id, _ in lines if prices[perfume_id][3] is False})
+    if unavailable:
+        raise ValueError(f'Perfumes not available: {unavailable}')
+    
+    rows = []
+    subtotal = 0
+    for perfume_id, quantity in lines:
+        name, brand, price, _ = prices[perfume_id]
+        rows.append((perfume_id, name, brand, quantity, price))
+        subtotal += price * quantity
+    return rows, subtotal
+
+
+def reserve_stock(cursor, order_lines: List[Tuple]) -> List[int]:
+    '''
+    Business: Atomically take stock for all order lines
+    Only perfumes with tracked stock are locked, in id order so concurrent checkouts
+    cannot deadlock; perfumes with untracked (NULL) stock always succeed.
+    FOR NO KEY UPDATE does not conflict with the FOR KEY SHARE locks that inserting
+    order_items takes on perfumes through the perfume_id foreign key
+    Returns: ids of perfumes without enough stock (nothing is reserved then)
+    '''
+    quantities: Dict[int, int] = {}
+    for perfume_id, _, _, quantity, _ in order_lines:
+        quantities[perfume_id] = quantities.get(perfume_id, 0) + quantity
+    
+    cursor.execute('''
+        SELECT id FROM perfumes
+        WHERE id = ANY(%s) AND stock IS NOT NULL
+        ORDER BY id
+        FOR NO KEY UPDATE
+    ''', (sorted(quantities),))
+    tracked_ids = [row[0] for row in cursor.fetchall()]
+    if not tracked_ids:
+        return []
+    
+    reserved = execute_values(cursor, '''
+        UPDATE perfumes p
+        SET stock = p.stock - v.quantity
+        FROM (VALUES %s) AS v(id, quantity)
+        WHERE p.id = v.id AND p.stock >= v.quantity
+        RETURNING p.id
+    ''', [(perfume_id, quantities[perfume_id]) for perfume_id in tracked_ids], fetch=True)
+    
+    return sorted(set(tracked_ids) - {row[0] for row in reserved})
+
+
+def order_response(order_id: int, order_number: str, total_amount: Any) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'success': True,
+            'orderNumber': order_number,
+            'orderId': order_id,
+            'totalAmount': float(total_amount)
+        })
+    }
+
+
+@instrumented('save-order')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Save customer order to database
-    Args: event - dict with httpMethod, body (order data)
+    Business: Save customer order to database, once per Idempotency-Key,
+              with item prices and total recomputed from the catalog and stock reserved
+    Args: event - dict with httpMethod, body (order data), headers (optional Idempotency-Key, up to 100 of A-Z a-z 0-9 . _ : -)
           context - object with request_id attribute
     Returns: HTTP response with order confirmation
     '''
@@ -20,7 +158,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -46,61 +184,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     postal_code = body_data.get('postalCode', '')
     comment = body_data.get('comment', '')
     payment_method = body_data.get('paymentMethod')
-    total_amount = body_data.get('totalAmount')
-    delivery_price = body_data.get('deliveryPrice')
+    delivery_price = body_data.get('deliveryPrice') or 0
     items = body_data.get('items', [])
     
-    # Generate order number
-    order_number = f"ORD-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    headers = event.get('headers', {}) or {}
+    idempotency_key = headers.get('idempotency-key') or headers.get('Idempotency-Key') or None
+    if idempotency_key is not None and not IDEMPOTENCY_KEY_PATTERN.fullmatch(idempotency_key):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'error': 'Idempotency-Key must be 1-100 letters, digits or ._:- characters'
+            })
+        }
     
     # Connect to database
-    database_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Insert order
+        if idempotency_key:
+            existing = find_order_by_idempotency_key(cursor, idempotency_key)
+            if existing:
+                return order_response(*existing)
+        
+        try:
+            if float(delivery_price) < 0:
+                raise ValueError('Invalid delivery price')
+            order_lines, subtotal = price_order_items(cursor, items)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}, ensure_ascii=False)
+            }
+        total_amount = subtotal + float(delivery_price)
+        
+        # Insert order; the number comes from a sequence so concurrent checkouts never collide
         cursor.execute('''
             INSERT INTO orders (
                 order_number, customer_name, customer_phone, customer_email,
                 delivery_method, delivery_address, city, postal_code,
-                comment, payment_method, total_amount, delivery_price, status
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
+                comment, payment_method, total_amount, delivery_price, status,
+                idempotency_key, stock_reserved
+            ) VALUES (
+                'ORD-' || to_char(CURRENT_DATE, 'YYYYMMDD') || '-'
+                    || nextval('order_number_seq') || '-' || %s,
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, true
+            )
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING id, order_number
         ''', (
-            order_number, customer_name, customer_phone, customer_email,
+            make_order_number_suffix(), customer_name, customer_phone, customer_email,
             delivery_method, delivery_address, city, postal_code,
-            comment, payment_method, total_amount, delivery_price, 'pending'
+            comment, payment_method, total_amount, delivery_price, 'pending',
+            idempotency_key
         ))
         
-        order_id = cursor.fetchone()[0]
+        inserted = cursor.fetchone()
+        
+        if inserted is None:
+            # Retried submission: a concurrent insert with this key has committed
+            conn.rollback()
+            existing = find_order_by_idempotency_key(cursor, idempotency_key)
+            return order_response(*existing)
+        
+        order_id, order_number = inserted
         
-        # Insert order items
-        for item in items:
-            cursor.execute('''
-                INSERT INTO order_items (
-                    order_id, perfume_id, perfume_name, perfume_brand, quantity, price
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            ''', (
-                order_id, item['id'], item['name'], item['brand'],
-                item['quantity'], item['price']
-            ))
+        # Insert all order items in one statement
+        execute_values(cursor, '''
+            INSERT INTO order_items (
+                order_id, perfume_id, perfume_name, perfume_brand, quantity, price
+            ) VALUES %s
+        ''', [(order_id,) + line for line in order_lines])
+        
+        apply_orders_to_rollups(cursor, [order_id], 1)
+        # Notifications and other follow-ups run in the order-events worker
+        emit_order_events(cursor, [order_id], 'order.created')
+        
+        # Reserve last to keep hot perfume rows locked for as short as possible
+        out_of_stock = reserve_stock(cursor, order_lines)
+        if out_of_stock:
+            conn.rollback()
+            return {
+                'statusCode': 409,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Not enough stock', 'perfumeIds': out_of_stock})
+            }
         
         conn.commit()
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps({
-                'success': True,
-                'orderNumber': order_number,
-                'orderId': order_id
-            })
-        }
+        return order_response(order_id, order_number, total_amount)
     
     except Exception as e:
         conn.rollback()
@@ -112,4 +286,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cursor.close()
-        conn.close()
+        release_connection(conn)
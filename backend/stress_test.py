@@ -0,0 +1,785 @@
+'''
+Concurrency checks and memory benchmarks for the backend functions.
+
+Each check runs the functions against a local Postgres and fails (exit code 1)
+when an invariant does not hold. Concurrency checks drive them through
+local_server.py; start it with a high ADMIN_RATE_LIMIT since they call admin
+endpoints. Benchmarks import the function in-process to measure it alone.
+Seed the database with load_test.py first. Admin calls log in through the auth
+function, so set ADMIN_PASSWORD (and ADMIN_TOKEN_SECRET for in-process checks).
+
+Usage:
+  DATABASE_URL=... python backend/stress_test.py connections --workers 8
+  DATABASE_URL=... python backend/stress_test.py checkouts --requests 500 --concurrency 100
+  DATABASE_URL=... python backend/stress_test.py hot-sku --requests 500 --concurrency 100 --stock 200
+  DATABASE_URL=... python backend/stress_test.py export-memory --max-rss-mb 64
+  DATABASE_URL=... python backend/stress_test.py suggest --requests 500 --max-ms 10
+  DATABASE_URL=... python backend/stress_test.py etags
+  DATABASE_URL=... python backend/stress_test.py similarity --sizes 10000,50000,100000
+  DATABASE_URL=... python backend/stress_test.py orders-listing --sizes 1000,10000,100000
+  DATABASE_URL=... python backend/stress_test.py order-events --sink-failures 3
+'''
+import argparse
+import base64
+import contextlib
+import gzip
+import inspect
+import json
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from psycopg2.extras import RealDictCursor
+
+from load_test import (
+    SEED_ORDER_ITEMS_SQL, SEED_ORDERS_SQL, admin_headers, http, load_perfume_ids, login, percentile
+)
+from local_server import BACKEND_DIR, load_function, login_in_process
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fixed autocomplete prefixes: one letter, long and brand-only matches, no match, Cyrillic
+SUGGEST_PREFIXES = ['l', 'load perfume 4', 'load brand 17', 'zzz', 'роза']
+
+# Single-perfume admin saves timed per catalog size in the similarity benchmark
+SIMILARITY_SAVES = 5
+
+# Orders listing benchmark: requests timed per scenario and table size, in a scratch
+# schema that shadows orders and order_items for the get-orders connection
+ORDERS_LISTING_REPEATS = 20
+ORDERS_LISTING_SCHEMA = 'stress_orders'
+
+# Outbox check: order_events in a scratch schema for the order-events connection
+ORDER_EVENTS_SCHEMA = 'stress_events'
+
+# Every DUPLICATE_EVERY-th checkout is sent DUPLICATES times at once with one Idempotency-Key
+DUPLICATE_EVERY = 10
+DUPLICATES = 5
+
+
+def function_backends(database_url: str) -> Set[int]:
+    '''Backend pids of every other connection to the database'''
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT pid FROM pg_stat_activity
+                WHERE datname = current_database() AND pid <> pg_backend_pid() AND backend_type = 'client backend'
+            ''')
+            return {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+
+def run_parallel(task: Callable[[int], int], count: int, concurrency: int) -> List[int]:
+    '''Run task(i) for i in range(count) on concurrency threads; returns the status codes'''
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(task, range(count)))
+
+
+def check_connections(base_url: str, database_url: str, workers: int, requests: int, concurrency: int) -> List[str]:
+    '''
+    Every worker keeps one connection across requests, and after the database drops
+    all of them the next requests reconnect instead of failing
+    '''
+    def list_orders(_: int) -> int:
+        return http(base_url, ('GET', '/get-orders/?limit=10', None, admin_headers()))[0]
+    
+    failures = []
+    statuses = run_parallel(list_orders, requests, concurrency)
+    before = function_backends(database_url)
+    errors = sum(status != 200 for status in statuses)
+    print(f'{requests} requests: {errors} errors, {len(before)} connections for {workers} workers')
+    if errors:
+        failures.append(f'{errors} of {requests} requests failed')
+    if len(before) > workers:
+        failures.append(f'{len(before)} connections for {workers} workers, connections are not reused')
+    
+    # Drop every function connection, like a database restart or failover
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(pid) FROM unnest(%s::int[]) AS pid', (sorted(before),))
+    finally:
+        conn.close()
+    time.sleep(0.5)
+    
+    statuses = run_parallel(list_orders, requests, concurrency)
+    after = function_backends(database_url)
+    errors = sum(status != 200 for status in statuses)
+    print(f'after terminating {len(before)} backends: {errors} errors, {len(after)} new connections')
+    if errors:
+        failures.append(f'{errors} of {requests} requests failed after the connections were terminated')
+    if after & before:
+        failures.append('terminated connections are still in use')
+    return failures
+
+
+def checkout_body(perfume_ids: List[int], quantity: int = 1) -> bytes:
+    return json.dumps({
+        'name': 'Stress Test', 'phone': '+79000000000', 'email': 'stress@example.com',
+        'deliveryMethod': 'courier', 'paymentMethod': 'card', 'deliveryPrice': 500,
+        'items': [{'id': perfume_id, 'quantity': quantity} for perfume_id in perfume_ids]
+    }).encode()
+
+
+def post_checkout(base_url: str, idempotency_key: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+    '''Returns status 0 when the request got no response, e.g. timed out'''
+    try:
+        status, response = http(base_url, (
+            'POST', '/save-order/', body, {'Content-Type': 'application/json', 'Idempotency-Key': idempotency_key}
+        ))
+    except OSError as e:
+        return 0, {'error': str(e) or type(e).__name__}
+    try:
+        return status, json.loads(response)
+    except ValueError:
+        return status, {'error': response[:200].decode(errors='replace')}
+
+
+def check_checkouts(base_url: str, database_url: str, perfume_ids: List[int], requests: int,
+                    concurrency: int) -> List[str]:
+    '''
+    Parallel checkouts never share an order number, and submissions repeated
+    concurrently with one Idempotency-Key create exactly one order
+    '''
+    run_id = uuid.uuid4().hex[:8]
+    submissions = []
+    for i in range(requests):
+        key = f'stress-{run_id}-{i}'
+        body = checkout_body([perfume_ids[i % len(perfume_ids)]])
+        submissions.extend([(key, body)] * (DUPLICATES if i % DUPLICATE_EVERY == 0 else 1))
+    
+    results = run_parallel(lambda i: post_checkout(base_url, *submissions[i]), len(submissions), concurrency)
+    
+    failures = []
+    orders_by_key: Dict[str, Set[Tuple[int, str]]] = {}
+    for (key, _), (status, body) in zip(submissions, results):
+        if status != 200:
+            failures.append(f"{key}: {status} {body.get('error')}")
+            continue
+        orders_by_key.setdefault(key, set()).add((body['orderId'], body['orderNumber']))
+    
+    for key, orders in orders_by_key.items():
+        if len(orders) > 1:
+            failures.append(f'{key}: one Idempotency-Key returned {len(orders)} different orders')
+    order_numbers = [number for orders in orders_by_key.values() for _, number in orders]
+    if len(set(order_numbers)) != len(order_numbers):
+        failures.append(f'{len(order_numbers) - len(set(order_numbers))} duplicate order numbers')
+    
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT count(*), count(DISTINCT idempotency_key), count(DISTINCT order_number)
+                FROM orders WHERE idempotency_key LIKE %s
+            ''', (f'stress-{run_id}-%',))
+            stored, keys, numbers = cursor.fetchone()
+    finally:
+        conn.close()
+    
+    print(f'{len(submissions)} submissions of {requests} checkouts: {len(failures)} failures, '
+          f'{stored} orders stored for {keys} keys with {numbers} order numbers')
+    if (stored, keys, numbers) != (requests, requests, requests):
+        failures.append(f'expected {requests} orders with distinct keys and numbers, found {stored}/{keys}/{numbers}')
+    return failures
+
+
+def set_stock(database_url: str, perfume_id: int, stock: Optional[int]) -> Optional[int]:
+    '''Set the stock of one perfume; returns the previous value'''
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                UPDATE perfumes p SET stock = %s
+                FROM perfumes old
+                WHERE old.id = p.id AND p.id = %s
+                RETURNING old.stock
+            ''', (stock, perfume_id))
+            previous = cursor.fetchone()[0]
+        conn.commit()
+        return previous
+    finally:
+        conn.close()
+
+
+def check_hot_sku(base_url: str, database_url: str, perfume_id: int, stock: int, requests: int,
+                  concurrency: int) -> List[str]:
+    '''
+    Many parallel checkouts of one perfume: with tracked stock exactly that many
+    succeed and the rest get 409 without deadlocks or errors, and with untracked
+    stock all of them succeed
+    '''
+    failures = []
+    previous = set_stock(database_url, perfume_id, stock)
+    try:
+        for tracked in (True, False):
+            if not tracked:
+                set_stock(database_url, perfume_id, None)
+            run_id = uuid.uuid4().hex[:8]
+            body = checkout_body([perfume_id])
+            started = time.perf_counter()
+            results = run_parallel(
+                lambda i: post_checkout(base_url, f'hot-{run_id}-{i}', body)[0], requests, concurrency
+            )
+            elapsed = time.perf_counter() - started
+            
+            succeeded = results.count(200)
+            rejected = results.count(409)
+            errors = requests - succeeded - rejected
+            expected = min(requests, stock) if tracked else requests
+            
+            conn = psycopg2.connect(database_url)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT stock FROM perfumes WHERE id = %s', (perfume_id,))
+                    final_stock = cursor.fetchone()[0]
+                    cursor.execute('SELECT count(*) FROM orders WHERE idempotency_key LIKE %s', (f'hot-{run_id}-%',))
+                    stored = cursor.fetchone()[0]
+            finally:
+                conn.close()
+            
+            label = f'stock {stock}' if tracked else 'untracked stock'
+            print(f'{requests} checkouts of perfume {perfume_id} with {label} in {elapsed:.1f}s: '
+                  f'{succeeded} succeeded, {rejected} rejected, {errors} errors, {stored} orders stored, '
+                  f'final stock {final_stock}')
+            if errors:
+                failures.append(f'{label}: {errors} checkouts failed with statuses {sorted(set(results) - {200, 409})}')
+            if succeeded != expected or stored != succeeded:
+                failures.append(f'{label}: expected {expected} orders, {succeeded} succeeded and {stored} were stored')
+            if tracked and final_stock != stock - succeeded:
+                failures.append(f'{label}: final stock {final_stock}, expected {stock - succeeded}')
+            if not tracked and final_stock is not None:
+                failures.append(f'untracked stock became {final_stock}')
+    finally:
+        set_stock(database_url, perfume_id, previous)
+    return failures
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_export_memory(database_url: str, export_format: str, max_rss_mb: float) -> List[str]:
+    '''
+    Export every order page by page with gzip accepted and report how much the
+    process peak RSS grows; it must stay flat however many orders are exported
+    '''
+    os.environ['DATABASE_URL'] = database_url
+    handler = load_function(os.path.join(BACKEND_DIR, 'get-orders'))
+    headers = {**login_in_process(), 'Accept-Encoding': 'gzip'}
+    
+    def export_page(params: Dict[str, str]) -> Dict[str, Any]:
+        event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return handler(event, SimpleNamespace(request_id='stress-test'))
+    
+    # Warm up imports and the connection before taking the baseline
+    export_page({'format': export_format, 'dateFrom': '2999-01-01'})
+    baseline = peak_rss_mb()
+    
+    started = time.perf_counter()
+    pages = response_bytes = 0
+    params = {'format': export_format}
+    while True:
+        response = export_page(params)
+        if response['statusCode'] != 200:
+            return [f"export returned {response['statusCode']}: {response.get('body')}"]
+        pages += 1
+        response_bytes += len(response['body'])
+        next_cursor = response['headers'].get('X-Next-Cursor')
+        if not next_cursor:
+            break
+        params = {'format': export_format, 'cursor': next_cursor}
+    
+    growth = peak_rss_mb() - baseline
+    print(f'{export_format} export: {pages} pages, {response_bytes / 2 ** 20:.1f} MB sent (gzip, base64) '
+          f'in {time.perf_counter() - started:.1f}s, peak RSS {baseline:.0f} MB -> +{growth:.1f} MB')
+    if growth > max_rss_mb:
+        return [f'peak RSS grew by {growth:.1f} MB, more than {max_rss_mb} MB']
+    return []
+
+
+def check_suggest_latency(database_url: str, requests: int, max_ms: float) -> List[str]:
+    '''
+    Time autocomplete in-process with the response cache cleared before every call,
+    for fixed prefixes and prefixes of random catalog names and brands; p95 must
+    stay under max_ms however large the catalog is
+    '''
+    os.environ['DATABASE_URL'] = database_url
+    handler = load_function(os.path.join(BACKEND_DIR, 'perfumes'))
+    response_cache = inspect.unwrap(handler).__globals__['_response_cache']
+    
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM perfumes')
+            catalog_size = cursor.fetchone()[0]
+            cursor.execute('SELECT name, brand FROM perfumes ORDER BY random() LIMIT %s', (requests,))
+            samples = cursor.fetchall()
+    finally:
+        conn.close()
+    rng = random.Random(0)
+    prefixes = SUGGEST_PREFIXES + [
+        rng.choice(sample)[:rng.randint(1, 12)].lower() for sample in samples
+    ][:max(requests - len(SUGGEST_PREFIXES), 0)]
+    
+    def suggest(prefix: str) -> Tuple[float, Dict[str, Any]]:
+        response_cache.clear()
+        event = {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'suggest': prefix}}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            response = handler(event, SimpleNamespace(request_id='stress-test'))
+            return (time.perf_counter() - started) * 1000, response
+    
+    # Warm up imports and the connection
+    suggest('warm up')
+    failures = []
+    timings = []
+    for prefix in prefixes:
+        elapsed_ms, response = suggest(prefix)
+        if response['statusCode'] != 200:
+            failures.append(f"suggest={prefix!r} returned {response['statusCode']}: {response.get('body')}")
+        timings.append(elapsed_ms)
+    
+    p50, p95 = percentile(timings, 0.5), percentile(timings, 0.95)
+    print(f'suggest on {catalog_size} perfumes: {len(timings)} prefixes, '
+          f'p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {max(timings):.2f} ms')
+    if p95 > max_ms:
+        failures.append(f'suggest p95 {p95:.2f} ms is above {max_ms} ms')
+    return failures
+
+
+def check_etags(database_url: str) -> List[str]:
+    '''
+    The full catalog in-process per Accept-Encoding: identity, gzip and br responses
+    carry different ETags and Vary: Accept-Encoding, decode to the same body, and a
+    validator revalidates (304) only a request for its own encoding
+    '''
+    os.environ['DATABASE_URL'] = database_url
+    handler = load_function(os.path.join(BACKEND_DIR, 'perfumes'))
+    
+    def get(accept_encoding: Optional[str], if_none_match: Optional[str] = None) -> Dict[str, Any]:
+        headers = {}
+        if accept_encoding:
+            headers['Accept-Encoding'] = accept_encoding
+        if if_none_match:
+            headers['If-None-Match'] = if_none_match
+        event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {}}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return handler(event, SimpleNamespace(request_id='stress-test'))
+    
+    failures = []
+    encodings = [None, 'gzip'] + (['br'] if brotli is not None else [])
+    responses = {}
+    for encoding in encodings:
+        # Twice, so the second gzip and br bodies come from the compressed-body cache
+        for _ in range(2):
+            response = get(encoding)
+            label = encoding or 'identity'
+            if response['statusCode'] != 200:
+                failures.append(f"{label}: status {response['statusCode']}")
+                continue
+            if response['headers'].get('Vary') != 'Accept-Encoding':
+                failures.append(f"{label}: Vary is {response['headers'].get('Vary')!r}")
+            body = response['body']
+            if response.get('isBase64Encoded'):
+                data = base64.b64decode(body)
+                coding = response['headers'].get('Content-Encoding')
+                body = (gzip.decompress(data) if coding == 'gzip' else brotli.decompress(data)).decode()
+            if encoding in responses and body != responses[encoding][1]:
+                failures.append(f'{label}: the cached body differs from the first one')
+            responses[encoding] = (response['headers'].get('ETag'), body)
+    if failures:
+        return failures
+    
+    etags = {encoding or 'identity': etag for encoding, (etag, _) in responses.items()}
+    print(f'catalog ETags: {etags}')
+    if len(set(etags.values())) != len(etags):
+        failures.append(f'encodings share an ETag: {etags}')
+    if len({body for _, body in responses.values()}) != 1:
+        failures.append('encodings decode to different bodies')
+    
+    for encoding in encodings:
+        for validator in encodings:
+            response = get(encoding, responses[validator][0])
+            expected = 304 if validator == encoding else 200
+            if response['statusCode'] != expected:
+                failures.append(f"{encoding or 'identity'} request with the {validator or 'identity'} ETag: "
+                                f"{response['statusCode']}, expected {expected}")
+            elif expected == 304 and (
+                response['headers'].get('ETag') != responses[encoding][0]
+                or response['headers'].get('Vary') != 'Accept-Encoding'
+            ):
+                failures.append(f"{encoding or 'identity'} 304 has ETag {response['headers'].get('ETag')} "
+                                f"and Vary {response['headers'].get('Vary')!r}")
+    return failures
+
+
+def check_similarity_cost(database_url: str, sizes: List[int], max_save_ms: float) -> List[str]:
+    '''
+    Time recommendation upkeep per catalog size through the perfumes-admin code: the
+    queued full rebuild run batch by batch, and a single-perfume save (update_similar
+    plus the version bump), which patches the cached feature matrix instead of encoding
+    the catalog again. Each size runs on temporary perfumes, perfume_similar,
+    catalog_version and similar_rebuild tables that shadow the real ones, filled with
+    random notes, categories and concentrations drawn from the catalog
+    '''
+    os.environ['DATABASE_URL'] = database_url
+    admin = inspect.unwrap(load_function(os.path.join(BACKEND_DIR, 'perfumes-admin'))).__globals__
+    similarity = sys.modules[admin['update_similar'].__module__]
+    failures = []
+    conn = psycopg2.connect(database_url)
+    try:
+        for size in sizes:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Temporary tables come first in the search path, so the unqualified
+                # table names in perfumes-admin resolve to them
+                cursor.execute('''
+                    CREATE TEMP TABLE perfumes AS
+                    WITH vocabulary AS (
+                        SELECT (SELECT array_agg(DISTINCT note) FROM public.perfumes, unnest(notes) note) AS notes,
+                               (SELECT array_agg(DISTINCT category) FROM public.perfumes) AS categories,
+                               (SELECT array_agg(DISTINCT concentration) FROM public.perfumes) AS concentrations
+                    )
+                    SELECT g AS id,
+                           categories[1 + floor(random() * cardinality(categories))::int] AS category,
+                           concentrations[1 + floor(random() * cardinality(concentrations))::int] AS concentration,
+                           ARRAY(
+                               SELECT notes[1 + floor(random() * cardinality(notes))::int]
+                               FROM generate_series(1, 2 + g %% 4)
+                           ) AS notes
+                    FROM vocabulary, generate_series(1, %s) g
+                ''', (size,))
+                cursor.execute('ALTER TABLE perfumes ADD PRIMARY KEY (id)')
+                for table in ('perfume_similar', 'catalog_version', 'similar_rebuild'):
+                    cursor.execute(f'CREATE TEMP TABLE {table} (LIKE public.{table} INCLUDING ALL)')
+                cursor.execute('INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 0, clock_timestamp())')
+                cursor.execute('INSERT INTO similar_rebuild (id) VALUES (1)')
+                similarity.start_similar_rebuild(cursor)
+                conn.commit()
+                
+                started = time.perf_counter()
+                batches = 1
+                while admin['continue_similar_rebuild'](conn, cursor)['pending']:
+                    batches += 1
+                rebuild_s = time.perf_counter() - started
+                
+                # Autovacuum skips temporary tables; the real table is vacuumed as it fills
+                conn.autocommit = True
+                cursor.execute('VACUUM ANALYZE perfume_similar')
+                conn.autocommit = False
+                
+                started = time.perf_counter()
+                similarity.load_feature_matrix(cursor)
+                load_ms = (time.perf_counter() - started) * 1000
+                conn.rollback()
+                
+                save_ms = []
+                for perfume_id in random.Random(size).sample(range(1, size + 1), SIMILARITY_SAVES):
+                    cursor.execute('''
+                        UPDATE perfumes SET notes = array_append(notes, 'stress test') WHERE id = %s
+                    ''', (perfume_id,))
+                    started = time.perf_counter()
+                    admin['catalog_changed'](cursor, [perfume_id], [])
+                    save_ms.append((time.perf_counter() - started) * 1000)
+                    conn.commit()
+                
+                for table in ('perfumes', 'perfume_similar', 'catalog_version', 'similar_rebuild'):
+                    cursor.execute(f'DROP TABLE pg_temp.{table}')
+                conn.commit()
+            
+            p50 = percentile(save_ms, 0.5)
+            print(f'{size} perfumes: rebuild {rebuild_s:.1f}s in {batches} batches; single-perfume save '
+                  f'p50 {p50:.0f} ms, max {max(save_ms):.0f} ms; encoding the whole catalog takes {load_ms:.0f} ms')
+            if p50 > max_save_ms:
+                failures.append(f'{size} perfumes: single-perfume save p50 {p50:.0f} ms is above {max_save_ms} ms')
+    finally:
+        conn.close()
+    return failures
+
+
+def check_orders_listing(database_url: str, sizes: List[int]) -> List[str]:
+    '''
+    Time the admin orders listing in-process as the orders table grows: the first
+    page at the default and the largest page size, a status filter and the next
+    page by cursor. Each runs a fixed number of statements, read from the
+    Server-Timing header, whatever the table size or page size. Orders and their
+    items are seeded in a scratch schema, dropped at the end
+    '''
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {ORDERS_LISTING_SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {ORDERS_LISTING_SCHEMA}')
+        for table in ('orders', 'order_items'):
+            cursor.execute(f'CREATE TABLE {ORDERS_LISTING_SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL)')
+        cursor.execute(f'SET search_path = {ORDERS_LISTING_SCHEMA}, public')
+    
+    os.environ['DATABASE_URL'] = make_dsn(database_url, options=f'-c search_path={ORDERS_LISTING_SCHEMA},public')
+    os.environ['ADMIN_RATE_LIMIT'] = str(10 ** 9)
+    handler = load_function(os.path.join(BACKEND_DIR, 'get-orders'))
+    headers = login_in_process()
+    
+    def list_orders(params: Dict[str, str]) -> Tuple[float, int, Dict[str, Any]]:
+        event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': params}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            response = handler(event, SimpleNamespace(request_id='stress-test'))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        match = re.search(r'(\d+) statements', response['headers'].get('Server-Timing', ''))
+        return elapsed_ms, int(match.group(1)) if match else -1, response
+    
+    scenarios: List[Tuple[str, Callable[[], Dict[str, str]]]] = [
+        ('first page', lambda: {'limit': '50'}),
+        ('largest page', lambda: {'limit': '200'}),
+        ('status filter', lambda: {'limit': '50', 'status': 'pending'}),
+        ('next page', lambda: {'limit': '50', 'cursor': next_cursor}),
+    ]
+    failures = []
+    # scenario -> statement counts seen at any size
+    statement_counts: Dict[str, Set[int]] = {name: set() for name, _ in scenarios}
+    try:
+        for size in sorted(sizes):
+            with conn.cursor() as cursor:
+                cursor.execute(SEED_ORDERS_SQL, (size,))
+                cursor.execute(SEED_ORDER_ITEMS_SQL)
+                cursor.execute(f'ANALYZE {ORDERS_LISTING_SCHEMA}.orders, {ORDERS_LISTING_SCHEMA}.order_items')
+            
+            _, _, first = list_orders({'limit': '50'})
+            next_cursor = json.loads(first['body'])['nextCursor']
+            report = []
+            for name, make_params in scenarios:
+                timings = []
+                for _ in range(ORDERS_LISTING_REPEATS):
+                    elapsed_ms, statements, response = list_orders(make_params())
+                    if response['statusCode'] != 200:
+                        failures.append(f"{size} orders, {name}: returned {response['statusCode']}: {response.get('body')}")
+                        break
+                    timings.append(elapsed_ms)
+                    statement_counts[name].add(statements)
+                if timings:
+                    report.append(f'{name} p50 {percentile(timings, 0.5):.1f} ms')
+            print(f"{size} orders: {', '.join(report)}; statements per request "
+                  f"{', '.join(f'{name} {sorted(counts)}' for name, counts in statement_counts.items())}")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {ORDERS_LISTING_SCHEMA} CASCADE')
+        conn.close()
+    
+    all_counts = set().union(*statement_counts.values())
+    if len(all_counts) > 1:
+        failures.append(f'statements per listing vary with table or page size: {statement_counts}')
+    return failures
+
+
+class StubSink(ThreadingHTTPServer):
+    '''
+    Webhook for order-events that answers 500 to the first fail_first posts of each
+    event and 200 afterwards, optionally after delay_seconds; records every answer
+    '''
+    def __init__(self, fail_first: int):
+        self.fail_first = fail_first
+        self.delay_seconds = 0.0
+        # event id -> statuses answered, in order
+        self.answers: Dict[int, List[int]] = {}
+        super().__init__(('127.0.0.1', 0), StubSinkHandler)
+
+
+class StubSinkHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        event = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.delay_seconds)
+        answers = self.server.answers.setdefault(event['id'], [])
+        status = 500 if len(answers) < self.server.fail_first else 200
+        answers.append(status)
+        self.send_response(status)
+        self.end_headers()
+    
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def check_order_events(database_url: str, sink_failures: int) -> List[str]:
+    '''
+    Drain the order-events outbox in-process against a stub sink that fails each event
+    sink_failures times. After every failure the event is pending again with attempts
+    counted and available_at retry_delay(attempts) ahead, and a drain before then
+    claims nothing; it is then delivered exactly once. A drain that passes its
+    deadline releases the undelivered events without using up an attempt. Events go
+    to a scratch schema, dropped at the end
+    '''
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {ORDER_EVENTS_SCHEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {ORDER_EVENTS_SCHEMA}')
+        cursor.execute(f'CREATE TABLE {ORDER_EVENTS_SCHEMA}.order_events (LIKE public.order_events INCLUDING ALL)')
+        cursor.execute(f'SET search_path = {ORDER_EVENTS_SCHEMA}, public')
+    
+    sink = StubSink(sink_failures)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    os.environ['DATABASE_URL'] = make_dsn(database_url, options=f'-c search_path={ORDER_EVENTS_SCHEMA},public')
+    os.environ['ORDER_EVENTS_WEBHOOK_URL'] = f'http://127.0.0.1:{sink.server_port}/'
+    handler = load_function(os.path.join(BACKEND_DIR, 'order-events'))
+    worker = inspect.unwrap(handler).__globals__
+    
+    def drain() -> Dict[str, int]:
+        # A timer trigger: no httpMethod, no admin token
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            response = handler({}, SimpleNamespace(request_id='stress-test'))
+        if response['statusCode'] != 200:
+            raise SystemExit(f"order-events returned {response['statusCode']}: {response['body']}")
+        return json.loads(response['body'])
+    
+    def add_events(count: int) -> List[int]:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO order_events (order_id, event_type, payload)
+                SELECT g, 'order.created', json_build_object('orderId', g) FROM generate_series(1, %s) g
+                RETURNING id
+            ''', (count,))
+            return sorted(row[0] for row in cursor.fetchall())
+    
+    def event_row(event_id: int) -> Tuple[str, int, Optional[float], Any]:
+        '''status, attempts, seconds until available_at, locked_at'''
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT status, attempts, EXTRACT(EPOCH FROM available_at - CURRENT_TIMESTAMP::timestamp)::float8,
+                       locked_at
+                FROM order_events WHERE id = %s
+            ''', (event_id,))
+            return cursor.fetchone()
+    
+    failures = []
+    try:
+        # Retries with backoff, then exactly one delivery
+        [event_id] = add_events(1)
+        for attempt in range(1, sink_failures + 1):
+            result = drain()
+            status, attempts, available_in, _ = event_row(event_id)
+            delay = worker['retry_delay'](attempt)
+            print(f'attempt {attempt}: {result}, event {status}, attempts {attempts}, '
+                  f'available in {available_in:.0f}s (retry_delay {delay}s)')
+            if result['failed'] != 1 or status != 'pending' or attempts != attempt:
+                failures.append(f'attempt {attempt}: {result}, event {status} with {attempts} attempts')
+            if not delay - 5 < available_in <= delay:
+                failures.append(f'attempt {attempt}: available in {available_in:.1f}s, retry_delay is {delay}s')
+            if drain()['claimed'] != 0:
+                failures.append(f'attempt {attempt}: the event was claimed again before its backoff ended')
+            with conn.cursor() as cursor:
+                # Skip the wait
+                cursor.execute('UPDATE order_events SET available_at = CURRENT_TIMESTAMP WHERE id = %s', (event_id,))
+        
+        result = drain()
+        status, attempts, _, _ = event_row(event_id)
+        print(f'attempt {sink_failures + 1}: {result}, event {status}, attempts {attempts}')
+        drain()
+        answers = sink.answers.get(event_id, [])
+        if status != 'done' or answers.count(200) != 1 or len(answers) != sink_failures + 1:
+            failures.append(f'event {status} after sink answers {answers}, expected one delivery '
+                            f'after {sink_failures} failures')
+        
+        # A drain that passes its deadline during the first delivery releases the rest
+        sink.fail_first = 0
+        sink.delay_seconds = 1.5
+        claim_timeout = worker['CLAIM_TIMEOUT_SECONDS']
+        worker['CLAIM_TIMEOUT_SECONDS'] = worker['WEBHOOK_TIMEOUT_SECONDS'] + worker['CLAIM_MARGIN_SECONDS'] + 1
+        event_ids = add_events(3)
+        try:
+            result = drain()
+        finally:
+            worker['CLAIM_TIMEOUT_SECONDS'] = claim_timeout
+            sink.delay_seconds = 0.0
+        print(f'drain past its deadline: {result}')
+        if result != {'claimed': 3, 'delivered': 1, 'failed': 0, 'released': 2}:
+            failures.append(f'drain past its deadline returned {result}, expected 1 delivered and 2 released')
+        for released_id in event_ids[1:]:
+            status, attempts, _, locked_at = event_row(released_id)
+            if status != 'pending' or attempts != 0 or locked_at is not None:
+                failures.append(f'released event {released_id}: {status}, {attempts} attempts, locked at {locked_at}')
+        
+        result = drain()
+        print(f'next drain: {result}')
+        for delivered_id in event_ids:
+            answers = sink.answers.get(delivered_id, [])
+            if answers != [200] or event_row(delivered_id)[0] != 'done':
+                failures.append(f'event {delivered_id}: sink answers {answers}, expected exactly one delivery')
+    finally:
+        sink.shutdown()
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {ORDER_EVENTS_SCHEMA} CASCADE')
+        conn.close()
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Concurrency checks for the backend functions')
+    parser.add_argument('check', choices=[
+        'connections', 'checkouts', 'hot-sku', 'export-memory', 'suggest', 'etags', 'similarity', 'orders-listing',
+        'order-events'
+    ])
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='workers of local_server.py')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=200, help='stock of the perfume in hot-sku')
+    parser.add_argument('--format', default='csv', choices=['csv', 'ndjson'])
+    parser.add_argument('--max-rss-mb', type=float, default=64)
+    parser.add_argument('--max-ms', type=float, default=10, help='p95 latency limit of suggest')
+    parser.add_argument('--sizes', help='catalog sizes of similarity (default 10000,50000,100000) '
+                                        'or order counts of orders-listing (default 1000,10000,100000)')
+    parser.add_argument('--max-save-ms', type=float, default=250, help='single-perfume save p50 limit of similarity, in ms')
+    parser.add_argument('--sink-failures', type=int, default=3, help='failed deliveries per event in order-events')
+    args = parser.parse_args()
+    
+    if not args.database_url:
+        parser.error('DATABASE_URL or --database-url is required')
+    
+    checks: Dict[str, Callable[[], List[str]]] = {
+        'connections': lambda: login(args.base_url) or check_connections(
+            args.base_url, args.database_url, args.workers, args.requests, args.concurrency
+        ),
+        'checkouts': lambda: login(args.base_url) or check_checkouts(
+            args.base_url, args.database_url, load_perfume_ids(args.database_url), args.requests, args.concurrency
+        ),
+        'hot-sku': lambda: login(args.base_url) or check_hot_sku(
+            args.base_url, args.database_url, load_perfume_ids(args.database_url)[0], args.stock,
+            args.requests, args.concurrency
+        ),
+        'export-memory': lambda: check_export_memory(args.database_url, args.format, args.max_rss_mb),
+        'suggest': lambda: check_suggest_latency(args.database_url, args.requests, args.max_ms),
+        'etags': lambda: check_etags(args.database_url),
+        'similarity': lambda: check_similarity_cost(
+            args.database_url, [int(size) for size in (args.sizes or '10000,50000,100000').split(',')], args.max_save_ms
+        ),
+        'orders-listing': lambda: check_orders_listing(
+            args.database_url, [int(size) for size in (args.sizes or '1000,10000,100000').split(',')]
+        ),
+        'order-events': lambda: check_order_events(args.database_url, args.sink_failures),
+    }
+    failures = checks[args.check]()
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3 @@
+-- Indexes backing catalog filters of the perfumes endpoint
+CREATE INDEX IF NOT EXISTS idx_perfumes_notes ON perfumes USING GIN (notes);
+CREATE INDEX IF NOT EXISTS idx_perfumes_concentration ON perfumes(concentration);
@@ -0,0 +1,2 @@
+-- Natural key used by bulk catalog import upserts
+CREATE UNIQUE INDEX IF NOT EXISTS idx_perfumes_brand_name ON perfumes(brand, name);
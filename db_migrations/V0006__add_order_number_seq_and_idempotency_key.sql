@@ -0,0 +1,5 @@
+-- Collision-free order numbers and idempotent order submission
+CREATE SEQUENCE IF NOT EXISTS order_number_seq;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(100);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders(idempotency_key);
@@ -0,0 +1,32 @@
+-- Daily rollups of orders for the analytics dashboard, maintained incrementally
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status)
+);
+
+CREATE TABLE IF NOT EXISTS daily_perfume_sales (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    perfume_id INTEGER NOT NULL,
+    perfume_name VARCHAR(255) NOT NULL,
+    perfume_brand VARCHAR(255) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status, perfume_id)
+);
+
+-- Backfill from existing orders
+INSERT INTO daily_sales (day, status, orders_count, revenue)
+SELECT created_at::date, COALESCE(status, 'pending'), COUNT(*), SUM(total_amount)
+FROM orders
+GROUP BY 1, 2;
+
+INSERT INTO daily_perfume_sales (day, status, perfume_id, perfume_name, perfume_brand, quantity, revenue)
+SELECT o.created_at::date, COALESCE(o.status, 'pending'), i.perfume_id,
+       MAX(i.perfume_name), MAX(i.perfume_brand), SUM(i.quantity), SUM(i.quantity * i.price)
+FROM order_items i
+JOIN orders o ON o.id = i.order_id
+GROUP BY 1, 2, 3;
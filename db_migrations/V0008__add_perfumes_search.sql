@@ -0,0 +1,25 @@
+-- Full-text and typo-tolerant search over name, brand and notes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- array_to_string is only STABLE, so wrap it for use in generated columns and indexes
+CREATE OR REPLACE FUNCTION perfume_search_text(name TEXT, brand TEXT, notes TEXT[])
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT lower(coalesce(name, '') || ' ' || coalesce(brand, '') || ' ' || coalesce(array_to_string(notes, ' '), ''))
+$$;
+
+ALTER TABLE perfumes ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(brand, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(brand, '')), 'A') ||
+    setweight(to_tsvector('russian', perfume_search_text('', '', notes)), 'B') ||
+    setweight(to_tsvector('simple', perfume_search_text('', '', notes)), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_perfumes_search_vector ON perfumes USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_perfumes_search_trgm ON perfumes USING GIN (perfume_search_text(name, brand, notes) gin_trgm_ops);
+
+-- Prefix autocomplete on name and brand
+CREATE INDEX IF NOT EXISTS idx_perfumes_name_prefix ON perfumes (lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_perfumes_brand_prefix ON perfumes (lower(brand) text_pattern_ops);
@@ -0,0 +1,11 @@
+-- Precomputed "similar perfumes" recommendations, maintained by perfumes-admin
+CREATE TABLE IF NOT EXISTS perfume_similar (
+    perfume_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    rank SMALLINT NOT NULL,
+    PRIMARY KEY (perfume_id, similar_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_perfume_similar_rank ON perfume_similar(perfume_id, rank);
+CREATE INDEX IF NOT EXISTS idx_perfume_similar_similar_id ON perfume_similar(similar_id);
@@ -0,0 +1,5 @@
+-- Stock quantity per perfume; NULL means stock is not tracked for the perfume
+ALTER TABLE perfumes ADD COLUMN IF NOT EXISTS stock INTEGER CHECK (stock >= 0);
+
+-- Whether the order still holds reserved stock that must be returned on cancel/delete
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS stock_reserved BOOLEAN NOT NULL DEFAULT false;
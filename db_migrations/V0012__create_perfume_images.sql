@@ -0,0 +1,9 @@
+-- Responsive image variants, one row per distinct source image (sha256 of its bytes)
+CREATE TABLE IF NOT EXISTS perfume_images (
+    hash CHAR(64) PRIMARY KEY,
+    variants JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Processed image of the perfume; NULL until perfumes-admin has rendered the current image
+ALTER TABLE perfumes ADD COLUMN IF NOT EXISTS image_hash CHAR(64) REFERENCES perfume_images(hash);
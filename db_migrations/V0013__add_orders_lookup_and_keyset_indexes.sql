@@ -0,0 +1,25 @@
+-- Keyset listing ORDER BY created_at, id (both directions), alone and per status
+CREATE INDEX IF NOT EXISTS idx_orders_created_at_id ON orders(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_at_id ON orders(status, created_at, id);
+DROP INDEX IF EXISTS idx_orders_created_at;
+DROP INDEX IF EXISTS idx_orders_status;
+
+-- Customer lookups in the admin listing, newest first
+CREATE INDEX IF NOT EXISTS idx_orders_phone_created_at_id ON orders(customer_phone, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_orders_email_created_at_id ON orders(lower(customer_email), created_at, id);
+
+-- Items by order, covering the stock release and rollup aggregates
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id_covering ON order_items(order_id) INCLUDE (perfume_id, quantity, price);
+DROP INDEX IF EXISTS idx_order_items_order_id;
+
+-- Items by perfume, also serving the foreign key check when a perfume is deleted
+CREATE INDEX IF NOT EXISTS idx_order_items_perfume_id ON order_items(perfume_id);
+
+-- Ordered perfumes cannot be deleted; NOT VALID skips items of perfumes deleted before this migration
+ALTER TABLE order_items
+    ADD CONSTRAINT fk_order_items_perfume FOREIGN KEY (perfume_id) REFERENCES perfumes(id) NOT VALID;
+
+-- Catalog keyset pagination by price and by name
+CREATE INDEX IF NOT EXISTS idx_perfumes_price_id ON perfumes(price, id);
+CREATE INDEX IF NOT EXISTS idx_perfumes_name_id ON perfumes(name, id);
+DROP INDEX IF EXISTS idx_perfumes_price;
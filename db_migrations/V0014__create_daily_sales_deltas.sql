@@ -0,0 +1,18 @@
+-- Append-only changes to the daily rollups: order writes only insert here, so concurrent
+-- checkouts never wait on a shared rollup row; analytics folds them into the rollups
+CREATE TABLE IF NOT EXISTS daily_sales_deltas (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    orders_count INTEGER NOT NULL,
+    revenue DECIMAL(14, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_perfume_sales_deltas (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    perfume_id INTEGER NOT NULL,
+    perfume_name VARCHAR(255) NOT NULL,
+    perfume_brand VARCHAR(255) NOT NULL,
+    quantity INTEGER NOT NULL,
+    revenue DECIMAL(14, 2) NOT NULL
+);
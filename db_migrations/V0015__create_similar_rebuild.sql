@@ -0,0 +1,14 @@
+-- Progress of the batched full rebuild of perfume_similar: perfumes with ids above
+-- next_after are still to be re-scored; NULL when no rebuild is queued
+CREATE TABLE IF NOT EXISTS similar_rebuild (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    next_after INTEGER,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
+
+INSERT INTO similar_rebuild (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- Weakest neighbour of every perfume (its rank-K row) in one index-only scan, read on
+-- each incremental update to find the perfumes a saved perfume now enters
+CREATE INDEX IF NOT EXISTS idx_perfume_similar_weakest ON perfume_similar(rank) INCLUDE (perfume_id, score);
@@ -4,6 +4,9 @@ import { Card, CardContent } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Perfume } from '@/types/perfume';
 
+// Catalog grid: one column on phones, two from sm, three next to the filters from lg
+const CARD_IMAGE_SIZES = '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw';
+
 interface PerfumeCardProps {
   perfume: Perfume;
   onAddToCart: (id: number) => void;
@@ -32,11 +35,31 @@ const PerfumeCard = ({
   return (
     <Card className="group hover:shadow-2xl transition-all duration-500 overflow-hidden border-2 hover:border-accent/30">
       <div className="aspect-square bg-gradient-to-br from-gray-800/40 to-gray-900/20 relative overflow-hidden cursor-pointer" onClick={() => onQuickView(perfume)}>
-        <img 
-          src={perfume.image} 
-          alt={perfume.name}
-          className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
-        />
+        {perfume.imageVariants ? (
+          <picture>
+            {perfume.imageVariants.srcset.avif && (
+              <source type="image/avif" srcSet={perfume.imageVariants.srcset.avif} sizes={CARD_IMAGE_SIZES} />
+            )}
+            <source type="image/webp" srcSet={perfume.imageVariants.srcset.webp} sizes={CARD_IMAGE_SIZES} />
+            <img 
+              src={perfume.imageVariants.src} 
+              alt={perfume.name}
+              width={perfume.imageVariants.width}
+              height={perfume.imageVariants.height}
+              loading="lazy"
+              decoding="async"
+              style={{ backgroundImage: `url(${perfume.imageVariants.placeholder})`, backgroundSize: 'cover' }}
+              className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
+            />
+          </picture>
+        ) : (
+          <img 
+            src={perfume.image} 
+            alt={perfume.name}
+            loading="lazy"
+            className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
+          />
+        )}
         <div className="absolute inset-0 bg-black/0 group-hover:bg-black/10 transition-colors flex items-center justify-center opacity-0 group-hover:opacity-100">
           <div className="bg-white/90 backdrop-blur-sm rounded-full p-3">
             <Icon name="Eye" size={24} className="text-primary" />
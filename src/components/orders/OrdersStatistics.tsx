@@ -1,17 +1,18 @@
 import { Card, CardContent } from '@/components/ui/card';
-import { Order } from './OrdersTypes';
+import { OrdersAnalytics } from './OrdersTypes';
 
 interface OrdersStatisticsProps {
-  orders: Order[];
+  analytics: OrdersAnalytics | null;
 }
 
-const OrdersStatistics = ({ orders }: OrdersStatisticsProps) => {
-  const newOrders = orders.filter(o => o.status === 'Новый').length;
-  const processingOrders = orders.filter(o => o.status === 'В обработке').length;
-  const deliveryOrders = orders.filter(o => o.status === 'Доставляется').length;
-  const completedOrders = orders.filter(o => o.status === 'Завершён').length;
-  const totalRevenue = orders.filter(o => o.status === 'Завершён').reduce((sum, o) => sum + o.totalAmount, 0);
-  const averageOrder = orders.length > 0 ? Math.round(orders.reduce((sum, o) => sum + o.totalAmount, 0) / orders.length) : 0;
+const OrdersStatistics = ({ analytics }: OrdersStatisticsProps) => {
+  const byStatus = analytics?.ordersByStatus ?? {};
+  const countOf = (status: string) => byStatus[status]?.orders ?? 0;
+  const newOrders = countOf('Новый') + countOf('pending');
+  const processingOrders = countOf('В обработке');
+  const deliveryOrders = countOf('Доставляется');
+  const completedOrders = countOf('Завершён');
+  const totalRevenue = byStatus['Завершён']?.revenue ?? 0;
   
   return (
     <div className="mb-6">
@@ -19,7 +20,7 @@ const OrdersStatistics = ({ orders }: OrdersStatisticsProps) => {
       <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-6 gap-4 mb-4">
         <Card>
           <CardContent className="pt-6">
-            <div className="text-2xl font-bold">{orders.length}</div>
+            <div className="text-2xl font-bold">{analytics?.totalOrders ?? 0}</div>
             <div className="text-sm text-muted-foreground">Всего заказов</div>
           </CardContent>
         </Card>
@@ -50,7 +51,7 @@ const OrdersStatistics = ({ orders }: OrdersStatisticsProps) => {
         <Card>
           <CardContent className="pt-6">
             <div className="text-2xl font-bold">
-              {orders.reduce((sum, o) => sum + o.items.reduce((s, i) => s + i.quantity, 0), 0)}
+              {analytics?.totalItems ?? 0}
             </div>
             <div className="text-sm text-muted-foreground">Товаров</div>
           </CardContent>
@@ -60,7 +61,7 @@ const OrdersStatistics = ({ orders }: OrdersStatisticsProps) => {
         <Card>
           <CardContent className="pt-6">
             <div className="text-2xl font-bold">
-              {orders.reduce((sum, o) => sum + o.totalAmount, 0).toLocaleString()} ₽
+              {(analytics?.totalAmount ?? 0).toLocaleString()} ₽
             </div>
             <div className="text-sm text-muted-foreground">Общая сумма всех заказов</div>
           </CardContent>
@@ -24,3 +24,12 @@ export interface Order {
   createdAt: string;
   items: OrderItem[];
 }
+
+export interface OrdersAnalytics {
+  revenueByDay: { day: string; orders: number; revenue: number }[];
+  ordersByStatus: Record<string, { orders: number; revenue: number }>;
+  topPerfumes: { perfumeId: number; perfumeName: string; perfumeBrand: string; quantity: number; revenue: number }[];
+  totalOrders: number;
+  totalAmount: number;
+  totalItems: number;
+}
@@ -0,0 +1,53 @@
+const AUTH_API_URL = 'https://functions.poehali.dev/681cc67d-089a-4c22-b1f0-80b99aec3e56';
+const SESSION_KEY = 'adminSession';
+
+interface AdminSession {
+  token: string;
+  expiresAt: number;
+}
+
+export class RateLimitError extends Error {}
+
+export const loginAdmin = async (password: string): Promise<string | null> => {
+  const response = await fetch(AUTH_API_URL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ password })
+  });
+
+  if (response.status === 429) {
+    throw new RateLimitError('Too many attempts');
+  }
+
+  const data = await response.json();
+  if (!response.ok || !data.success) {
+    return null;
+  }
+
+  localStorage.setItem(SESSION_KEY, JSON.stringify({ token: data.token, expiresAt: data.expiresAt }));
+  return data.token;
+};
+
+export const getAdminToken = (): string | null => {
+  const saved = localStorage.getItem(SESSION_KEY);
+  if (!saved) return null;
+
+  try {
+    const session: AdminSession = JSON.parse(saved);
+    if (session.expiresAt * 1000 > Date.now()) {
+      return session.token;
+    }
+  } catch (error) {
+    console.error('Invalid admin session:', error);
+  }
+  localStorage.removeItem(SESSION_KEY);
+  return null;
+};
+
+export const clearAdminSession = () => {
+  localStorage.removeItem(SESSION_KEY);
+};
+
+export const adminHeaders = (token: string | null): Record<string, string> => (
+  token ? { Authorization: `Bearer ${token}` } : {}
+);
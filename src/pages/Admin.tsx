@@ -5,10 +5,10 @@ import * as XLSX from 'xlsx';
 import { AdminLogin } from '@/components/admin/AdminLogin';
 import { AdminHeader } from '@/components/admin/AdminHeader';
 import { PerfumeCard } from '@/components/admin/PerfumeCard';
+import { RateLimitError, adminHeaders, clearAdminSession, getAdminToken, loginAdmin } from '@/lib/adminSession';
 
 const API_URL = 'https://functions.poehali.dev/d898a0d3-06c5-4b2d-a26c-c3b447db586c';
 const ADMIN_API_URL = 'https://functions.poehali.dev/9ac7bf2c-5f68-4762-89d0-f4b5392107f3';
-const AUTH_API_URL = 'https://functions.poehali.dev/681cc67d-089a-4c22-b1f0-80b99aec3e56';
 
 const Admin = () => {
   const [perfumes, setPerfumes] = useState<Perfume[]>([]);
@@ -16,6 +16,7 @@ const Admin = () => {
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [editingPerfume, setEditingPerfume] = useState<Perfume | null>(null);
   const [isAuthenticated, setIsAuthenticated] = useState(false);
+  const [token, setToken] = useState<string | null>(null);
   const [isImporting, setIsImporting] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
   const [filterCategory, setFilterCategory] = useState<string>('Все');
@@ -25,8 +26,9 @@ const Admin = () => {
   const { toast } = useToast();
 
   useEffect(() => {
-    const savedAuth = localStorage.getItem('adminAuth');
-    if (savedAuth === 'true') {
+    const savedToken = getAdminToken();
+    if (savedToken) {
+      setToken(savedToken);
       setIsAuthenticated(true);
     }
   }, []);
@@ -79,11 +81,13 @@ const Admin = () => {
     try {
       const response = await fetch(ADMIN_API_URL, {
         method: editingPerfume ? 'PUT' : 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...adminHeaders(token) },
         body: JSON.stringify(perfumeData)
       });
 
-      if (response.ok) {
+      if (response.status === 401) {
+        handleLogout();
+      } else if (response.ok) {
         toast({
           title: 'Успех',
           description: editingPerfume ? 'Товар обновлен' : 'Товар добавлен'
@@ -106,10 +110,13 @@ const Admin = () => {
 
     try {
       const response = await fetch(`${ADMIN_API_URL}?id=${id}`, {
-        method: 'DELETE'
+        method: 'DELETE',
+        headers: adminHeaders(token)
       });
 
-      if (response.ok) {
+      if (response.status === 401) {
+        handleLogout();
+      } else if (response.ok) {
         toast({
           title: 'Успех',
           description: 'Товар удален'
@@ -180,17 +187,23 @@ const Admin = () => {
         availability: row['Наличие'] === 'Да' || row['availability'] === true || row['availability'] === 'true'
       }));
 
-      for (const perfume of perfumesData) {
-        await fetch(ADMIN_API_URL, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(perfume)
-        });
+      const response = await fetch(ADMIN_API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...adminHeaders(token) },
+        body: JSON.stringify(perfumesData)
+      });
+
+      if (!response.ok) {
+        throw new Error('Import failed');
       }
 
+      const report = await response.json();
+
       toast({
-        title: 'Успех',
-        description: `Добавлено ${perfumesData.length} товаров`
+        title: report.errors.length ? 'Импорт завершён с ошибками' : 'Успех',
+        description: `Добавлено ${report.inserted}, обновлено ${report.updated} товаров` +
+          (report.errors.length ? `. Ошибки в строках: ${report.errors.map((e: { row: number }) => e.row).join(', ')}` : ''),
+        variant: report.errors.length ? 'destructive' : 'default'
       });
 
       fetchPerfumes();
@@ -210,17 +223,11 @@ const Admin = () => {
 
   const handleLogin = async (password: string) => {
     try {
-      const response = await fetch(AUTH_API_URL, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ password })
-      });
-
-      const data = await response.json();
+      const newToken = await loginAdmin(password);
 
-      if (response.ok && data.success) {
+      if (newToken) {
+        setToken(newToken);
         setIsAuthenticated(true);
-        localStorage.setItem('adminAuth', 'true');
         toast({
           title: 'Успешный вход',
           description: 'Добро пожаловать в админ-панель'
@@ -235,7 +242,9 @@ const Admin = () => {
     } catch (error) {
       toast({
         title: 'Ошибка',
-        description: 'Не удалось подключиться',
+        description: error instanceof RateLimitError
+          ? 'Слишком много попыток входа. Попробуйте позже'
+          : 'Не удалось подключиться',
         variant: 'destructive'
       });
     }
@@ -265,7 +274,8 @@ const Admin = () => {
 
   const handleLogout = () => {
     setIsAuthenticated(false);
-    localStorage.removeItem('adminAuth');
+    setToken(null);
+    clearAdminSession();
     toast({
       title: 'Выход',
       description: 'Вы вышли из админ-панели'
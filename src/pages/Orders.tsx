@@ -5,36 +5,65 @@ import OrdersHeader from '@/components/orders/OrdersHeader';
 import OrdersStatistics from '@/components/orders/OrdersStatistics';
 import OrdersList from '@/components/orders/OrdersList';
 import OrderEditDialog from '@/components/orders/OrderEditDialog';
-import { Order } from '@/components/orders/OrdersTypes';
+import { Order, OrdersAnalytics } from '@/components/orders/OrdersTypes';
+import { RateLimitError, adminHeaders, clearAdminSession, getAdminToken, loginAdmin } from '@/lib/adminSession';
 
 const API_URL = 'https://functions.poehali.dev/fe8d5d8d-ffbc-4b6e-947f-0842449d171d';
+const PAGE_SIZE = 50;
+const SEARCH_DEBOUNCE_MS = 400;
+const PHONE_PATTERN = /^\+?[\d\s()-]+$/;
+const EMAIL_PATTERN = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
+
+// A complete phone or email goes to the server's exact-match filters and covers all
+// orders; names and partial input only filter the pages already loaded
+const serverSearchParams = (query: string): Record<string, string> | null => {
+  const value = query.trim();
+  if (EMAIL_PATTERN.test(value)) return { email: value };
+  if (PHONE_PATTERN.test(value) && value.replace(/\D/g, '').length >= 10) return { phone: value };
+  return null;
+};
 
 const Orders = () => {
   const [password, setPassword] = useState('');
+  const [token, setToken] = useState<string | null>(null);
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [orders, setOrders] = useState<Order[]>([]);
   const [loading, setLoading] = useState(false);
   const [editingOrder, setEditingOrder] = useState<Order | null>(null);
   const [isEditDialogOpen, setIsEditDialogOpen] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
+  const [serverSearch, setServerSearch] = useState('');
   const [filterStatus, setFilterStatus] = useState<string>('Все');
   const [sortBy, setSortBy] = useState<string>('date-desc');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [analytics, setAnalytics] = useState<OrdersAnalytics | null>(null);
   const { toast } = useToast();
+  const serverSort = sortBy === 'date-asc' ? 'date-asc' : 'date-desc';
+  // Name searches do not change the server query, so typing them does not refetch
+  const serverFilter = JSON.stringify(serverSearchParams(serverSearch));
+
+  const fetchOrdersPage = (adminToken: string, cursor?: string | null) => {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    if (filterStatus !== 'Все') params.set('status', filterStatus);
+    Object.entries(serverSearchParams(serverSearch) ?? {}).forEach(([key, value]) => params.set(key, value));
+    params.set('sort', serverSort);
+    if (cursor) params.set('cursor', cursor);
+
+    return fetch(`${API_URL}?${params.toString()}`, {
+      headers: adminHeaders(adminToken)
+    });
+  };
 
   const handleLogin = async () => {
     setLoading(true);
     try {
-      const response = await fetch(API_URL, {
-        headers: {
-          'X-Admin-Password': password
-        }
-      });
+      const newToken = await loginAdmin(password);
 
-      if (response.ok) {
-        const data = await response.json();
-        setOrders(data.orders);
+      if (newToken) {
+        setToken(newToken);
+        setPassword('');
         setIsAuthenticated(true);
-        localStorage.setItem('ordersAdminPassword', password);
       } else {
         toast({
           title: 'Ошибка',
@@ -45,7 +74,9 @@ const Orders = () => {
     } catch (error) {
       toast({
         title: 'Ошибка',
-        description: 'Не удалось подключиться к серверу',
+        description: error instanceof RateLimitError
+          ? 'Слишком много попыток входа. Попробуйте позже'
+          : 'Не удалось подключиться к серверу',
         variant: 'destructive'
       });
     } finally {
@@ -53,32 +84,80 @@ const Orders = () => {
     }
   };
 
-  const loadOrders = async (savedPassword: string) => {
+  const loadOrders = async (adminToken: string) => {
     try {
-      const response = await fetch(API_URL, {
-        headers: {
-          'X-Admin-Password': savedPassword
-        }
+      const response = await fetchOrdersPage(adminToken);
+
+      if (response.status === 401) {
+        handleLogout();
+      } else if (response.ok) {
+        const data = await response.json();
+        setOrders(data.orders);
+        setNextCursor(data.nextCursor);
+      }
+    } catch (error) {
+      console.error('Failed to load orders:', error);
+    }
+  };
+
+  const loadAnalytics = async (adminToken: string) => {
+    try {
+      const response = await fetch(`${API_URL}?action=analytics`, {
+        headers: adminHeaders(adminToken)
       });
 
+      if (response.ok) {
+        setAnalytics(await response.json());
+      }
+    } catch (error) {
+      console.error('Failed to load analytics:', error);
+    }
+  };
+
+  const loadMoreOrders = async () => {
+    if (!nextCursor || !token) return;
+
+    setLoadingMore(true);
+    try {
+      const response = await fetchOrdersPage(token, nextCursor);
+
       if (response.ok) {
         const data = await response.json();
-        setOrders(data.orders);
+        setOrders(prev => [...prev, ...data.orders]);
+        setNextCursor(data.nextCursor);
       }
     } catch (error) {
       console.error('Failed to load orders:', error);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
   useEffect(() => {
-    const savedPassword = localStorage.getItem('ordersAdminPassword');
-    if (savedPassword) {
-      setPassword(savedPassword);
+    const savedToken = getAdminToken();
+    if (savedToken) {
+      setToken(savedToken);
       setIsAuthenticated(true);
-      loadOrders(savedPassword);
     }
   }, []);
 
+  useEffect(() => {
+    const timeout = setTimeout(() => setServerSearch(searchQuery), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timeout);
+  }, [searchQuery]);
+
+  useEffect(() => {
+    if (isAuthenticated && token) {
+      loadOrders(token);
+    }
+  }, [isAuthenticated, filterStatus, serverSort, serverFilter]);
+
+  useEffect(() => {
+    if (isAuthenticated && token) {
+      loadAnalytics(token);
+    }
+  }, [isAuthenticated]);
+
   const filteredOrders = useMemo(() => {
     return orders
       .filter(order => {
@@ -98,11 +177,17 @@ const Orders = () => {
       });
   }, [orders, searchQuery, filterStatus, sortBy]);
 
+  const coversLoadedOnly = nextCursor !== null && (
+    (searchQuery.trim() !== '' && !serverSearchParams(searchQuery)) || sortBy.startsWith('total')
+  );
+
   const handleLogout = () => {
     setIsAuthenticated(false);
-    setPassword('');
+    setToken(null);
     setOrders([]);
-    localStorage.removeItem('ordersAdminPassword');
+    setNextCursor(null);
+    setAnalytics(null);
+    clearAdminSession();
   };
 
   const handleStatusChange = async (orderId: number, newStatus: string) => {
@@ -111,13 +196,14 @@ const Orders = () => {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
-          'X-Admin-Password': password
+          ...adminHeaders(token)
         },
         body: JSON.stringify({ orderId, status: newStatus })
       });
 
       if (response.ok) {
         setOrders(orders.map(o => o.id === orderId ? { ...o, status: newStatus } : o));
+        if (token) loadAnalytics(token);
         toast({
           title: 'Статус обновлён',
           description: 'Статус заказа успешно изменён'
@@ -146,13 +232,14 @@ const Orders = () => {
         method: 'DELETE',
         headers: {
           'Content-Type': 'application/json',
-          'X-Admin-Password': password
+          ...adminHeaders(token)
         },
         body: JSON.stringify({ orderId })
       });
 
       if (response.ok) {
         setOrders(orders.filter(o => o.id !== orderId));
+        if (token) loadAnalytics(token);
         toast({
           title: 'Заказ удалён',
           description: 'Заказ успешно удалён из базы данных'
@@ -186,7 +273,7 @@ const Orders = () => {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
-          'X-Admin-Password': password
+          ...adminHeaders(token)
         },
         body: JSON.stringify({
           orderId: editingOrder.id,
@@ -236,17 +323,21 @@ const Orders = () => {
   return (
     <div className="min-h-screen bg-background">
       <OrdersHeader
-        onRefresh={() => loadOrders(password)}
+        onRefresh={() => {
+          if (!token) return;
+          loadOrders(token);
+          loadAnalytics(token);
+        }}
         onLogout={handleLogout}
       />
 
       <main className="container mx-auto px-4 py-8">
-        <OrdersStatistics orders={orders} />
+        <OrdersStatistics analytics={analytics} />
         
         <div className="mb-6 grid grid-cols-1 md:grid-cols-3 gap-4">
           <input
             type="text"
-            placeholder="Поиск по имени, телефону, email..."
+            placeholder="Телефон или email (все заказы), имя (загруженные)..."
             value={searchQuery}
             onChange={(e) => setSearchQuery(e.target.value)}
             className="px-4 py-2 border rounded-md"
@@ -276,7 +367,12 @@ const Orders = () => {
         </div>
 
         <div className="mb-4 text-muted-foreground">
-          Найдено заказов: <span className="font-semibold text-foreground">{filteredOrders.length}</span> из {orders.length}
+          Найдено заказов: <span className="font-semibold text-foreground">{filteredOrders.length}</span> из {orders.length}{nextCursor ? '+' : ''}
+          {coversLoadedOnly && (
+            <span className="block text-sm">
+              Поиск по имени или части номера и сортировка по сумме — только среди загруженных заказов
+            </span>
+          )}
         </div>
         
         <OrdersList
@@ -285,6 +381,18 @@ const Orders = () => {
           onEdit={handleEditOrder}
           onDelete={handleDeleteOrder}
         />
+
+        {nextCursor && (
+          <div className="mt-6 text-center">
+            <button
+              onClick={loadMoreOrders}
+              disabled={loadingMore}
+              className="px-6 py-2 border rounded-md hover:bg-muted disabled:opacity-50"
+            >
+              {loadingMore ? 'Загрузка...' : 'Загрузить ещё'}
+            </button>
+          </div>
+        )}
       </main>
 
       <OrderEditDialog
@@ -7,6 +7,17 @@ export interface Review {
   helpful: number;
 }
 
+export interface ImageVariants {
+  src: string;
+  width: number;
+  height: number;
+  placeholder: string;
+  srcset: {
+    avif?: string;
+    webp: string;
+  };
+}
+
 export interface Perfume {
   id: number;
   name: string;
@@ -16,6 +27,7 @@ export interface Perfume {
   volume: string;
   notes: string[];
   image: string;
+  imageVariants?: ImageVariants | null;
   concentration?: string;
   availability?: boolean;
   description?: string;